@@ -38,8 +38,8 @@ def setup():
     # TODO: add a way to require this plugin to run after *all* other
     # plugins to the extent possible instead of delaying 500ms
     def tabs_from_state():
-        for tab_class, state in states:
-            tab = tab_class.from_state(get_tab_manager(), state)
-            get_tab_manager().add_tab(tab)
+        get_tab_manager().add_tabs(
+            tab_class.from_state(get_tab_manager(), state)
+            for tab_class, state in states)
 
     get_main_window().after(500, tabs_from_state)
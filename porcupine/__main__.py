@@ -7,6 +7,7 @@ import platform
 from queue import Empty         # queue is a handy variable name
 import sys
 import tkinter
+import traceback
 
 import porcupine
 from porcupine import _ipc, _logs, _pluginloader, dirs, settings, tabs, utils
@@ -22,20 +23,35 @@ def _iter_queue(queue):
             break
 
 
-def open_file(path, content):
-    if (path, content) != (None, None):
-        tabmanager = porcupine.get_tab_manager()
-        tabmanager.add_tab(tabs.FileTab(tabmanager, content, path))
+# content is None for files that should be read from the path, that
+# way the file is loaded in a thread and its encoding is detected
+def open_files(paths_and_contents):
+    tabmanager = porcupine.get_tab_manager()
+    new_tabs = []
+    for path, content in paths_and_contents:
+        if path is None and content is None:
+            # see queue_opener()
+            continue
+        if content is not None:
+            new_tabs.append(tabs.FileTab(tabmanager, content, path))
+            continue
+
+        try:
+            new_tabs.append(tabs.FileTab.open_file(tabmanager, path))
+        except (UnicodeError, OSError) as e:
+            log.exception("opening '%s' failed", path)
+            utils.errordialog(type(e).__name__, "Opening failed!",
+                              traceback.format_exc())
+    tabmanager.add_tabs(new_tabs)
 
 
 def queue_opener(queue):
-    gonna_focus = False
-    for path, content in _iter_queue(queue):
-        # if porcupine is running and the user runs it again without any
-        # arguments, then path and content are None and we just focus
-        # the editor window
-        gonna_focus = True
-        open_file(path, content)
+    # if porcupine is running and the user runs it again without any
+    # arguments, then path and content are None and we just focus the
+    # editor window
+    queued = list(_iter_queue(queue))
+    gonna_focus = bool(queued)
+    open_files(queued)
 
     window = porcupine.get_main_window()
     if gonna_focus:
@@ -113,7 +129,7 @@ def main():
         help="find out where to install custom plugins")
     parser.add_argument(
         'files', metavar='FILES', action=_ExtendAction,
-        nargs=argparse.ZERO_OR_MORE, type=argparse.FileType("r"),
+        nargs=argparse.ZERO_OR_MORE,
         help="open these files when Porcupine starts, - means stdin")
     parser.add_argument(
         '-n', '--new-file', dest='files', action='append_const', const=None,
@@ -142,8 +158,8 @@ def main():
     args = parser.parse_args()
 
     filelist = []
-    for file in args.files:
-        if file is sys.stdin:
+    for path in args.files:
+        if path == '-':
             # don't close stdin so it's possible to do this:
             #
             #   $ porcupine - -
@@ -151,13 +167,13 @@ def main():
             #   ^D
             #   bla bla
             #   ^D
-            filelist.append((None, file.read()))
-        elif file is None:
+            filelist.append((None, sys.stdin.read()))
+        elif path is None:
             # -n or --new-file was used
             filelist.append((None, ''))
         else:
-            with file:
-                filelist.append((os.path.abspath(file.name), file.read()))
+            # the running porcupine may have a different working directory
+            filelist.append((os.path.abspath(path), None))
 
     try:
         if filelist:
@@ -191,8 +207,7 @@ def main():
         _pluginloader.load(shuffle=args.shuffle_plugins)
 
     # see queue_opener()
-    for path, content in filelist:
-        open_file(path, content)
+    open_files(filelist)
 
     # the user can change the settings only if we get here, so there's
     # no need to wrap the try/with/finally/whatever the whole thing
@@ -15,6 +15,12 @@ log = logging.getLogger(__name__)
 _main_window = None
 _tab_manager = None
 
+# see add_action()
+_actions = []
+_menu_items = {}        # {tabtypes: [(menu, index), ...]}
+_menu_states = {}       # {tabtypes: True or False}, True means enabled
+_current_tab_type = None
+
 
 def init(window):
     """Set up Porcupine.
@@ -54,6 +60,7 @@ def init(window):
     _tab_manager.pack(fill='both', expand=True)
     for binding, callback in _tab_manager.bindings:
         window.bind(binding, callback, add=True)
+    _tab_manager.bind('<<CurrentTabChanged>>', _update_menu_states, add=True)
 
     menubar.init()
     window['menu'] = menubar.get_menu(None)
@@ -68,7 +75,7 @@ def quit():
     This function makes sure that all tabs can be closed by calling
     their :meth:`can_be_closed() <porcupine.tabs.Tab.can_be_closed>`
     methods. If they can, all tabs are
-    :meth:`closed <porcupine.tabs.TabManager.close_tab>` and the main
+    :meth:`closed <porcupine.tabs.TabManager.close_tabs>` and the main
     window is destroyed.
     """
     for tab in _tab_manager.tabs:
@@ -77,9 +84,7 @@ def quit():
         # the tabs must not be closed here, otherwise some of them
         # are closed if not all tabs can be closed
 
-    # closing tabs removes them from the tabs list, that's why copying
-    for tab in _tab_manager.tabs.copy():
-        _tab_manager.close_tab(tab)
+    _tab_manager.close_tabs(_tab_manager.tabs)
     _main_window.destroy()
 
 
@@ -103,16 +108,16 @@ def _setup_actions():
         _tab_manager.add_tab(tabs.FileTab(_tab_manager))
 
     def open_files():
+        new_tabs = []
         for path in _dialogs.open_files():
             try:
-                tab = tabs.FileTab.open_file(_tab_manager, path)
+                new_tabs.append(tabs.FileTab.open_file(_tab_manager, path))
             except (UnicodeError, OSError) as e:
                 log.exception("opening '%s' failed", path)
                 utils.errordialog(type(e).__name__, "Opening failed!",
                                   traceback.format_exc())
-                continue
 
-            _tab_manager.add_tab(tab)
+        _tab_manager.add_tabs(new_tabs)
 
     def close_current_tab():
         if _tab_manager.current_tab.can_be_closed():
@@ -235,6 +240,51 @@ def _setup_actions():
         menubar.get_menu("Color Themes").add_radiobutton(**options)
 
 
+class Action:
+    """An action added with :func:`add_action`.
+
+    The attributes are the arguments of :func:`add_action`, so
+    *menupath* and both items of *keyboard_shortcut* may be None. The
+    ``None`` items of *tabtypes* have been replaced with
+    ``type(None)``. Don't set the attributes.
+
+    .. attribute:: callback
+    .. attribute:: menupath
+    .. attribute:: keyboard_shortcut
+    .. attribute:: tabtypes
+    """
+
+    __slots__ = ['callback', 'menupath', 'keyboard_shortcut', 'tabtypes']
+
+    def __init__(self, callback, menupath, keyboard_shortcut, tabtypes):
+        self.callback = callback
+        self.menupath = menupath
+        self.keyboard_shortcut = keyboard_shortcut
+        self.tabtypes = tabtypes
+
+    def __repr__(self):
+        return '<%s %r>' % (type(self).__name__, self.menupath)
+
+    def is_enabled(self):
+        """Check if the action can be used with the current tab.
+
+        This returns True if the :attr:`current tab
+        <porcupine.tabs.TabManager.current_tab>` is an instance of a
+        class in :attr:`tabtypes`.
+        """
+        return isinstance(_tab_manager.current_tab, self.tabtypes)
+
+    def run(self):
+        """Call :attr:`callback` if :meth:`is_enabled` returns True.
+
+        This returns True if the callback was called, and False if not.
+        """
+        if not self.is_enabled():
+            return False
+        self.callback()
+        return True
+
+
 def add_action(callback, menupath=None, keyboard_shortcut=(None, None),
                tabtypes=(None, tabs.Tab)):
     """Add a keyboard binding and/or a menu item.
@@ -253,6 +303,10 @@ def add_action(callback, menupath=None, keyboard_shortcut=(None, None),
     with. If you want to allow no tabs at all, add None to this list.
     The menuitem will be disabled and the binding won't do anything when
     the current tab is not of a compatible type.
+
+    An :class:`Action` object is returned.
+
+    .. seealso:: :func:`get_actions`
     """
     tabtypes = tuple((
         # isinstance(None, type(None)) is True
@@ -260,29 +314,69 @@ def add_action(callback, menupath=None, keyboard_shortcut=(None, None),
         for cls in tabtypes
     ))
     accelerator, binding = keyboard_shortcut
+    action = Action(callback, menupath, keyboard_shortcut, tabtypes)
+    _actions.append(action)
 
     if menupath is not None:
         menupath, menulabel = menupath.rsplit('/', 1)
         menu = menubar.get_menu(menupath)
         menu.add_command(label=menulabel, command=callback,
                          accelerator=accelerator)
-        menuindex = menu.index('end')
-
-        def tab_changed(event):
-            enable = isinstance(_tab_manager.current_tab, tabtypes)
-            menu.entryconfig(
-                menuindex, state=('normal' if enable else 'disabled'))
 
-        tab_changed(_tab_manager.current_tab)
-        _tab_manager.bind('<<CurrentTabChanged>>', tab_changed, add=True)
+        # menu items with the same tabtypes are enabled and disabled
+        # together by _update_menu_states()
+        enabled = action.is_enabled()
+        if _menu_states.setdefault(tabtypes, enabled) != enabled:
+            # this happens if the current tab changed but its type
+            # didn't, see _update_menu_states()
+            _update_menu_states(force=True)
+        menu.entryconfig('end', state=('normal' if enabled else 'disabled'))
+        _menu_items.setdefault(tabtypes, []).append(
+            (menu, menu.index('end')))
 
     if binding is not None:
         # TODO: check if it's already bound
         def bind_callback(event):
-            if isinstance(_tab_manager.current_tab, tabtypes):
-                callback()
+            if action.run():
                 # try to allow binding keys that are used for other
                 # things by default
                 return 'break'
+            return None
 
         _main_window.bind(binding, bind_callback)
+
+    return action
+
+
+def get_actions():
+    """Return a list of :class:`Action` objects.
+
+    The list contains an action for each :func:`add_action` call, in
+    the same order as the calls were made. This is useful for things
+    that let the user choose an action with the keyboard, for example::
+
+        for action in porcupine.get_actions():
+            if action.is_enabled() and action.menupath == 'File/Save':
+                action.run()
+    """
+    return _actions.copy()
+
+
+# this is bound to <<CurrentTabChanged>>, and it's the only thing that
+# enables and disables the menu items, so it doesn't need to do anything
+# when the type of the current tab stays the same
+def _update_menu_states(junk_event=None, *, force=False):
+    global _current_tab_type
+
+    tab_type = type(_tab_manager.current_tab)
+    if tab_type is _current_tab_type and not force:
+        return
+    _current_tab_type = tab_type
+
+    for tabtypes, items in _menu_items.items():
+        enabled = issubclass(tab_type, tabtypes)
+        if _menu_states[tabtypes] != enabled:
+            _menu_states[tabtypes] = enabled
+            for menu, index in items:
+                menu.entryconfig(
+                    index, state=('normal' if enabled else 'disabled'))
@@ -48,6 +48,7 @@ class FileType:
     .. attribute:: compile_command
     .. attribute:: run_command
     .. attribute:: lint_command
+    .. attribute:: langserver_command
 
         These attributes correspond to the values defined in
         ``filetypes.ini``. ``tabs2spaces`` is True or False, and the
@@ -57,7 +58,8 @@ class FileType:
 
     __slots__ = ('name', 'patterns', 'mimetypes', '_lexer_getter',
                  'tabs2spaces', 'indent_size', 'max_line_length',
-                 'compile_command', 'run_command', 'lint_command')
+                 'compile_command', 'run_command', 'lint_command',
+                 'langserver_command')
 
     def __init__(self, name, lexer_getter, patterns, mimetypes,
                  config_section):
@@ -72,6 +74,7 @@ class FileType:
         self.compile_command = config_section['compile_command']
         self.run_command = config_section['run_command']
         self.lint_command = config_section['lint_command']
+        self.langserver_command = config_section['langserver_command']
 
     def get_lexer(self):
         """Return a Pygments lexer object for files of this type."""
@@ -133,6 +136,7 @@ _DEFAULT_DEFAULTS = {
     'compile_command': '',
     'run_command': '',
     'lint_command': '',
+    'langserver_command': '',
 }
 
 
@@ -206,7 +210,7 @@ class _FiletypesDotIniLexer(pygments.lexer.RegexLexer):
         key_val_pair(r'tabs2spaces', r'yes|no'),
         key_val_pair(r'indent_size', r'[1-9][0-9]*'),        # positive int
         key_val_pair(r'max_line_length', r'0|[1-9][0-9]*'),  # non-negative int
-        key_val_pair(r'(?:compile|run|lint)_command', r'.*'),
+        key_val_pair(r'(?:compile|run|lint|langserver)_command', r'.*'),
         key_val_pair(r'.*?', r'.*?', pygments.token.Text, pygments.token.Text),
         [(r'.+?$', pygments.token.Text)],       # less red error tokens
     ))}
@@ -282,6 +286,7 @@ def _config2filetypes(config):
         validate('compile_command', None, command=True)
         validate('run_command', None, command=True)
         validate('lint_command', None, command=True)
+        validate('langserver_command', None, command=True)
 
     for name, *args in _get_pygments_lexers():
         # setdefault return value is useless, this is a small bug
@@ -303,6 +308,8 @@ _comments = '''\
 #   compile_command     see below
 #   run_command         see below
 #   lint_command        see below
+#   langserver_command  a program that speaks the Language Server Protocol,
+#                       e.g. pyls for Python, see the langserver plugin
 #
 # If any of these are not specified, the values in the DEFAULT section
 # will be used instead.
@@ -0,0 +1,225 @@
+"""An index of importable modules for completing import statements.
+
+Finding the modules that can be imported means looking at every
+directory in :data:`sys.path`, and jedi does that again whenever its
+cache is cold. This module does it once in a subprocess that runs with
+:data:`porcupine.utils.python_executable`, and the result is saved to a
+JSON file in Porcupine's cache directory. The file is rebuilt when the
+modification time of a directory in the interpreter's :data:`sys.path`
+changes, and that happens when packages are installed or removed.
+
+The subprocess runs this file as a script, so this file must not import
+anything from porcupine at the module level. This module is not a plugin
+because its name starts with ``_``.
+"""
+
+import ast
+import bisect
+import hashlib
+import json
+import logging
+import os
+import pkgutil
+import subprocess
+import sys
+import threading
+
+log = logging.getLogger(__name__)
+
+# bump this when the format of the JSON file changes
+_FORMAT_VERSION = 1
+
+# parsing huge generated files would take too long
+_MAX_FILE_SIZE = 1024 * 1024
+
+
+def _get_mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def _get_string(node):
+    # python 3.8 replaced ast.Str with ast.Constant
+    if type(node).__name__ in {'Str', 'Constant'}:
+        value = getattr(node, 'value', getattr(node, 's', None))
+        if isinstance(value, str):
+            return value
+    return None
+
+
+def _get_public_names(source):
+    tree = ast.parse(source)
+    names = set()
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.ClassDef)) or (
+                type(node).__name__ == 'AsyncFunctionDef'):
+            names.add(node.name)
+        elif isinstance(node, ast.Assign):
+            for target in node.targets:
+                if isinstance(target, ast.Name):
+                    if target.id == '__all__' and isinstance(
+                            node.value, (ast.List, ast.Tuple)):
+                        # __all__ wins if it's a literal
+                        return {_get_string(element)
+                                for element in node.value.elts} - {None}
+                    names.add(target.id)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)) and (
+                getattr(node, 'module', None) != '__future__'):
+            for alias in node.names:
+                name = alias.asname or alias.name.split('.')[0]
+                if name != '*':
+                    names.add(name)
+    return {name for name in names if not name.startswith('_')}
+
+
+def _get_module_names(module_name, path, lib_dynload):
+    if module_name in sys.builtin_module_names or (
+            path is not None and not path.endswith('.py') and
+            os.path.dirname(path) == lib_dynload):
+        # importing builtin and standard library C modules is safe and
+        # they don't have any source to parse
+        try:
+            return [name for name in dir(__import__(module_name))
+                    if not name.startswith('_')]
+        except Exception:
+            return []
+
+    if path is None or not path.endswith('.py'):
+        return []
+    try:
+        # e.g. packages with a compiled __init__ don't have __init__.py
+        if os.path.getsize(path) > _MAX_FILE_SIZE:
+            return []
+        with open(path, 'rb') as file:
+            return list(_get_public_names(file.read()))
+    except Exception:
+        # syntax errors, python 2 files and so on
+        return []
+
+
+def _build():
+    directories = [path for path in sys.path if path and os.path.isdir(path)]
+    lib_dynload = os.path.join(os.path.dirname(os.__file__), 'lib-dynload')
+
+    modules = {name: None for name in sys.builtin_module_names}
+    # iter_modules() yields each name once, from the first directory
+    # that has it, and that's also what import finds
+    for module_info in pkgutil.iter_modules(directories):
+        finder, name, is_package = module_info
+        path = getattr(finder, 'path', '')
+        if is_package:
+            path = os.path.join(path, name, '__init__.py')
+        else:
+            spec = finder.find_spec(name)
+            path = None if spec is None else spec.origin
+        modules[name] = path
+
+    return {
+        'version': _FORMAT_VERSION,
+        'mtimes': [[path, _get_mtime(path)] for path in sys.path if path],
+        'modules': {name: sorted(_get_module_names(name, path, lib_dynload))
+                    for name, path in modules.items()
+                    if not name.startswith('_')},
+    }
+
+
+def _get_matching(sorted_list, prefix):
+    start = bisect.bisect_left(sorted_list, prefix)
+    end = start
+    while end < len(sorted_list) and sorted_list[end].startswith(prefix):
+        end += 1
+    return sorted_list[start:end]
+
+
+class ImportIndex:
+    """The modules that *python_executable* can import.
+
+    The index is loaded or built in a thread when :meth:`start` is
+    called, and the ``complete_`` methods return None until it's ready.
+    """
+
+    def __init__(self, python_executable, cache_directory):
+        self._python = python_executable
+        executable_hash = hashlib.sha1(
+            python_executable.encode('utf-8')).hexdigest()
+        self._cache_file = os.path.join(
+            cache_directory, 'importindex-%s.json' % executable_hash)
+        # (sorted_module_names, {module_name: sorted_names}) or None
+        self._index = None
+
+    def start(self):
+        """Start loading the index from the cache or building it."""
+        threading.Thread(target=self._load, daemon=True).start()
+
+    def _read_cache(self):
+        try:
+            with open(self._cache_file, 'r', encoding='utf-8') as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return None
+
+        if data.get('version') != _FORMAT_VERSION:
+            return None
+        for path, mtime in data['mtimes']:
+            if _get_mtime(path) != mtime:
+                log.info("'%s' has changed, rebuilding the import index",
+                         path)
+                return None
+        return data
+
+    def _load(self):
+        data = self._read_cache()
+        if data is None:
+            try:
+                output = subprocess.check_output(
+                    [self._python, os.path.abspath(__file__)],
+                    stdin=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                data = json.loads(output.decode('utf-8'))
+            except (OSError, subprocess.CalledProcessError, ValueError):
+                log.exception("building the import index with %s failed",
+                              self._python)
+                return
+
+            # this file is also run as a script with an interpreter that
+            # may not have porcupine installed, see the docstring
+            from porcupine import utils
+
+            # other porcupines may be reading the file at the same time
+            try:
+                with utils.atomic_open(self._cache_file, 'w',
+                                       encoding='utf-8') as file:
+                    json.dump(data, file)
+            except OSError:
+                log.exception("cannot write '%s'", self._cache_file)
+
+        # this is assigned at once so that other threads never see a
+        # half-loaded index
+        self._index = (sorted(data['modules']), data['modules'])
+
+    def complete_module(self, prefix):
+        """Return a list of top-level module names starting with *prefix*.
+
+        None is returned if the index isn't ready yet.
+        """
+        if self._index is None:
+            return None
+        return _get_matching(self._index[0], prefix)
+
+    def complete_name(self, module_name, prefix):
+        """Return a list of public names of a top-level module.
+
+        Only names that start with *prefix* are included. None is
+        returned if the index isn't ready or the module isn't in it.
+        """
+        if self._index is None or module_name not in self._index[1]:
+            return None
+        return _get_matching(self._index[1][module_name], prefix)
+
+
+if __name__ == '__main__':
+    # sys.path[0] is the directory of this file, and e.g. jedi.py in it
+    # must not hide the real jedi
+    del sys.path[0]
+    json.dump(_build(), sys.stdout)
@@ -0,0 +1,111 @@
+"""The process that runs jedi for the jedi plugin.
+
+Importing jedi and parsing the modules that are imported in the edited
+file takes a long time, so this process is started when Porcupine
+starts and it stays running. The jedi plugin sends the content of each
+file once, and after that it sends only the changes. Messages are
+tuples sent with a :func:`multiprocessing.Pipe`:
+
+* ``('open', file_id, text)`` starts keeping track of a file.
+* ``('change', file_id, start, end, new_text)`` replaces the text
+  between two Tk text widget indexes, just like the change callbacks of
+  :class:`porcupine.textwidget.HandyText`.
+* ``('close', file_id)`` forgets a file.
+* ``('complete', request_id, file_id, path, line, column, line_count)``
+  finds completions for the file.
+* ``('cancel', request_id)`` means that the completions are not needed
+  anymore. This does nothing if they have been found already.
+
+Each complete message gets a response:
+
+* ``('result', request_id, list_of_suffixes)``
+* ``('error', request_id, traceback_string)``
+* ``('out_of_sync', request_id, file_id)`` if *line_count* is not the
+  number of lines that this process has, and the file must be sent
+  again with an open message
+* ``('cancelled', request_id, None)``
+
+This module is not a plugin because its name starts with ``_``.
+"""
+
+import collections
+import traceback
+
+from porcupine import textwidget
+
+# these are imported by many files, so they are parsed when the process
+# starts instead of when completing for the first time
+_PRELOADED_MODULES = ['builtins', 'os', 'sys', 're', 'collections',
+                      'functools', 'itertools', 'typing', 'pathlib',
+                      'subprocess', 'json', 'logging', 'tkinter']
+
+
+def _get_completions(jedi, source, path, line, column):
+    if hasattr(jedi.Script, 'complete'):    # jedi 0.16 and newer
+        completions = jedi.Script(source, path=path).complete(line, column)
+    else:
+        completions = jedi.Script(source, line, column,
+                                  path=path).completions()
+    return [completion.complete for completion in completions]
+
+
+def main(connection, cache_directory):
+    """Handle messages from *connection* until it's closed."""
+    import jedi
+    jedi.settings.cache_directory = cache_directory
+    jedi.settings.case_insensitive_completion = False
+    jedi.preload_module(*_PRELOADED_MODULES)
+    _get_completions(jedi, 'import os\nos.', None, 2, 3)
+
+    files = {}      # {file_id: list of lines without '\n' characters}
+    messages = collections.deque()
+    cancelled = set()
+    while True:
+        # completing may take a while, and all messages that arrived
+        # meanwhile are read before doing anything so that cancelled
+        # requests are skipped
+        try:
+            if not messages:
+                messages.append(connection.recv())
+            while connection.poll():
+                messages.append(connection.recv())
+        except EOFError:
+            break
+        for message in messages:
+            if message[0] == 'cancel':
+                cancelled.add(message[1])
+
+        message = messages.popleft()
+        kind, *args = message
+        if kind == 'open':
+            file_id, text = args
+            files[file_id] = text.split('\n')
+        elif kind == 'change':
+            file_id, *change_args = args
+            if file_id in files:
+                textwidget.apply_change(files[file_id], *change_args)
+        elif kind == 'close':
+            [file_id] = args
+            files.pop(file_id, None)
+        elif kind == 'cancel':
+            cancelled.discard(args[0])
+        elif kind == 'complete':
+            request_id, file_id, path, line, column, line_count = args
+            lines = files.get(file_id)
+            if request_id in cancelled:
+                connection.send(('cancelled', request_id, None))
+                continue
+            if lines is None or len(lines) != line_count:
+                files.pop(file_id, None)
+                connection.send(('out_of_sync', request_id, file_id))
+                continue
+            try:
+                result = _get_completions(jedi, '\n'.join(lines), path,
+                                          line, column)
+            except Exception:
+                connection.send(('error', request_id,
+                                 traceback.format_exc()))
+            else:
+                connection.send(('result', request_id, result))
+        else:
+            raise ValueError("unknown message: %r" % (message,))
@@ -0,0 +1,370 @@
+"""A persistent trigram index for the findinfiles plugin.
+
+The index knows which 3-byte sequences each file contains. A file can't
+contain ``"hello"`` unless it contains ``"hel"``, ``"ell"`` and
+``"llo"``, so only the files that contain all of those need to be
+searched. The trigrams are taken from the lowercased bytes of the files,
+so the same index works for case-sensitive and case-insensitive
+searches.
+
+The index of each directory is kept in memory after the first search
+and saved to :data:`porcupine.dirs.cachedir`. Files with a different
+modification time or size than last time are indexed again when
+:meth:`TrigramIndex.update` is called, so the index doesn't need a
+separate watcher. The findinfiles plugin searches the files that the
+index knows about first and updates the index after that, because
+listing and stat-ing every file of a big directory is slow.
+
+This module is not a plugin because its name starts with ``_``.
+"""
+
+import array
+import hashlib
+import logging
+import os
+import pickle
+import re
+import sys
+import threading
+import time
+
+from porcupine import dirs, utils
+
+try:
+    from re import _parser as _sre_parse     # python 3.11 and newer
+except ImportError:
+    import sre_parse as _sre_parse
+
+log = logging.getLogger(__name__)
+
+_INDEX_DIR = os.path.join(dirs.cachedir, 'trigrams')
+_VERSION = 1
+_BINARY_CHECK_SIZE = 8 * 1024       # same as in findinfiles
+_MAX_INDEXED_SIZE = 64 * 1024 * 1024
+_UPDATE_CHUNK_SIZE = 16             # files per task for the process pool
+
+
+def _get_trigrams(data):
+    """Return a set of the trigrams of a bytes object as integers."""
+    data = data.lower()
+    if len(data) < 4:
+        return {int.from_bytes(data[i:i + 3], 'little')
+                for i in range(len(data) - 2)}
+
+    # going through every byte with a python loop would be slow, but
+    # set(array) runs in C and there are usually far fewer different
+    # 4-byte words than bytes, each word contains 2 trigrams
+    result = set()
+    for offset in range(4):
+        end = offset + (len(data) - offset) // 4 * 4
+        words = array.array('I')     # 'I' is 4 bytes on everything
+        words.frombytes(data[offset:end])
+        if sys.byteorder == 'big':
+            words.byteswap()
+        for word in set(words):
+            result.add(word & 0xffffff)
+            result.add(word >> 8)
+    return result
+
+
+# this runs in the worker processes
+def _index_files(paths):
+    """Return a list of (path, mtime, size, trigrams_or_None) tuples.
+
+    The trigrams are sorted and in an ``array.array('I')`` converted to
+    bytes. They are None for files that are too big to be indexed, and
+    the trigrams of binary files are empty because findinfiles never
+    searches them. Files that can't be read are left out.
+    """
+    result = []
+    for path in paths:
+        try:
+            with open(path, 'rb') as file:
+                stat = os.fstat(file.fileno())
+                if stat.st_size > _MAX_INDEXED_SIZE:
+                    trigrams = None
+                else:
+                    data = file.read()
+                    if b'\0' in data[:_BINARY_CHECK_SIZE]:
+                        trigrams = b''
+                    else:
+                        trigrams = array.array(
+                            'I', sorted(_get_trigrams(data))).tobytes()
+        except OSError:
+            continue
+        result.append((path, stat.st_mtime, stat.st_size, trigrams))
+    return result
+
+
+def _get_regex_literals(regex):
+    # returns strings that every match of the regex contains, this only
+    # looks at the top level of the regex because that's simple and good
+    # enough for most regexes
+    try:
+        parsed = _sre_parse.parse(regex)
+    except re.error:
+        return []
+
+    literals = []
+    current = []
+    for op, arg in parsed:
+        if op == _sre_parse.LITERAL:
+            current.append(chr(arg))
+        elif current:
+            literals.append(''.join(current))
+            current = []
+    if current:
+        literals.append(''.join(current))
+    return literals
+
+
+def get_query_trigrams(text, regex, match_case):
+    """Return a set of trigrams that every matching file contains.
+
+    An empty set is returned if the files can't be narrowed down.
+    """
+    if regex:
+        literals = _get_regex_literals(text)
+    else:
+        literals = [text]
+
+    result = set()
+    for literal in literals:
+        data = literal.encode('utf-8').lower()
+        for i in range(len(data) - 2):
+            chunk = data[i:i + 3]
+            # bytes.lower() lowercases ascii only, so without this, 'Ä'
+            # wouldn't find 'ä' with a case-insensitive search, and
+            # inline flags like (?i) can make regexes case-insensitive
+            if (regex or not match_case) and max(chunk) >= 0x80:
+                continue
+            result.add(int.from_bytes(chunk, 'little'))
+    return result
+
+
+class TrigramIndex:
+    """The trigram index of one directory.
+
+    All methods can be called from any thread, but not from the worker
+    processes.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = get_index_path(directory)
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._changed = False
+        self._updated = None        # time.time() of last update() or None
+
+        # file ids are indexes of self._paths, removed files are None
+        self._paths = []
+        self._stats = {}    # {path: (file_id, mtime, size)}
+        self._unindexed = set()     # ids of files too big for indexing
+        self._postings = {}         # {trigram: array.array('I') of ids}
+
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            with open(self.path, 'rb') as file:
+                (version, directory, self._updated, self._paths,
+                 self._stats, self._unindexed, postings) = pickle.load(file)
+        except FileNotFoundError:
+            return
+        except Exception:
+            log.exception("cannot load '%s', it will be rebuilt", self.path)
+            self._clear()
+            return
+
+        if version != _VERSION or directory != self.directory:
+            log.info("'%s' is outdated, it will be rebuilt", self.path)
+            self._clear()
+            return
+
+        for trigram, data in postings.items():
+            ids = array.array('I')
+            ids.frombytes(data)
+            self._postings[trigram] = ids
+
+    def _clear(self):
+        self._paths = []
+        self._stats = {}
+        self._unindexed = set()
+        self._postings = {}
+        self._updated = None
+        self._changed = True
+
+    def clear(self):
+        """Forget everything, :meth:`update` will index all files again."""
+        with self._lock:
+            self._loaded = True
+            self._clear()
+
+    def _remove_file(self, path):
+        file_id = self._stats.pop(path)[0]
+        self._paths[file_id] = None
+        self._unindexed.discard(file_id)
+        self._changed = True
+
+    def _add_file(self, path, mtime, size, trigrams):
+        file_id = len(self._paths)
+        self._paths.append(path)
+        self._stats[path] = (file_id, mtime, size)
+        if trigrams is None:
+            self._unindexed.add(file_id)
+        else:
+            ids = array.array('I')
+            ids.frombytes(trigrams)
+            for trigram in ids:
+                try:
+                    self._postings[trigram].append(file_id)
+                except KeyError:
+                    self._postings[trigram] = array.array('I', [file_id])
+        self._changed = True
+
+    def _compact(self):
+        # the postings of removed files are left behind, and this
+        # renumbers everything when there are many of them
+        new_ids = {}
+        new_paths = []
+        for old_id, path in enumerate(self._paths):
+            if path is not None:
+                new_ids[old_id] = len(new_paths)
+                new_paths.append(path)
+
+        for trigram, ids in list(self._postings.items()):
+            new = array.array('I', [new_ids[i] for i in ids
+                                    if i in new_ids])
+            if new:
+                self._postings[trigram] = new
+            else:
+                del self._postings[trigram]
+
+        self._paths = new_paths
+        self._stats = {path: (new_ids[file_id], mtime, size)
+                       for path, (file_id, mtime, size)
+                       in self._stats.items()}
+        self._unindexed = {new_ids[file_id] for file_id in self._unindexed}
+
+    def update(self, paths, map_function, cancel_event, progress_callback):
+        """Index new and changed files and forget removed files.
+
+        *paths* should contain all files of the directory. The files are
+        indexed in other processes with ``map_function(function, tasks)``,
+        which should work like :meth:`multiprocessing.pool.Pool.imap`.
+        ``progress_callback(done, total)`` is called while indexing.
+        Returns False if *cancel_event* was set before everything was
+        indexed.
+        """
+        with self._lock:
+            self._load()
+            paths = set(paths)
+            for path in list(self._stats):
+                if path not in paths:
+                    self._remove_file(path)
+
+            outdated = []
+            for path in paths:
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    if path in self._stats:
+                        self._remove_file(path)
+                    continue
+                if (path not in self._stats or
+                        self._stats[path][1:] != (stat.st_mtime,
+                                                  stat.st_size)):
+                    outdated.append(path)
+
+            chunks = [outdated[i:i + _UPDATE_CHUNK_SIZE]
+                      for i in range(0, len(outdated), _UPDATE_CHUNK_SIZE)]
+            done = 0
+            for result in map_function(_index_files, chunks):
+                if cancel_event.is_set():
+                    return False
+                for path, mtime, size, trigrams in result:
+                    if path in self._stats:
+                        self._remove_file(path)
+                    self._add_file(path, mtime, size, trigrams)
+                done += _UPDATE_CHUNK_SIZE
+                progress_callback(min(done, len(outdated)), len(outdated))
+
+            if len(self._paths) > 2 * len(self._stats):
+                self._compact()
+            self._updated = time.time()
+            return True
+
+    def get_candidates(self, trigrams):
+        """Return a list of the files that may contain the trigrams.
+
+        Use :func:`get_query_trigrams` to create the trigrams. Files
+        that have changed after the previous :meth:`update` may be
+        missing.
+        """
+        with self._lock:
+            self._load()
+            if not trigrams:
+                return list(self._stats)
+
+            # starting with the rarest trigram makes the sets small
+            postings = sorted((self._postings.get(trigram, ())
+                               for trigram in trigrams), key=len)
+            ids = set(postings[0])
+            for other_ids in postings[1:]:
+                if not ids:
+                    break
+                ids.intersection_update(other_ids)
+            ids.update(self._unindexed)
+            return [self._paths[i] for i in sorted(ids)
+                    if self._paths[i] is not None]
+
+    def save(self):
+        """Write the index to the cache directory if it has changed."""
+        with self._lock:
+            if not self._changed:
+                return
+            postings = {trigram: ids.tobytes()
+                        for trigram, ids in self._postings.items()}
+            os.makedirs(_INDEX_DIR, exist_ok=True)
+            with utils.atomic_open(self.path, 'wb') as file:
+                pickle.dump((_VERSION, self.directory, self._updated,
+                             self._paths, self._stats, self._unindexed,
+                             postings), file, pickle.HIGHEST_PROTOCOL)
+            self._changed = False
+
+    def get_info(self):
+        """Return a ``(file_count, updated)`` tuple.
+
+        *updated* is a :func:`time.time` value or None if the index has
+        never been updated.
+        """
+        with self._lock:
+            self._load()
+            return (len(self._stats), self._updated)
+
+
+def get_index_path(directory):
+    """Return the path of the file that the index of *directory* uses.
+
+    Check the size of this file to find out how big the index is.
+    """
+    name = hashlib.sha1(os.fsencode(directory)).hexdigest()
+    return os.path.join(_INDEX_DIR, name + '.pickle')
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(directory):
+    """Return a :class:`TrigramIndex` for a directory.
+
+    The index is loaded when it's used for the first time, and the same
+    index object is returned every time.
+    """
+    with _indexes_lock:
+        if directory not in _indexes:
+            _indexes[directory] = TrigramIndex(directory)
+        return _indexes[directory]
@@ -1,16 +1,31 @@
 # TODO: document this module's simple register_completer() api
+import array
+import bisect
 import collections
+import concurrent.futures
+import functools
+import itertools
+import logging
 import re
+import time
+import tkinter as tk
+from tkinter import ttk
 
 from porcupine import get_tab_manager, tabs, utils
 
-__all__ = ['register_completer']
+__all__ = ['register_completer', 'submit']
 setup_before = ['tabs2spaces']      # see tabs2spaces.py
 
-_completers = {}
+log = logging.getLogger(__name__)
+_POLL_INTERVAL = 20     # milliseconds
+_PREFETCH_DELAY = 200   # milliseconds without typing before prefetching
+_POPUP_ROWS = 10
 
+_completers = {}    # {filetype_name: (function, timeout)}
+_executor = concurrent.futures.ThreadPoolExecutor(max_workers=4)
 
-def register_completer(filetype_name, function):
+
+def register_completer(filetype_name, function, *, timeout=1):
     """Add a syntax completer for a specific filetype.
 
     Use like this::
@@ -31,113 +46,795 @@ def register_completer(filetype_name, function):
 
     The ``tab`` argument to *function* is a :class:`porcupine.tabs.Filetab`.
 
+    The completer runs when the user presses Tab, so it must not do
+    anything slow. Instead of the iterable, it can return a
+    :class:`concurrent.futures.Future` that gives the iterable when it's
+    done. Use :func:`submit` to create the future, or create it yourself
+    if the completions come from somewhere else. Get everything you need
+    from the text widget before that because tkinter must not be used
+    from other threads::
+
+        def slow_java_completer(tab):
+            content = tab.textwidget.get('1.0', 'end - 1 char')
+            cursor = tab.textwidget.index('insert')
+            return autocomplete.submit(find_completions, content, cursor)
+
+    The completions are ignored if the user types something or moves the
+    cursor before they are ready. If they aren't ready after *timeout*
+    seconds or the future fails, words from the open files are completed
+    instead.
+
+    The completer is also called when the user stops typing for a moment
+    after a ``.`` or a part of a word, so that the completions are often
+    ready when Tab is pressed. If the user types something before the
+    future is done, it's cancelled with
+    :meth:`~concurrent.futures.Future.cancel`.
+
     The *filetype_name* should be a key of
     :data:`porcupine.filetypes.filetypes`. Registering multiple completers
     for the same *filetype_name* overrides previous registrations.
     """
-    _completers[filetype_name] = function
+    _completers[filetype_name] = (function, timeout)
+
+
+def submit(function, *args, **kwargs):
+    """Run ``function(*args, **kwargs)`` in a thread and return a future.
+
+    The threads are shared by all completers. See
+    :func:`register_completer` for an example.
+    """
+    return _executor.submit(function, *args, **kwargs)
+
+
+_WORD_REGEX = re.compile(r'\w+')
+_SCAN_CHUNK = 2000      # lines
+
+
+# words in the current tab are this many times more important than
+# words in other tabs
+_LOCAL_WEIGHT = 5
+
+
+class _SortedCounter:
+    """A :class:`collections.Counter` that can find words by prefix."""
+
+    def __init__(self):
+        self.counts = collections.Counter()
+        self._sorted_words = []     # same words as self.counts has
+
+    def update(self, deltas):
+        """Add ``{word: change_in_count}`` to the counts.
+
+        Words are forgotten when their count goes to zero.
+        """
+        added = []
+        removed = []
+        for word, delta in deltas.items():
+            if word not in self.counts:
+                added.append(word)
+            self.counts[word] += delta
+            if self.counts[word] <= 0:
+                del self.counts[word]
+                removed.append(word)
+
+        if len(added) + len(removed) > 100:
+            # this happens when scanning a file, and insort() would be
+            # slow, but sort() is fast when most of the list is sorted
+            if removed:
+                removed = set(removed)
+                self._sorted_words = [word for word in self._sorted_words
+                                      if word not in removed]
+            self._sorted_words.extend(added)
+            self._sorted_words.sort()
+            return
+        for word in removed:
+            del self._sorted_words[bisect.bisect_left(self._sorted_words,
+                                                      word)]
+        for word in added:
+            bisect.insort(self._sorted_words, word)
+
+    def get_words(self, prefix):
+        """Return a list of ``(word, count)`` pairs.
+
+        Each word starts with *prefix*, and the list is sorted by word.
+        This doesn't look at words that don't start with the prefix, so
+        it's fast even if there are lots of words.
+        """
+        result = []
+        index = bisect.bisect_left(self._sorted_words, prefix)
+        for word in itertools.islice(self._sorted_words, index, None):
+            if not word.startswith(prefix):
+                break
+            result.append((word, self.counts[word]))
+        return result
+
+
+# the words of all tabs, each tab adds its word counts here and removes
+# them when it's closed, so a word is forgotten when no tab has it
+_all_words = _SortedCounter()
+
+
+class _WordIndex:
+    """The words of a text widget and how many times each word appears.
+
+    The index is updated with :meth:`~porcupine.textwidget.HandyText.\
+add_change_callback`, so only the changed lines are looked at, and
+    looking up words with a prefix doesn't depend on the file size. Big
+    changes, like loading a file or waking up a hibernated tab, are
+    scanned a few thousand lines at a time with ``after()``.
+    """
 
+    def __init__(self, textwidget):
+        self._textwidget = textwidget
+        self.words = _SortedCounter()
+
+        # the words of the first self._scanned lines, as integer ids in
+        # arrays to save memory, and how many words each line has
+        self._scanned = 0
+        self._line_sizes = array.array('I')
+        self._word_ids = array.array('I')
+        self._ids = {}              # {word: id}
+        self._id_words = []         # words by id, None for free ids
+        self._free_ids = []
+        self._offset_cache = (0, 0)     # (line, index in self._word_ids)
+
+        self._scan_id = None
+        self._schedule_scan()
+        textwidget.add_change_callback(self._on_change)
+
+    def destroy(self):
+        """Stop updating the index and remove its words from other tabs."""
+        self._textwidget.remove_change_callback(self._on_change)
+        if self._scan_id is not None:
+            self._textwidget.after_cancel(self._scan_id)
+            self._scan_id = None
+        _all_words.update({word: -count
+                           for word, count in self.words.counts.items()})
+        self.words = _SortedCounter()
+        self._scanned = 0
+        del self._line_sizes[:]
+        del self._word_ids[:]
+        self._ids.clear()
+        self._id_words.clear()
+
+    def _get_id(self, word):
+        try:
+            return self._ids[word]
+        except KeyError:
+            if self._free_ids:
+                word_id = self._free_ids.pop()
+                self._id_words[word_id] = word
+            else:
+                word_id = len(self._id_words)
+                self._id_words.append(word)
+            self._ids[word] = word_id
+            return word_id
+
+    # edits are usually near each other, so this sums only the lines
+    # between the previous edit and this edit
+    def _get_offset(self, line):
+        cached_line, cached_offset = self._offset_cache
+        if line >= cached_line:
+            return cached_offset + sum(self._line_sizes[cached_line:line])
+        return cached_offset - sum(self._line_sizes[line:cached_line])
+
+    # replaces the words of lines start:end with the words of new_lines
+    def _replace_lines(self, start, end, new_lines):
+        offset = self._get_offset(start)
+        end_offset = offset + sum(self._line_sizes[start:end])
+
+        deltas = collections.Counter(map(
+            self._id_words.__getitem__, self._word_ids[offset:end_offset]))
+        for word in deltas:
+            deltas[word] = -deltas[word]
+        new_words = [_WORD_REGEX.findall(line) for line in new_lines]
+        for words in new_words:
+            deltas.update(words)
+
+        self._word_ids[offset:end_offset] = array.array('I', [
+            self._get_id(word) for words in new_words for word in words])
+        self._line_sizes[start:end] = array.array('I', map(len, new_words))
+        self._scanned += len(new_lines) - (end - start)
+        self._offset_cache = (start, offset)
+
+        deltas = {word: delta for word, delta in deltas.items() if delta}
+        self.words.update(deltas)
+        _all_words.update(deltas)
+        for word, delta in deltas.items():
+            if delta < 0 and word not in self.words.counts:
+                self._free_ids.append(self._ids.pop(word))
+                self._id_words[self._free_ids[-1]] = None
+
+    def _schedule_scan(self):
+        if self._scan_id is None:
+            self._scan_id = self._textwidget.after(1, self._scan_some)
+
+    def _scan_some(self):
+        self._scan_id = None
+        line_count = int(self._textwidget.index('end - 1 char').split('.')[0])
+        if self._scanned >= line_count:
+            return
+        last_line = min(self._scanned + _SCAN_CHUNK, line_count)
+        text = self._textwidget.get('%d.0' % (self._scanned + 1),
+                                    '%d.0 lineend' % last_line)
+        self._replace_lines(self._scanned, self._scanned, text.split('\n'))
+        self._schedule_scan()
+
+    # forgets the lines after the first line_count lines, they are
+    # scanned later
+    def _truncate(self, line_count):
+        self._replace_lines(line_count, self._scanned, [])
+        self._schedule_scan()
+
+    def _on_change(self, start, end, new_text):
+        start_line = int(start.split('.')[0])
+        end_line = int(end.split('.')[0])
+        new_end_line = start_line + new_text.count('\n')
+
+        if start_line > self._scanned:
+            # the scan hasn't got this far yet
+            return
+        if end_line > self._scanned or (
+                new_end_line - start_line > _SCAN_CHUNK):
+            # e.g. loading or waking up, this must not freeze the UI
+            self._truncate(start_line - 1)
+            return
+
+        # words may continue before start or after end, so whole lines
+        # are looked at
+        new_lines = self._textwidget.get(
+            '%d.0' % start_line, '%d.0 lineend' % new_end_line).split('\n')
+        self._replace_lines(start_line - 1, end_line, new_lines)
+
+        if self._scan_id is None and self._scanned != int(
+                self._textwidget.index('end - 1 char').split('.')[0]):
+            # this happens if the change callbacks didn't run while the
+            # tab was loading when this was created, but it's not a
+            # problem because everything changed anyway
+            self._truncate(0)
+
+
+def _get_mask(string):
+    # each character sets a bit, so a word can't match a filter if the
+    # filter has bits that the word doesn't have
+    mask = 0
+    for character in string:
+        mask |= 1 << (ord(character) & 63)
+    return mask
+
+
+def _is_word_start(word, index):
+    return (index == 0 or word[index - 1] == '_' or
+            (word[index].isupper() and not word[index - 1].isupper()))
+
+
+# returns a score or None if the word doesn't match, bigger is better
+def _fuzzy_score(filter_text, lower_filter, word, lower_word):
+    score = 0
+    position = -1
+    for character in lower_filter:
+        if lower_word.startswith(character, position + 1):
+            position += 1
+            score += 3 if _is_word_start(word, position) else 2
+            continue
+
+        # e.g. 'gtm' should match the beginnings of 'get_tab_manager'
+        # even though 'get' contains a t
+        first = lower_word.find(character, position + 1)
+        if first == -1:
+            return None
+        position = first
+        while (position != -1 and
+               not _is_word_start(word, position)):
+            position = lower_word.find(character, position + 1)
+        if position == -1:
+            position = first
+        else:
+            score += 3
+
+    if lower_word.startswith(lower_filter[:1]):
+        score += 2
+    if word.startswith(filter_text):
+        score += 10
+    return score
+
+
+class _Popup:
+    """A list of completions below the word being completed.
+
+    The list is filtered as the user keeps typing, but the text widget
+    isn't changed until a completion is chosen. Only the visible rows
+    are added to the listbox, so long lists are not slow.
+    """
 
-def _fallback_completer(tab):
-    """Find all words in file, sorted by frequency."""
-    before_cursor = tab.textwidget.get('insert linestart', 'insert')
-    after_cursor = tab.textwidget.get('insert', 'insert lineend')
+    def __init__(self, textwidget, on_choose):
+        self._textwidget = textwidget
+        self._on_choose = on_choose
+        self._toplevel = None   # created when needed, there may be many tabs
+
+        self.word_start = None      # None when not showing
+        self._words = []    # (word, lower_word, mask) tuples, best first
+        self._filter_text = None
+        self._matches = []  # same tuples as in self._words
+        self._selected = 0
+        self._top = 0       # index of the first visible match
+
+    def _create_widgets(self):
+        self._toplevel = tk.Toplevel(self._textwidget)
+        self._toplevel.withdraw()
+        self._toplevel.overrideredirect(True)
+
+        self._listbox = tk.Listbox(
+            self._toplevel, height=_POPUP_ROWS, exportselection=False,
+            activestyle='none', font=self._textwidget['font'])
+        self._listbox.pack(fill='both', expand=True)
+        self._listbox.bind('<Button-1>', self._on_click)
+        utils.bind_mouse_wheel(self._listbox, self._on_wheel)
+        self._count_label = ttk.Label(self._toplevel)
+        self._count_label.pack(fill='x')
+
+    def show(self, word_start, words):
+        if self._toplevel is None:
+            self._create_widgets()
+        self.word_start = word_start
+        self._words = [(word, word.lower(), _get_mask(word.lower()))
+                       for word in collections.OrderedDict.fromkeys(words)]
+        self._filter_text = None
+        self.update_filter()
+        if self.word_start is None:
+            # nothing matched
+            return
+
+        bbox = self._textwidget.bbox(word_start)
+        if bbox is None:
+            # the word isn't visible
+            x, y = 0, 0
+        else:
+            x, y = bbox[0], bbox[1] + bbox[3]
+        width = min(max(len(word) for word in words), 50) + 2
+        self._listbox['width'] = width
+        self._toplevel.geometry('+%d+%d' % (
+            self._textwidget.winfo_rootx() + x,
+            self._textwidget.winfo_rooty() + y))
+        self._toplevel.deiconify()
+        self._toplevel.lift()
+
+    def hide(self, *junk):
+        self.word_start = None
+        self._words = []
+        self._matches = []
+        if self._toplevel is not None:
+            self._toplevel.withdraw()
+
+    def update_filter(self):
+        """Filter the words with the text between word start and cursor.
+
+        The popup is hidden if the cursor isn't in the word anymore or
+        nothing matches.
+        """
+        if self._textwidget.compare('insert', '<', self.word_start):
+            self.hide()
+            return
+        filter_text = self._textwidget.get(self.word_start, 'insert')
+        if re.fullmatch(r'\w*', filter_text) is None:
+            self.hide()
+            return
+        if filter_text == self._filter_text:
+            return
+
+        if (self._filter_text is not None and
+                filter_text.startswith(self._filter_text)):
+            # anything that matches the longer filter text also matched
+            # the shorter filter text
+            candidates = self._matches
+        else:
+            candidates = self._words
+        self._filter_text = filter_text
+
+        lower_filter = filter_text.lower()
+        filter_mask = _get_mask(lower_filter)
+        scores = {}
+        for candidate in candidates:
+            word, lower_word, mask = candidate
+            if filter_mask & ~mask or word == filter_text:
+                continue
+            score = _fuzzy_score(filter_text, lower_filter, word, lower_word)
+            if score is not None:
+                scores[candidate] = score
+
+        # sorted() is stable, so words that the completer thinks are
+        # better come first when the scores are equal
+        matches = [candidate for candidate in candidates
+                   if candidate in scores]
+        self._matches = sorted(matches, key=scores.get, reverse=True)
+        if not self._matches:
+            self.hide()
+            return
+        self._selected = 0
+        self._top = 0
+        self._render()
+
+    def _render(self):
+        visible = self._matches[self._top:self._top + _POPUP_ROWS]
+        self._listbox.delete(0, 'end')
+        self._listbox.insert('end', *[word for word, *junk in visible])
+        self._listbox.selection_set(self._selected - self._top)
+        self._count_label['text'] = '%d/%d' % (
+            self._selected + 1, len(self._matches))
+
+    def move_selection(self, diff):
+        self._selected = (self._selected + diff) % len(self._matches)
+        if self._selected < self._top:
+            self._top = self._selected
+        elif self._selected >= self._top + _POPUP_ROWS:
+            self._top = self._selected - _POPUP_ROWS + 1
+        self._render()
+
+    def get_selected(self):
+        return self._matches[self._selected][0]
+
+    def _on_wheel(self, direction):
+        if direction == 'up':
+            self._top = max(self._top - 1, 0)
+        else:
+            self._top = max(min(self._top + 1,
+                                len(self._matches) - _POPUP_ROWS), 0)
+        self._selected = min(max(self._selected, self._top),
+                             self._top + _POPUP_ROWS - 1)
+        self._render()
+
+    def _on_click(self, event):
+        index = self._listbox.nearest(event.y)
+        if index >= 0:
+            self._selected = self._top + index
+            self._on_choose()
+        # the listbox must not take the focus from the text widget
+        return 'break'
 
-    match = re.search(r'\w+$', before_cursor)
-    if match is None:
-        # can't autocomplete based on this
-        return None
-    prefix = match.group(0)
 
-    # find unique words starting with the prefix
-    # Tcl's regexes don't support \b or a sane way of grouping so
-    # they are kind of useless for this. I guess I should implement
-    # this with Tcl regexes too and check which is faster :)
-    result = collections.Counter()
-    for chunk in tab.textwidget.iter_chunks():
-        print([prefix])
-        result.update(re.findall(r'\b' + prefix + r'(\w+)', chunk))
+# a completion that is running in another thread or process
+_Request = collections.namedtuple('_Request', [
+    'future', 'name', 'start_time', 'deadline', 'cursor', 'change_count',
+    'before_cursor', 'word_start', 'prefix'])
 
-    # if the cursor is in the middle of a word, that word must not
-    # be completed, e.g. if the user types abcdef and moves the
-    # cursor between c and d, we must not autocomplete to abcdefdef
-    try:
-        del result[re.search(r'^\w*', after_cursor).group(0)]
-    except KeyError:
-        pass
+# completions of the word that starts at word_start, when the beginning
+# of the word was prefix, words are prefix + suffix
+_CacheEntry = collections.namedtuple('_CacheEntry', [
+    'word_start', 'prefix', 'words'])
 
-    return sorted(result, key=result.get, reverse=True)
+# a completion that was started before the user pressed tab
+_Prefetch = collections.namedtuple('_Prefetch', [
+    'future', 'word_start', 'prefix', 'change_count'])
 
 
 class _AutoCompleter:
 
     def __init__(self, tab):
         self.tab = tab
-        self._startpos = None
-        self._suffixes = None
-        self._completing = False    # avoid recursion
+        self._words = _WordIndex(tab.textwidget)
+        self._popup = _Popup(tab.textwidget, self._choose)
+        self._request = None
+        self._poll_id = None
+        self._change_count = 0      # for noticing changes during requests
+        self._cache = None
+        self._prefetch = None
+        self._prefetch_id = None
+        tab.textwidget.add_change_callback(self._on_change)
+
+    def _on_change(self, start, end, new_text):
+        self._change_count += 1
+        self._cancel_prefetch()
+        if self._cache is not None and not self._is_in_word(
+                start, end, new_text):
+            self._cache = None
+
+    # typing more of the same word doesn't make the cache outdated, but
+    # anything else might change the completions
+    def _is_in_word(self, start, end, new_text):
+        word_line, word_column = map(int, self._cache.word_start.split('.'))
+        start_line, start_column = map(int, start.split('.'))
+        end_line = int(end.split('.')[0])
+        return (start_line == end_line == word_line and
+                start_column >= word_column and
+                re.fullmatch(r'\w*', new_text) is not None)
+
+    def _get_cached(self, word_start, prefix):
+        if (self._cache is None or
+                self._cache.word_start != word_start or
+                not prefix.startswith(self._cache.prefix)):
+            return None
+        return [word[len(prefix):] for word in self._cache.words
+                if word.startswith(prefix) and word != prefix]
+
+    def _set_cached(self, word_start, prefix, suffixes):
+        self._cache = _CacheEntry(word_start, prefix,
+                                  [prefix + suffix for suffix in suffixes])
+
+    def _schedule_prefetch(self):
+        self._cancel_prefetch()
+        self._prefetch_id = self.tab.after(_PREFETCH_DELAY,
+                                           self._start_prefetch)
+
+    def _cancel_prefetch(self):
+        if self._prefetch_id is not None:
+            self.tab.after_cancel(self._prefetch_id)
+            self._prefetch_id = None
+        if self._prefetch is not None:
+            self._prefetch.future.cancel()
+            self._prefetch = None
+
+    def _start_prefetch(self):
+        self._prefetch_id = None
+        if self._request is not None or self._popup.word_start is not None:
+            return
+        if self.tab.filetype.name not in _completers:
+            return
+        completer, timeout = _completers[self.tab.filetype.name]
 
-    def _find_suffixes(self):
+        before_cursor = self.tab.textwidget.get('insert linestart', 'insert')
+        after_cursor = self.tab.textwidget.get('insert', 'insert lineend')
+        if (re.search(r'[\w.]$', before_cursor) is None or
+                re.search(r'^\w', after_cursor) is not None):
+            return
+        prefix = re.search(r'\w*$', before_cursor).group(0)
+        word_start = self.tab.textwidget.index(
+            'insert - %d chars' % len(prefix))
+        if self._get_cached(word_start, prefix) is not None:
+            return
+
+        try:
+            result = completer(self.tab)
+        except Exception:
+            log.exception("prefetching %s completions failed",
+                          self.tab.filetype.name)
+            return
+        if isinstance(result, concurrent.futures.Future):
+            self._prefetch = _Prefetch(result, word_start, prefix,
+                                       self._change_count)
+            self._prefetch_id = self.tab.after(_POLL_INTERVAL,
+                                               self._poll_prefetch)
+        elif result is not None:
+            self._set_cached(word_start, prefix, list(result))
+
+    def _poll_prefetch(self):
+        self._prefetch_id = None
+        prefetch = self._prefetch
+        if not prefetch.future.done():
+            self._prefetch_id = self.tab.after(_POLL_INTERVAL,
+                                               self._poll_prefetch)
+            return
+
+        self._prefetch = None
+        try:
+            suffixes = prefetch.future.result()
+        except Exception:
+            # it will fail again when the user presses tab, and it's
+            # logged then
+            return
+        if (suffixes is not None and
+                self._change_count == prefetch.change_count):
+            self._set_cached(prefetch.word_start, prefetch.prefix,
+                             list(suffixes))
+
+    # returns a future or None
+    def _take_prefetch(self, word_start, prefix):
+        prefetch = self._prefetch
+        if (prefetch is None or
+                prefetch.word_start != word_start or
+                prefetch.prefix != prefix or
+                prefetch.change_count != self._change_count):
+            return None
+        self._prefetch = None
+        if self._prefetch_id is not None:
+            self.tab.after_cancel(self._prefetch_id)
+            self._prefetch_id = None
+        return prefetch.future
+
+    # returns None to let the tab key do something else
+    def _start_completing(self):
         before_cursor = self.tab.textwidget.get('insert linestart', 'insert')
         after_cursor = self.tab.textwidget.get('insert', 'insert lineend')
 
-        print([before_cursor])
         if re.search(r'\S$', before_cursor) is None:
             # let other plugins handle this however they want to
-            print("give up")
             return None
         if re.search(r'^\w', after_cursor) is not None:
             # don't complete in the middle of a word
-            return []
-
-        completer = _completers.get(self.tab.filetype.name,
-                                    _fallback_completer)
-        return completer(self.tab)
-
-    def _complete(self, rotation):
-        self._completing = True
-
-        if self._suffixes is None:
-            suffixes = self._find_suffixes()
-            if suffixes is None:
-                # no completable characters before the cursor, just give
-                # up and allow doing something else on this tab press
-                return None
-
-            self._startpos = self.tab.textwidget.index('insert')
-            self._suffixes = collections.deque(suffixes)
-            self._suffixes.appendleft('')  # end of completions
-
-        self._suffixes.rotate(rotation)
-        self.tab.textwidget.delete(self._startpos, 'insert')
-        self.tab.textwidget.mark_set('insert', self._startpos)
-        self.tab.textwidget.insert(self._startpos, self._suffixes[0])
-
-        self._completing = False
+            return 'break'
+
+        prefix = re.search(r'\w*$', before_cursor).group(0)
+        word_start = self.tab.textwidget.index(
+            'insert - %d chars' % len(prefix))
+        start_time = time.perf_counter()
+        try:
+            completer, timeout = _completers[self.tab.filetype.name]
+        except KeyError:
+            # the word index is fast enough without caching
+            name = "word"
+            suffixes = self._complete_words(before_cursor)
+        else:
+            name = self.tab.filetype.name
+            suffixes = self._get_cached(word_start, prefix)
+            if suffixes is not None:
+                name += " (cached)"
+            else:
+                # a prefetch that isn't done yet is better than nothing
+                result = self._take_prefetch(word_start, prefix)
+                if result is None:
+                    try:
+                        result = completer(self.tab)
+                    except Exception:
+                        log.exception("%s completion failed, completing "
+                                      "words instead", name)
+                        suffixes = self._complete_words(before_cursor)
+
+                if isinstance(result, concurrent.futures.Future):
+                    self._request = _Request(
+                        result, name, start_time, start_time + timeout,
+                        self.tab.textwidget.index('insert'),
+                        self._change_count, before_cursor, word_start,
+                        prefix)
+                    self._poll()
+                    return 'break'
+                if result is not None:
+                    suffixes = list(result)
+                    self._set_cached(word_start, prefix, suffixes)
+
+        self._log_time(name, start_time)
+        if suffixes is None:
+            # no completable characters before the cursor, just give
+            # up and allow doing something else on this tab press
+            return None
+        self._show_suffixes(word_start, prefix, suffixes)
         return 'break'
 
+    @staticmethod
+    def _log_time(name, start_time):
+        log.debug("%s completion took %.1f milliseconds",
+                  name, (time.perf_counter() - start_time) * 1000)
+
+    def _poll(self):
+        self._poll_id = None
+        request = self._request
+
+        if request.future.done():
+            try:
+                suffixes = request.future.result()
+            except Exception:
+                log.exception("%s completion failed, completing words "
+                              "instead", request.name)
+                suffixes = self._complete_words(request.before_cursor)
+            else:
+                self._log_time(request.name, request.start_time)
+                if (suffixes is not None and
+                        self._change_count == request.change_count):
+                    suffixes = list(suffixes)
+                    self._set_cached(request.word_start, request.prefix,
+                                     suffixes)
+        elif time.perf_counter() > request.deadline:
+            request.future.cancel()
+            log.info("%s completion took longer than %.1f seconds, "
+                     "completing words instead", request.name,
+                     request.deadline - request.start_time)
+            suffixes = self._complete_words(request.before_cursor)
+        else:
+            self._poll_id = self.tab.after(_POLL_INTERVAL, self._poll)
+            return
+
+        self._request = None
+        if (self.tab.textwidget.index('insert') == request.cursor and
+                self._change_count == request.change_count and
+                suffixes is not None):
+            self._show_suffixes(request.word_start, request.prefix,
+                                suffixes)
+
+    def _cancel_request(self):
+        if self._request is not None:
+            self._request.future.cancel()
+            self._request = None
+        if self._poll_id is not None:
+            self.tab.after_cancel(self._poll_id)
+            self._poll_id = None
+
+    def _complete_words(self, before_cursor):
+        """Find words that start with the word before the cursor.
+
+        Words from all tabs are used. Common words and words in this tab
+        come first.
+        """
+        match = re.search(r'\w+$', before_cursor)
+        if match is None:
+            # can't autocomplete based on this
+            return None
+        prefix = match.group(0)
+
+        # the word being typed is in the index too, but it's not a
+        # completion
+        local_counts = self._words.words.counts
+        scores = {word: count + _LOCAL_WEIGHT * local_counts.get(word, 0)
+                  for word, count in _all_words.get_words(prefix)
+                  if word != prefix}
+        return [word[len(prefix):]
+                for word in sorted(scores, key=scores.get, reverse=True)]
+
+    def _show_suffixes(self, word_start, prefix, suffixes):
+        words = [prefix + suffix for suffix in suffixes]
+        if len(words) == 1:
+            # no need to choose anything
+            self.tab.textwidget.insert('insert', suffixes[0])
+        elif words:
+            self._popup.show(word_start, words)
+
+    def _choose(self):
+        word = self._popup.get_selected()
+        word_start = self._popup.word_start
+        self._popup.hide()
+        self.tab.textwidget.delete(word_start, 'insert')
+        self.tab.textwidget.insert(word_start, word)
+
     def on_tab(self, event, shifted):
         if event.widget.tag_ranges('sel'):
             # something's selected, autocompleting is probably not the
             # right thing to do
             return None
-        return self._complete(1 if shifted else -1)
 
-    def reset(self, *junk):
-        # deleting and inserting from _complete() runs this, so this
-        # must do nothing if we're currently completing
-        if not self._completing:
-            self._suffixes = None
+        if self._request is not None:
+            # still waiting for the completions
+            return 'break'
+        if self._popup.word_start is not None:
+            self._choose()
+            return 'break'
+        return self._start_completing()
+
+    def on_arrow_key(self, diff, event):
+        if self._popup.word_start is None:
+            # this binding hides the text widget's <Key> binding that
+            # notices cursor movements
+            self.tab.textwidget.after_idle(
+                self.tab.textwidget.cursor_has_moved)
+            return None
+        self._popup.move_selection(diff)
+        return 'break'
 
+    def on_escape(self, event):
+        if self._popup.word_start is None:
+            return None
+        self._popup.hide()
+        return 'break'
 
-def on_new_tab(event):
-    # TODO: autocomplete in other kinds of tabs too?
-    tab = event.data_widget
-    if isinstance(tab, tabs.FileTab):
-        completer = _AutoCompleter(tab)
-        utils.bind_tab_key(tab.textwidget, completer.on_tab, add=True)
-        tab.textwidget.bind('<<CursorMoved>>', completer.reset, add=True)
+    def hide_popup(self, *junk):
+        self._popup.hide()
+
+    def on_destroy(self, event):
+        if event.widget is self.tab:
+            self._cancel_request()
+            self._cancel_prefetch()
+            self._words.destroy()
+
+    def on_cursor_moved(self, event):
+        if self._popup.word_start is not None:
+            # typing more of the word filters the popup, anything else
+            # hides it
+            self._popup.update_filter()
+        self._cancel_request()
+        self._schedule_prefetch()
+
+
+# TODO: autocomplete in other kinds of tabs too?
+def on_new_tab(tab):
+    completer = _AutoCompleter(tab)
+    utils.bind_tab_key(tab.textwidget, completer.on_tab, add=True)
+    tab.textwidget.bind('<<CursorMoved>>', completer.on_cursor_moved,
+                        add=True)
+    tab.textwidget.bind('<Up>', functools.partial(completer.on_arrow_key, -1),
+                        add=True)
+    tab.textwidget.bind('<Down>', functools.partial(completer.on_arrow_key, 1),
+                        add=True)
+    tab.textwidget.bind('<Escape>', completer.on_escape, add=True)
+    for sequence in ['<FocusOut>', '<Unmap>', '<Configure>']:
+        tab.textwidget.bind(sequence, completer.hide_popup, add=True)
+    tab.bind('<Destroy>', completer.on_destroy, add=True)
 
 
 def setup():
-    utils.bind_with_data(get_tab_manager(), '<<NewTab>>', on_new_tab, add=True)
+    get_tab_manager().add_new_tab_callback(on_new_tab, tabs.FileTab)
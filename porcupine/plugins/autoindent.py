@@ -5,7 +5,7 @@
 # do anything
 setup_before = ['rstrip']
 
-from porcupine import get_tab_manager, tabs, utils
+from porcupine import get_tab_manager, tabs
 
 
 def leading_whitespace(string):
@@ -39,18 +39,17 @@ def after_enter(textwidget):
         textwidget.dedent('insert')
 
 
-def on_new_tab(event):
-    if isinstance(event.data_widget, tabs.FileTab):
-        textwidget = event.data_widget.textwidget
+def on_new_tab(tab):
+    textwidget = tab.textwidget
 
-        def bind_callback(event):
-            textwidget.after_idle(after_enter, textwidget)
+    def bind_callback(event):
+        textwidget.after_idle(after_enter, textwidget)
 
-        textwidget.bind('<Return>', bind_callback, add=True)
+    textwidget.bind('<Return>', bind_callback, add=True)
 
 
 def setup():
-    utils.bind_with_data(get_tab_manager(), '<<NewTab>>', on_new_tab, add=True)
+    get_tab_manager().add_new_tab_callback(on_new_tab, tabs.FileTab)
 
 
 if __name__ == '__main__':
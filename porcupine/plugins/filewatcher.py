@@ -0,0 +1,336 @@
+"""Reload files when other programs change them.
+
+This plugin watches the files of all FileTabs in one thread. It uses
+inotify on Linux and checks the modification times of the files once a
+second on other systems. When a file changes and its tab has no unsaved
+changes, the new content is applied to the tab as a minimal line diff,
+so undo, the cursor position and syntax highlighting survive it. If the
+tab has unsaved changes, the user is asked what to do first.
+"""
+
+import ctypes
+import ctypes.util
+import difflib
+import errno
+import logging
+import os
+import platform
+import queue
+import struct
+import threading
+import time
+from tkinter import messagebox
+
+from porcupine import get_tab_manager, tabs, utils
+
+log = logging.getLogger(__name__)
+
+# from /usr/include/linux/inotify.h
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_Q_OVERFLOW = 0x00004000
+_IN_ONLYDIR = 0x01000000
+_EVENT_HEADER = struct.Struct('iIII')   # wd, mask, cookie, len
+
+
+class _Watcher:
+    """Base class for watchers.
+
+    Watchers put paths of changed files to self.changed_paths. watch()
+    and unwatch() are called from Tk's main loop, and the watching
+    thread must not use tkinter.
+    """
+
+    def __init__(self):
+        self.changed_paths = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def watch(self, path):
+        raise NotImplementedError
+
+    def unwatch(self, path):
+        raise NotImplementedError
+
+    def _run(self):
+        raise NotImplementedError
+
+
+class _InotifyWatcher(_Watcher):
+
+    def __init__(self):
+        super().__init__()
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'),
+                                 use_errno=True)
+        self._fd = self._libc.inotify_init()
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init() failed")
+
+        # a file is watched by watching the directory that it's in,
+        # because saving with os.replace() like utils.atomic_open()
+        # creates a new file and the watch of the old file would be lost
+        self._directories = {}    # {directory: (wd, {name: path})}
+        self._wd2directory = {}
+
+    def watch(self, path):
+        directory, name = os.path.split(os.path.realpath(path))
+        with self._lock:
+            if directory not in self._directories:
+                wd = self._libc.inotify_add_watch(
+                    self._fd, os.fsencode(directory),
+                    _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_ONLYDIR)
+                if wd < 0:
+                    code = ctypes.get_errno()
+                    log.warning("cannot watch '%s': %s",
+                                directory, os.strerror(code))
+                    return
+                self._directories[directory] = (wd, {})
+                self._wd2directory[wd] = directory
+            self._directories[directory][1][name] = path
+
+    def unwatch(self, path):
+        directory, name = os.path.split(os.path.realpath(path))
+        with self._lock:
+            try:
+                wd, names = self._directories[directory]
+            except KeyError:
+                # watch() failed
+                return
+            names.pop(name, None)
+            if not names:
+                del self._directories[directory]
+                del self._wd2directory[wd]
+                self._libc.inotify_rm_watch(self._fd, wd)
+
+    def _run(self):
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                log.exception("reading inotify events failed")
+                return
+
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = _EVENT_HEADER.unpack_from(
+                    data, offset)
+                offset += _EVENT_HEADER.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                offset += length
+
+                with self._lock:
+                    if mask & _IN_Q_OVERFLOW:
+                        # some events were lost, let's check everything
+                        for wd, names in self._directories.values():
+                            for path in names.values():
+                                self.changed_paths.put(path)
+                        continue
+
+                    try:
+                        directory = self._wd2directory[wd]
+                        path = self._directories[directory][1][name]
+                    except KeyError:
+                        # not a file that we are interested in
+                        continue
+                self.changed_paths.put(path)
+
+
+class _PollingWatcher(_Watcher):
+
+    _INTERVAL = 1     # seconds
+
+    def __init__(self):
+        super().__init__()
+        self._stats = {}    # {path: (mtime, size) or None}
+
+    @staticmethod
+    def _stat(path):
+        try:
+            result = os.stat(path)
+        except OSError:
+            return None
+        return (result.st_mtime, result.st_size)
+
+    def watch(self, path):
+        stat = self._stat(path)
+        with self._lock:
+            self._stats[path] = stat
+
+    def unwatch(self, path):
+        with self._lock:
+            self._stats.pop(path, None)
+
+    def _run(self):
+        while True:
+            time.sleep(self._INTERVAL)
+            with self._lock:
+                paths = list(self._stats)
+
+            for path in paths:
+                stat = self._stat(path)
+                with self._lock:
+                    if path not in self._stats:
+                        # unwatched while this thread was stat()ing
+                        continue
+                    if self._stats[path] != stat:
+                        self._stats[path] = stat
+                        if stat is not None:
+                            self.changed_paths.put(path)
+
+
+def _create_watcher():
+    if platform.system() == 'Linux':
+        try:
+            return _InotifyWatcher()
+        except (OSError, AttributeError):
+            # AttributeError comes from ctypes if the functions don't
+            # exist, that shouldn't happen on linux but who knows...
+            log.warning("cannot use inotify, checking files for changes "
+                        "once a second instead", exc_info=True)
+    return _PollingWatcher()
+
+
+# this doesn't use tkinter, so it can run in a thread
+def _diff(old_lines, new_lines):
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines)
+    return [opcode for opcode in matcher.get_opcodes()
+            if opcode[0] != 'equal']
+
+
+def _apply_diff(textwidget, opcodes, new_lines):
+    """Apply opcodes from _diff() to the text widget.
+
+    Only the lines that changed are touched, and everything is one step
+    in the undo history.
+    """
+    autoseparators = textwidget['autoseparators']
+    textwidget['autoseparators'] = False
+    textwidget.edit_separator()
+    try:
+        # the line numbers of the old lines before a change stay the
+        # same if things are changed from the end to the beginning
+        for tag, i1, i2, j1, j2 in reversed(opcodes):
+            start = '%d.0' % (i1 + 1)
+            textwidget.delete(start, '%d.0' % (i2 + 1))
+            textwidget.insert(start, ''.join(new_lines[j1:j2]))
+    finally:
+        textwidget.edit_separator()
+        textwidget['autoseparators'] = autoseparators
+
+
+class _ReloadManager:
+
+    def __init__(self, watcher):
+        self._watcher = watcher
+        self._paths = {}        # {tab: path}
+        self._reloading = set()
+
+    def on_new_tab(self, tab):
+        tab.bind('<<PathChanged>>', self._on_path_changed, add=True)
+        tab.bind('<Destroy>', self._on_destroy, add=True)
+        self._set_path(tab, tab.path)
+
+    def _on_path_changed(self, event):
+        self._set_path(event.widget, event.widget.path)
+
+    def _on_destroy(self, event):
+        if event.widget in self._paths:
+            self._set_path(event.widget, None)
+
+    def _set_path(self, tab, path):
+        old_path = self._paths.pop(tab, None)
+        if old_path is not None:
+            self._watcher.unwatch(old_path)
+        if path is not None:
+            self._paths[tab] = path
+            self._watcher.watch(path)
+
+    def poll(self):
+        changed = set()
+        while True:
+            try:
+                changed.add(self._watcher.changed_paths.get(block=False))
+            except queue.Empty:
+                break
+
+        for tab, path in list(self._paths.items()):
+            if path in changed and tab not in self._reloading:
+                self._check_tab(tab)
+
+        get_tab_manager().after(200, self.poll)
+
+    def _check_tab(self, tab):
+        if tab.loading:
+            # the loading thread is reading the new content anyway
+            return
+
+        # the hibernation file doesn't know about the change, and waking
+        # up is easier than reloading a hibernated tab
+        tab.wake_up()
+        self._reloading.add(tab)
+        path = tab.path
+        encoding = tab.encoding
+        old_content = tab.textwidget.get('1.0', 'end - 1 char')
+
+        # returns None if nothing needs to be done
+        def read_and_diff():
+            # porcupine's own saves must be ignored even if the user has
+            # typed something after saving, comparing the content with
+            # the text widget isn't enough for that
+            with open(path, 'r', encoding=encoding) as file:
+                stat = os.fstat(file.fileno())
+                if tab.is_own_write(path, stat):
+                    return None
+                new_content = file.read()
+            if new_content == old_content:
+                return None
+
+            new_lines = new_content.splitlines(keepends=True)
+            opcodes = _diff(old_content.splitlines(keepends=True),
+                            new_lines)
+            return (opcodes, new_lines)
+
+        def done(success, result):
+            self._reloading.discard(tab)
+            if not tab.winfo_exists() or tab.path != path:
+                return
+            if not success:
+                # the file was deleted or something, the user will
+                # notice that when saving
+                log.warning("cannot reload '%s'\n%s", path, result)
+                return
+            if result is None:
+                return
+            if tab.textwidget.get('1.0', 'end - 1 char') != old_content:
+                # changed while the thread was running, try again
+                self._check_tab(tab)
+                return
+
+            if not tab.is_saved():
+                get_tab_manager().current_tab = tab
+                if not messagebox.askyesno(
+                        "File changed",
+                        ("%s has been changed by another program. Do you "
+                         "want to reload it and lose your changes?")
+                        % os.path.basename(path)):
+                    return
+
+            log.info("reloading '%s'", path)
+            _apply_diff(tab.textwidget, *result)
+            tab.mark_saved()
+
+        utils.run_in_thread(read_and_diff, done)
+
+
+def setup():
+    watcher = _create_watcher()
+    watcher.start()
+    manager = _ReloadManager(watcher)
+    get_tab_manager().add_new_tab_callback(manager.on_new_tab,
+                                           tabs.FileTab)
+    get_tab_manager().after(200, manager.poll)
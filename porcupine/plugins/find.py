@@ -1,222 +1,705 @@
 """Find/replace widget."""
+import array
+import bisect
+import functools
+import queue
 import re
+import threading
 import tkinter as tk
+from tkinter import ttk
 import weakref
 
+import pygments.styles
+
 import porcupine
-from porcupine import utils, tabs
+from porcupine import get_tab_manager, settings, tabs
 
 find_widgets = weakref.WeakKeyDictionary()
 
+# only the matches on the visible lines and this many lines above and
+# below them are highlighted
+_HIGHLIGHT_MARGIN = 100
+
+# files bigger than this many characters are searched in a thread
+_BACKGROUND_SEARCH_SIZE = 1024 * 1024
+_SCAN_BATCH_LINES = 10000
+_SCAN_POLL_INTERVAL = 50       # milliseconds
+_RESEARCH_DELAY = 300          # milliseconds
+
+
+@functools.lru_cache(maxsize=32)
+def _compile(text, regex, full_words, match_case):
+    if not regex:
+        text = re.escape(text)
+    if full_words:
+        text = r'\b(?:%s)\b' % text
+    return re.compile(text, 0 if match_case else re.IGNORECASE)
+
+
+def _find_in_lines(pattern, first_lineno, lines):
+    """Yield (lineno, start_column, end_column) tuples.
+
+    Matches never go past the end of a line, and empty matches are
+    ignored because they can't be selected.
+    """
+    for lineno, line in enumerate(lines, start=first_lineno):
+        for match in pattern.finditer(line):
+            if match.end() > match.start():
+                yield (lineno, match.start(), match.end())
+
+
+# this runs in a thread
+def _scan(pattern, content, start_lineno, cancel_event, result_queue):
+    """Search content in batches of lines.
+
+    The search starts from start_lineno and wraps around at the end of
+    the content, so the matches after the cursor are found first. Puts
+    (first_lineno, last_lineno, matches) tuples to result_queue, and
+    None when everything has been searched.
+    """
+    lines = content.split('\n')
+    del content     # free some memory before the slow part
+    first_linenos = list(range(1, len(lines) + 1, _SCAN_BATCH_LINES))
+    split = bisect.bisect_right(first_linenos, start_lineno) - 1
+    for first_lineno in first_linenos[split:] + first_linenos[:split]:
+        if cancel_event.is_set():
+            return
+        batch = lines[first_lineno - 1:first_lineno - 1 + _SCAN_BATCH_LINES]
+        result_queue.put((first_lineno, first_lineno + len(batch) - 1,
+                          list(_find_in_lines(pattern, first_lineno, batch))))
+    result_queue.put(None)
+
+
+def _replace_line(line, spans, pattern, template):
+    if pattern is None:
+        pieces = []
+        column = 0
+        for start, end in spans:
+            pieces.append(line[column:start])
+            pieces.append(template)
+            column = end
+        pieces.append(line[column:])
+        return ''.join(pieces)
+
+    # subn() is a lot faster than expanding the template for each match
+    # separately, but it replaces empty matches too and _find_in_lines()
+    # skips them
+    result, count = pattern.subn(template, line)
+    if count == len(spans):
+        return result
+
+    pieces = []
+    column = 0
+    for start, end in spans:
+        pieces.append(line[column:start])
+        pieces.append(pattern.match(line, start).expand(template))
+        column = end
+    pieces.append(line[column:])
+    return ''.join(pieces)
+
+
+def _replace_in_lines(lines, first_lineno, matches, pattern, template):
+    """Replace matches in a list of lines in-place.
+
+    lines[0] is the line number first_lineno. If pattern is not None,
+    the template is expanded like in :meth:`re.Match.expand`. This runs
+    once for all matches, so it must be fast even if there are 100000
+    matches.
+    """
+    if pattern is not None and '\\' not in template:
+        # nothing to expand, and the template is a plain string
+        pattern = None
+
+    current_lineno = None
+    spans = []
+    for lineno, start, end in matches:
+        if lineno != current_lineno:
+            if spans:
+                index = current_lineno - first_lineno
+                lines[index] = _replace_line(
+                    lines[index], spans, pattern, template)
+                spans.clear()
+            current_lineno = lineno
+        spans.append((start, end))
+
+    if spans:
+        index = current_lineno - first_lineno
+        lines[index] = _replace_line(lines[index], spans, pattern, template)
+
+
+class _Matches:
+    """A sorted list of matches.
+
+    Each match is a (lineno, start_column, end_column) tuple, but they
+    are stored in arrays of C integers to save memory.
+    """
 
-class Finder(tk.Frame):
+    def __init__(self, matches=()):
+        self._linenos = array.array('l')
+        self._starts = array.array('l')
+        self._ends = array.array('l')
+        for lineno, start, end in matches:
+            self._linenos.append(lineno)
+            self._starts.append(start)
+            self._ends.append(end)
+
+    def __len__(self):
+        return len(self._linenos)
+
+    def __getitem__(self, index):
+        return (self._linenos[index], self._starts[index], self._ends[index])
+
+    def __iter__(self):
+        return zip(self._linenos, self._starts, self._ends)
+
+    def index_after(self, lineno, column):
+        """Return the index of the first match at or after a location.
+
+        If there are no such matches, ``len(self)`` is returned.
+        """
+        index = bisect.bisect_left(self._linenos, lineno)
+        while (index < len(self) and self._linenos[index] == lineno and
+               self._starts[index] < column):
+            index += 1
+        return index
+
+    def index_of(self, lineno, start, end):
+        """Return the index of a match, or None if it's not a match."""
+        index = self.index_after(lineno, start)
+        if index < len(self) and self[index] == (lineno, start, end):
+            return index
+        return None
+
+    def indexes_between(self, first_lineno, last_lineno):
+        """Return a range of indexes of the matches on some lines.
+
+        Both line numbers are inclusive.
+        """
+        return range(bisect.bisect_left(self._linenos, first_lineno),
+                     bisect.bisect_right(self._linenos, last_lineno))
+
+    def replace_lines(self, first_lineno, last_lineno, lineno_diff,
+                      new_matches):
+        """Update the matches after changing some lines.
+
+        The matches on lines first_lineno...last_lineno (inclusive) are
+        replaced with new_matches, and lineno_diff is added to the line
+        numbers of the matches after them.
+        """
+        first = bisect.bisect_left(self._linenos, first_lineno)
+        last = bisect.bisect_right(self._linenos, last_lineno)
+        if lineno_diff != 0:
+            linenos = self._linenos     # local variables are faster
+            for index in range(last, len(linenos)):
+                linenos[index] += lineno_diff
+
+        new = _Matches(new_matches)
+        self._linenos[first:last] = new._linenos
+        self._starts[first:last] = new._starts
+        self._ends[first:last] = new._ends
+
+
+class Finder(ttk.Frame):
     """A widget for finding and replacing text.
 
     Use the pack geometry manager with this widget.
+
+    The text widget is searched as the user types. The matches are
+    kept up to date with :meth:`~porcupine.textwidget.HandyText.\
+add_change_callback` while the finder is showing, so after an edit,
+    only the changed lines are searched again.
+
+    All matches are highlighted, but to keep things fast with huge
+    files, only the matches near the visible part of the text widget
+    are tagged. The tags are updated when the text widget scrolls.
+
+    Big files are searched in a thread, and the matches are shown as
+    they are found. Editing the file while that's running cancels the
+    search, and it's started again when the user stops typing.
     """
 
     def __init__(self, parent, textwidget, **kwargs):
         super().__init__(parent, **kwargs)
-
-        self._last_pattern = None
-        self._matches = None
+        self._textwidget = textwidget
+        self._pattern = None    # a compiled regex, or None if no pattern
+        self._matches = None    # a _Matches object when there's a pattern
+        self._search_start = '1.0'
+        self._status_after_id = None
+        self._showing = False
+        self._highlight_after_id = None
+        self._highlighted_lines = None    # (first, last) or None
+        self._scan = None           # (cancel_event, result_queue) or None
+        self._scan_after_id = None
+        self._research_after_id = None
+        self._select_when_found = False
 
         self.grid_columnconfigure(1, weight=1)
-        self._textwidget = textwidget
 
-        entrygrid = tk.Frame(self)
+        entrygrid = ttk.Frame(self)
         entrygrid.grid(row=0, column=0)
-        self._find_entry = self._add_entry(entrygrid, 0, "Find:", self.find)
+        self._find_var = tk.StringVar()
+        self._find_entry = self._add_entry(entrygrid, 0, "Find:",
+                                           self._find_var)
         self._replace_entry = self._add_entry(entrygrid, 1, "Replace with:")
+        self._find_entry.bind('<Return>', lambda event: self.find())
+        self._find_entry.bind(
+            '<Shift-Return>', lambda event: self.find(backwards=True))
 
-        buttonframe = tk.Frame(self)
+        buttonframe = ttk.Frame(self)
         buttonframe.grid(row=1, column=0, sticky='we')
         buttons = [
-            ("Find", self.find),
+            ("Previous", functools.partial(self.find, backwards=True)),
+            ("Next", self.find),
             ("Replace", self.replace),
             ("Replace and find", self.replace_and_find),
             ("Replace all", self.replace_all),
         ]
         for text, command in buttons:
-            button = tk.Button(buttonframe, text=text, command=command)
+            button = ttk.Button(buttonframe, text=text, command=command)
             button.pack(side='left', fill='x', expand=True)
 
+        checkboxframe = ttk.Frame(self)
+        checkboxframe.grid(row=0, column=1, sticky='nw')
+        self._match_case_var = tk.BooleanVar()
         self._full_words_var = tk.BooleanVar()
-        checkbox = utils.Checkbox(self, text="Full words only",
-                                  variable=self._full_words_var)
-        checkbox.grid(row=0, column=1, sticky='nw')
-
-        self._statuslabel = tk.Label(self)
+        self._regex_var = tk.BooleanVar()
+        for text, var in [("Match case", self._match_case_var),
+                          ("Full words only", self._full_words_var),
+                          ("Regular expression", self._regex_var)]:
+            checkbox = ttk.Checkbutton(checkboxframe, text=text, variable=var,
+                                       command=self._on_pattern_changed)
+            checkbox.pack(side='left')
+
+        self._statuslabel = ttk.Label(self)
         self._statuslabel.grid(row=1, column=1, columnspan=2, sticky='nswe')
 
-        closebutton = tk.Label(self, image=utils.get_image('closebutton.gif'))
+        closebutton = ttk.Label(self, image='img_closebutton')
         closebutton.grid(row=0, column=2, sticky='ne')
-        closebutton.bind('<Button-1>', lambda event: self.pack_forget())
-
-    def _add_entry(self, frame, row, text, callback=None):
-        tk.Label(frame, text=text).grid(row=row, column=0)
-        entry = tk.Entry(frame, width=35, font='TkFixedFont')
-        entry.bind('<Escape>', lambda event: self.pack_forget())
-        if callback is not None:
-            entry.bind('<Return>', lambda event: callback())
+        closebutton.bind('<Button-1>', lambda event: self.hide())
+
+        self._find_var.trace('w', self._on_pattern_changed)
+        textwidget.add_change_callback(self._on_change)
+
+        # the linenumbers plugin sets its own yscrollcommand, so this
+        # must not replace it
+        old_yscrollcommand = str(textwidget['yscrollcommand'])
+
+        def yscrollcommand(*args):
+            if old_yscrollcommand:
+                self.tk.call('eval', old_yscrollcommand, *args)
+            if self._matches is not None:
+                self._schedule_highlight(force=False)
+
+        textwidget['yscrollcommand'] = yscrollcommand
+
+        config = settings.get_section('General')
+        config.connect('pygments_style', self._set_style, run_now=True)
+        textwidget.tag_lower('find_highlight', 'sel')
+        self.bind('<Destroy>', self._on_destroy, add=True)
+
+    def _on_destroy(self, event):
+        if event.widget is self:
+            self._cancel_search()
+            settings.get_section('General').disconnect(
+                'pygments_style', self._set_style)
+
+    def _set_style(self, name):
+        style = pygments.styles.get_style_by_name(name)
+        self._textwidget.tag_config(
+            'find_highlight', background=style.highlight_color)
+
+    def _add_entry(self, frame, row, text, textvariable=None):
+        ttk.Label(frame, text=text).grid(row=row, column=0)
+        entry = ttk.Entry(frame, width=35, font='TkFixedFont',
+                          textvariable=textvariable)
+        entry.bind('<Escape>', lambda event: self.hide())
         entry.grid(row=row, column=1, sticky='we')
         return entry
 
-    # reset this when showing
+    # search when showing
     def pack(self, *args, **kwargs):
-        self.reset()
         super().pack(*args, **kwargs)
+        self._showing = True
+        self._find_entry.focus()
+        self._find_entry.selection_range(0, 'end')
+        self._search_start = self._textwidget.index('insert')
+        self._on_pattern_changed()
+
+    def hide(self):
+        """Hide the finder and forget the matches."""
+        self.pack_forget()
+        self._showing = False
+        self._cancel_search()
+        self._pattern = None
+        self._matches = None
+        self._schedule_highlight()
+        self._textwidget.focus()
+
+    def _set_status(self, text):
+        if self._status_after_id is not None:
+            self.after_cancel(self._status_after_id)
+            self._status_after_id = None
+        self._statuslabel['text'] = text
+
+    # counting where the selected match is in the matches takes some
+    # time, so it's done only once after a bunch of changes
+    def _schedule_status_update(self):
+        if self._status_after_id is None:
+            self._status_after_id = self.after_idle(self._update_status)
+
+    def _update_status(self):
+        self._status_after_id = None
+        if self._matches is None:
+            return
+        if not self._matches:
+            if self._is_searching():
+                self._statuslabel['text'] = "Searching..."
+            else:
+                self._statuslabel['text'] = "No matches"
+            return
 
-    def _next_match(self, start_from=0):
-        what = self._find_entry.get()
-        full_words = self._full_words_var.get()
-
-        if not what:
-            self._statuslabel['text'] = "Cannot find an emptiness!"
-            return None
-        if full_words:
-            regexp = r"\b%s\b" % re.escape(what)
+        index = self._get_selected_index()
+        if index is None:
+            text = "%d matches" % len(self._matches)
         else:
-            regexp = re.escape(what)
-
-        found_matches = True
-
-        if self._last_pattern != regexp:
-            matches = []
-            for y, line in enumerate(self._textwidget.iter_lines()):
-                if y < start_from:
-                    continue
+            text = "%d of %d matches" % (index + 1, len(self._matches))
+        if self._is_searching():
+            text += " (searching...)"
+        self._statuslabel['text'] = text
+
+    # returns None if the selected text is not a match
+    def _get_selected_index(self):
+        try:
+            start = self._textwidget.index('sel.first')
+            end = self._textwidget.index('sel.last')
+        except tk.TclError:
+            return None
 
-                for match in re.finditer(regexp, line):
-                    matches.append((y + 1, match.start(),
-                                    match.end() - match.start()))
+        lineno, start_column = map(int, start.split('.'))
+        end_lineno, end_column = map(int, end.split('.'))
+        if end_lineno != lineno:
+            return None
+        return self._matches.index_of(lineno, start_column, end_column)
+
+    def _is_searching(self):
+        return (self._scan is not None or
+                self._research_after_id is not None)
+
+    def _cancel_search(self):
+        if self._scan is not None:
+            self._scan[0].set()
+            self._scan = None
+        if self._scan_after_id is not None:
+            self.after_cancel(self._scan_after_id)
+            self._scan_after_id = None
+        if self._research_after_id is not None:
+            self.after_cancel(self._research_after_id)
+            self._research_after_id = None
+
+    def _search(self, select=False):
+        """Find the matches of the pattern that the user typed.
+
+        If select is True, the first match after the search start is
+        selected when it's found.
+        """
+        self._cancel_search()
+        self._pattern = None
+        self._matches = None
+        self._select_when_found = False
+        self._schedule_highlight()
 
-            found_matches = bool(self._matches)
-            self._last_pattern = regexp
-            self._matches = iter(matches)
+        text = self._find_var.get()
+        if not text:
+            self._set_status('')
+            return
 
-        # If we have exhausted our matches, and there were matches before, we
-        # restart the finding process.
-        next_match = next(self._matches, None)
-        if found_matches and next_match is None:
-            self._last_pattern = None
-            return self._next_match()
-        return next_match
+        try:
+            self._pattern = _compile(
+                text, self._regex_var.get(), self._full_words_var.get(),
+                self._match_case_var.get())
+        except re.error as e:
+            self._set_status("Invalid regular expression: %s" % e)
+            return
 
-    def find(self, start_from=0):
-        match = self._next_match(start_from)
+        content = self._textwidget.get('1.0', 'end - 1 char')
+        if len(content) < _BACKGROUND_SEARCH_SIZE:
+            self._matches = _Matches(
+                _find_in_lines(self._pattern, 1, content.split('\n')))
+            if select:
+                self._select_after_search_start(wrap=True)
+        else:
+            self._matches = _Matches()
+            self._select_when_found = select
+            cancel_event = threading.Event()
+            result_queue = queue.Queue()
+            thread = threading.Thread(target=_scan, daemon=True, args=[
+                self._pattern, content, int(self._search_start.split('.')[0]),
+                cancel_event, result_queue])
+            thread.start()
+            self._scan = (cancel_event, result_queue)
+            self._scan_after_id = self.after(_SCAN_POLL_INTERVAL,
+                                             self._poll_scan)
+
+        self._schedule_status_update()
+        self._schedule_highlight()
+
+    def _poll_scan(self):
+        self._scan_after_id = None
+        cancel_event, result_queue = self._scan
+        done = False
+        while True:
+            try:
+                item = result_queue.get(block=False)
+            except queue.Empty:
+                break
+            if item is None:
+                done = True
+                break
+            first_lineno, last_lineno, matches = item
+            self._matches.replace_lines(first_lineno, last_lineno, 0, matches)
+
+        if done:
+            self._scan = None
+        else:
+            self._scan_after_id = self.after(_SCAN_POLL_INTERVAL,
+                                             self._poll_scan)
+
+        if self._select_when_found:
+            # the first match after the search start is usually found
+            # first, but the matches before it are found at the end
+            self._select_after_search_start(wrap=done)
+        self._schedule_status_update()
+        self._schedule_highlight()
+
+    # returns True if something was selected
+    def _select_after_search_start(self, wrap):
+        lineno, column = map(int, self._search_start.split('.'))
+        index = self._matches.index_after(lineno, column)
+        if index == len(self._matches):
+            if not wrap:
+                return False
+            if not self._matches:
+                self._select_when_found = False
+                self._textwidget.tag_remove('sel', '1.0', 'end')
+                return False
+            index = 0
+
+        # searching as the user types, so the selected match stays the
+        # same when the pattern e.g. changes from 'fo' to 'foo'
+        self._select(index)
+        return True
+
+    def _on_pattern_changed(self, *junk):
+        if self._showing:
+            self._search(select=True)
+
+    def _research(self):
+        self._research_after_id = None
+        self._search()
+
+    def _on_change(self, start, end, new_text):
+        if self._matches is None:
+            return
+        if self._is_searching():
+            # the line numbers of the snapshot don't match the text
+            # widget anymore, so the search must be started over
+            self._cancel_search()
+            self._matches = _Matches()
+            self._research_after_id = self.after(_RESEARCH_DELAY,
+                                                 self._research)
+            self._schedule_status_update()
+            self._schedule_highlight()
+            return
 
-        if match is not None:
-            self._statuslabel['text'] = ''
+        first_lineno = int(start.split('.')[0])
+        old_last_lineno = int(end.split('.')[0])
+        new_last_lineno = first_lineno + new_text.count('\n')
+
+        lines = self._textwidget.get(
+            '%d.0' % first_lineno, '%d.0 lineend' % new_last_lineno)
+        self._matches.replace_lines(
+            first_lineno, old_last_lineno, new_last_lineno - old_last_lineno,
+            _find_in_lines(self._pattern, first_lineno, lines.split('\n')))
+        self._schedule_status_update()
+        self._schedule_highlight()
+
+    # scrolling calls this with force=False, and then nothing is done if
+    # the highlighted lines are already visible
+    def _schedule_highlight(self, force=True):
+        if force:
+            self._highlighted_lines = None
+        if self._highlight_after_id is None:
+            self._highlight_after_id = self.after_idle(self._highlight)
+
+    def _highlight(self):
+        self._highlight_after_id = None
+        if self._matches is None:
+            self._textwidget.tag_remove('find_highlight', '1.0', 'end')
+            self._highlighted_lines = None
+            return
 
-            line, col, match_len = match
+        first_visible = int(self._textwidget.index('@0,0').split('.')[0])
+        last_visible = int(self._textwidget.index(
+            '@0,%d' % self._textwidget.winfo_height()).split('.')[0])
+        if (self._highlighted_lines is not None and
+                self._highlighted_lines[0] <= first_visible and
+                last_visible <= self._highlighted_lines[1]):
+            return
 
-            start = "%d.%d" % (line, col)
-            end = "%s + %d chars" % (start, match_len)
+        first_lineno = max(first_visible - _HIGHLIGHT_MARGIN, 1)
+        last_lineno = last_visible + _HIGHLIGHT_MARGIN
+        self._textwidget.tag_remove('find_highlight', '1.0', 'end')
+        indexes = []
+        for index in self._matches.indexes_between(first_lineno,
+                                                   last_lineno):
+            lineno, start, end = self._matches[index]
+            indexes.append('%d.%d' % (lineno, start))
+            indexes.append('%d.%d' % (lineno, end))
+        if indexes:
+            self._textwidget.tag_add('find_highlight', *indexes)
+        self._highlighted_lines = (first_lineno, last_lineno)
+
+    def _select(self, index):
+        lineno, start, end = self._matches[index]
+        start = '%d.%d' % (lineno, start)
+        end = '%d.%d' % (lineno, end)
+        self._textwidget.tag_remove('sel', '1.0', 'end')
+        self._textwidget.tag_add('sel', start, end)
+        self._textwidget.mark_set('insert', start)
+        self._textwidget.see(start)
+        self._select_when_found = False
+        self._schedule_status_update()
+
+    def find(self, backwards=False):
+        """Select the next or previous match.
+
+        The search starts from the selection or the cursor, and it
+        wraps around at the end or beginning of the file. Returns True
+        if a match was selected.
+        """
+        if self._matches is None:
+            return False
+        if not self._matches:
+            if self._is_searching():
+                self._set_status("Searching...")
+            else:
+                self._set_status("No matches")
+            return False
+
+        try:
+            start = self._textwidget.index(
+                'sel.first' if backwards else 'sel.last')
+        except tk.TclError:
+            start = self._textwidget.index('insert')
+        lineno, column = map(int, start.split('.'))
+
+        index = self._matches.index_after(lineno, column)
+        if backwards:
+            index -= 1
+        self._select(index % len(self._matches))
+        return True
+
+    # returns the selected match, or None
+    def _get_selected_match(self):
+        if self._matches is None:
+            return None
+        index = self._get_selected_index()
+        if index is None:
+            return None
 
-            self._textwidget.tag_remove('sel', '1.0', 'end')
-            self._textwidget.tag_add('sel', start, end)
-            self._textwidget.mark_set('insert', start)
-            self._textwidget.see(start)
-            return True
+        lineno, start, end = self._matches[index]
+        line = self._textwidget.get('%d.0' % lineno, '%d.0 lineend' % lineno)
+        return (lineno, self._pattern.match(line, start))
 
-        self._statuslabel['text'] = "I can't find it :("
-        return False
+    def _expand(self, match):
+        if self._regex_var.get():
+            return match.expand(self._replace_entry.get())
+        return self._replace_entry.get()
 
     def replace(self):
-        find_text = self._find_entry.get()
-        if not find_text:
-            self._statuslabel['text'] = "Cannot replace an emptiness!"
-            return
-        elif self._last_pattern is None:
-            self._statuslabel['text'] = "Press find first!"
-            return
-
-        start, end = self._textwidget.tag_ranges('sel')
-        if self._textwidget.index(start) == self._textwidget.index(end):
-            # empty area selected
-            self._statuslabel['text'] = "Nothing selected!"
-            return
-
-        if not re.match(self._last_pattern, self._textwidget.get(start, end)):
-            # wrong text selected
-            self._statuslabel['text'] = "Wrong text selected!"
-
-        replace_text = self._replace_entry.get()
-        self._textwidget.delete(start, end)
-        self._textwidget.insert(start, replace_text)
-        new_end = '%s + %d chars' % (start, len(replace_text))
-        self._textwidget.tag_add('sel', start, new_end)
+        """Replace the selected match.
+
+        Returns False if the selection is not a match.
+        """
+        selected = self._get_selected_match()
+        if selected is None:
+            self._set_status("Select a match first!")
+            return False
+
+        lineno, match = selected
+        start = '%d.%d' % (lineno, match.start())
+        end = '%d.%d' % (lineno, match.end())
+        replacement = self._expand(match)
+        self._textwidget.replace(start, end, replacement)
+
+        # the next find() starts after the replacement, so replacing
+        # 'a' with 'aa' doesn't find the new 'a'
+        self._textwidget.tag_remove('sel', '1.0', 'end')
+        self._textwidget.mark_set(
+            'insert', '%s + %d chars' % (start, len(replacement)))
+        return True
 
     def replace_and_find(self):
-        # We do this weird trickery with starting from the line the last
-        # replacement was on because we don't want to get stuck in an infinite
-        # loop when the replacement contains the pattern.
-        line, _ = map(int, self._textwidget.index("insert").split("."))
-        self.replace()
-
-        # If we wanted to start from the same line, we'd say line - 1.
-        # Here we want the line after the current one, so we just say line.
-        # This is cause tkinter's lines are 1-based but self.find takes 0-based
-        # lines.
-        # TODO: Should this cycle?
-        self.find(start_from=line)
+        if self.replace():
+            self.find()
 
     def replace_all(self):
-        old_cursor_pos = self._textwidget.index("insert")
-
-        # See replace_and_find for an explanation as to why we do this weird
-        # keeping-track-of-the-line trickery.
-        count = 0
-        line = 1
-        while self.find(line):
-            self.replace()
+        """Replace all matches as one undoable change.
+
+        The new text is built in Python from one snapshot of the lines
+        that contain matches, and it's put to the text widget with one
+        ``replace`` call. That's much faster than replacing each match
+        separately when there are many matches.
+        """
+        if self._is_searching():
+            self._set_status("Wait for the search to finish first.")
+            return
+        if not self._matches:
+            self._set_status("No matches")
+            return
 
-            # See replace_and_find for an explanation as to why we don't
-            # subtract from the line.
-            line, _ = map(int, self._textwidget.index("insert").split("."))
-            count += 1
+        matches = self._matches     # pep8 line length
+        count = len(matches)
+        first_lineno = matches[0][0]
+        last_lineno = matches[count - 1][0]
+        start = '%d.0' % first_lineno
+        end = '%d.0 lineend' % last_lineno
+        lines = self._textwidget.get(start, end).split('\n')
 
+        if self._regex_var.get():
+            pattern = self._pattern
+        else:
+            pattern = None
+        _replace_in_lines(lines, first_lineno, matches, pattern,
+                          self._replace_entry.get())
+
+        cursor_pos = self._textwidget.index('insert')
+        autoseparators = self._textwidget['autoseparators']
+        self._textwidget['autoseparators'] = False
+        self._textwidget.edit_separator()
+        try:
+            self._textwidget.replace(start, end, '\n'.join(lines))
+        finally:
+            self._textwidget.edit_separator()
+            self._textwidget['autoseparators'] = autoseparators
         self._textwidget.tag_remove('sel', '1.0', 'end')
-        self._textwidget.mark_set("insert", old_cursor_pos)
+        self._textwidget.mark_set('insert', cursor_pos)
 
         if count == 1:
-            self._statuslabel['text'] = "Replaced 1 occurence."
+            self._set_status("Replaced 1 occurence.")
         else:
-            self._statuslabel['text'] = "Replaced %d occurences." % count
-
-    def reset(self):
-        self._statuslabel['text'] = ''
-        self._find_entry.focus()
-        self._last_pattern = None
-        self._matches = None
+            self._set_status("Replaced %d occurences." % count)
 
 
+# the finders are created when they're needed, most tabs never need one
 def find():
-    current_tab = porcupine.get_tab_manager().current_tab
-    find_widgets[current_tab].pack(fill='x')
-
-
-def on_new_tab(event):
-    tab = event.widget.current_tab
-
-    if isinstance(tab, tabs.FileTab):
+    tab = get_tab_manager().current_tab
+    if tab not in find_widgets:
         find_widgets[tab] = Finder(tab, tab.textwidget)
-        tab.textwidget.bind("<<ContentChanged>>",
-                            lambda _: find_widgets[tab].reset(),
-                            add=True)
-
-
-def on_tab_changed(event):
-    current_tab = event.widget.current_tab
-    if current_tab in find_widgets:
-        find_widgets[current_tab].reset()
+    find_widgets[tab].pack(fill='x')
 
 
 def setup():
     porcupine.add_action(find,
                          "Edit/Find and Replace", ("Ctrl+F", '<Control-f>'),
-                         tabtypes=[porcupine.tabs.FileTab])
-    tab_manager = porcupine.get_tab_manager()
-    tab_manager.bind("<<NewTab>>", on_new_tab, add=True)
-    tab_manager.bind("<<CurrentTabChanged>>", on_tab_changed, add=True)
+                         tabtypes=[tabs.FileTab])
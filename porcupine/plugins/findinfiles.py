@@ -0,0 +1,607 @@
+"""Search for text in all files of a directory.
+
+The files are listed with ``git ls-files`` if the directory is in a git
+repository, so gitignored files are skipped. Otherwise all files are
+searched except the ones in hidden directories like ``.hg``. Binary
+files are always skipped.
+
+The files are searched in a pool of processes that is created when
+searching for the first time and reused after that. The matches show up
+in a Find in Files tab while the other files are still being searched.
+Clicking a match opens the file in a new tab.
+
+By default, a trigram index from :source:`porcupine/plugins/_trigrams.py`
+is used for finding the files that may contain matches, and only those
+files are searched. The index is updated before each search, so only
+the files that changed since the previous search are read.
+"""
+
+import atexit
+import collections
+import functools
+import logging
+import mmap
+import multiprocessing
+import os
+import queue
+import re
+import subprocess
+import threading
+import time
+import tkinter as tk
+from tkinter import filedialog, ttk
+import traceback
+
+import porcupine
+from porcupine import get_tab_manager, tabs, utils
+from porcupine.plugins import _trigrams
+from porcupine.textwidget import ThemedText
+
+log = logging.getLogger(__name__)
+
+_BINARY_CHECK_SIZE = 8 * 1024    # bytes from the beginning of the file
+_CHUNK_SIZE = 32                 # files per task for the process pool
+_MAX_LINE_LENGTH = 200           # characters of each line in the results
+_MAX_MATCHES = 10000
+_POLL_INTERVAL = 50              # milliseconds
+
+
+def _list_files(directory):
+    """Yield paths of the files in a directory that should be searched."""
+    try:
+        output = subprocess.check_output(
+            ['git', 'ls-files', '-z', '--cached', '--others',
+             '--exclude-standard'],
+            cwd=directory, stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        # git is not installed or this is not a git repository
+        for dirpath, dirnames, filenames in os.walk(directory):
+            dirnames[:] = [name for name in dirnames
+                           if not name.startswith('.')]
+            for name in filenames:
+                yield os.path.join(dirpath, name)
+        return
+
+    for name in os.fsdecode(output).split('\0'):
+        if name:
+            yield os.path.join(directory, name)
+
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# the rest of the module-level functions run in the worker processes
+
+@functools.lru_cache(maxsize=8)
+def _compile(text, regex, match_case):
+    if not regex:
+        text = re.escape(text)
+    return re.compile(text, 0 if match_case else re.IGNORECASE)
+
+
+def _read_file(path, needle):
+    """Return the content of a file as a string, or None to skip it.
+
+    If *needle* is not None, the file is skipped if it doesn't contain
+    it. That's a lot faster than decoding the file and searching it
+    with a regex.
+    """
+    with open(path, 'rb') as file:
+        # mmap doesn't like empty files
+        if os.fstat(file.fileno()).st_size == 0:
+            return None
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if b'\0' in data[:_BINARY_CHECK_SIZE]:
+                return None
+            if needle is not None and data.find(needle) == -1:
+                return None
+            return data[:].decode('utf-8', errors='replace')
+
+
+def _search_content(pattern, content):
+    """Yield (lineno, start_column, end_column, line) tuples.
+
+    Only the first match of each line is yielded, like grep does.
+    """
+    lineno = 1
+    previous_start = 0
+    previous_lineno = None
+    for match in pattern.finditer(content):
+        if match.start() == match.end():
+            continue
+
+        lineno += content.count('\n', previous_start, match.start())
+        previous_start = match.start()
+        if lineno == previous_lineno:
+            continue
+        previous_lineno = lineno
+
+        line_start = content.rfind('\n', 0, match.start()) + 1
+        line_end = content.find('\n', match.start())
+        if line_end == -1:
+            line_end = len(content)
+        yield (lineno, match.start() - line_start,
+               min(match.end(), line_end) - line_start,
+               content[line_start:line_end])
+
+
+def _search_chunk(args):
+    """Search some files.
+
+    Returns (number_of_files, [(path, lineno, start, end, line), ...]).
+    """
+    (text, regex, match_case), paths = args
+    pattern = _compile(text, regex, match_case)
+    needle = None if (regex or not match_case) else text.encode('utf-8')
+
+    results = []
+    for path in paths:
+        try:
+            content = _read_file(path, needle)
+        except (OSError, ValueError):
+            # the file was removed or it's not a regular file, mmap
+            # raises ValueError for some special files
+            continue
+        if content is not None:
+            results.extend((path,) + match for match in
+                           _search_content(pattern, content))
+    return (len(paths), results)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # porcupine runs many threads, and forking a process with
+            # threads can deadlock if a thread is holding a lock when
+            # forking, e.g. the logging module's lock
+            if 'forkserver' in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context('forkserver')
+            else:
+                context = multiprocessing.get_context('spawn')
+            _pool = context.Pool()
+            atexit.register(_pool.terminate)
+        return _pool
+
+
+def _run_in_pool(function, tasks, cancel_event):
+    """Like ``_get_pool().imap(function, tasks)``, but cancellable.
+
+    The pool is shared by all searches, so a cancelled search must not
+    leave lots of tasks in it. Only a few tasks per process are given to
+    the pool at a time.
+    """
+    pool = _get_pool()
+    max_pending = 4 * (os.cpu_count() or 1)
+    pending = collections.deque()
+    for task in tasks:
+        if cancel_event.is_set():
+            return
+        pending.append(pool.apply_async(function, [task]))
+        if len(pending) >= max_pending:
+            yield pending.popleft().get()
+    while pending:
+        if cancel_event.is_set():
+            return
+        yield pending.popleft().get()
+
+
+# this runs in a thread in the main process
+def _run_search(directory, pattern_args, use_index, rebuild_index,
+                result_queue, cancel_event):
+    """Search the files of a directory with a process pool.
+
+    If *pattern_args* is None, this only updates the index. Puts these
+    tuples to *result_queue*:
+
+    * ``('indexing', number_of_done_files, number_of_all_files)``
+    * ``('index', number_of_files, updated)`` after updating the index
+    * ``('files', number_of_files_to_search, number_of_all_files)``
+    * ``('results', number_of_files, results)``
+    * ``('done', error_message_or_None)`` at the end
+    """
+    def map_function(function, tasks):
+        return _run_in_pool(function, tasks, cancel_event)
+
+    searched = set()
+
+    # returns False if cancelled
+    def search(paths):
+        searched.update(paths)
+        tasks = ((pattern_args, chunk)
+                 for chunk in _chunks(paths, _CHUNK_SIZE))
+        for file_count, results in map_function(_search_chunk, tasks):
+            if cancel_event.is_set():
+                return False
+            result_queue.put(('results', file_count, results))
+        return True
+
+    index = None
+    try:
+        if use_index:
+            index = _trigrams.get_index(directory)
+            if rebuild_index:
+                index.clear()
+        if pattern_args is not None:
+            trigrams = _trigrams.get_query_trigrams(*pattern_args)
+
+        # listing and stat-ing all files would delay the first results
+        # a lot in big directories, so the files are first searched
+        # with the index as it was after the previous search
+        if index is not None and pattern_args is not None:
+            file_count, updated = index.get_info()
+            if updated is not None:
+                candidates = index.get_candidates(trigrams)
+                result_queue.put(('files', len(candidates), file_count))
+                if not search(candidates):
+                    return
+
+        # then new and changed files are indexed, and the files that
+        # weren't searched yet are searched
+        paths = list(_list_files(directory))
+        if index is not None:
+            if not index.update(
+                    paths, map_function, cancel_event,
+                    lambda done, total: result_queue.put(
+                        ('indexing', done, total))):
+                return
+            result_queue.put(('index',) + index.get_info())
+
+        if pattern_args is not None:
+            if index is None:
+                more = paths
+            else:
+                more = [path for path in index.get_candidates(trigrams)
+                        if path not in searched]
+            result_queue.put(('files', len(searched) + len(more),
+                              len(paths)))
+            if not search(more):
+                return
+    except Exception:
+        log.exception("searching '%s' failed", directory)
+        result_queue.put(('done', traceback.format_exc()))
+        return
+    finally:
+        if index is not None:
+            try:
+                index.save()
+            except OSError:
+                log.exception("saving '%s' failed", index.path)
+
+    result_queue.put(('done', None))
+
+
+def _go_to(tab, lineno, column):
+    tab.textwidget.tag_remove('sel', '1.0', 'end')
+    tab.textwidget.mark_set('insert', '%d.%d' % (lineno, column))
+    tab.textwidget.see('insert')
+
+
+def _open_location(path, lineno, column):
+    manager = get_tab_manager()
+    for tab in manager.tabs:
+        if isinstance(tab, tabs.FileTab) and tab.path is not None:
+            try:
+                if os.path.samefile(tab.path, path):
+                    break
+            except OSError:
+                continue
+    else:
+        try:
+            tab = tabs.FileTab.open_file(manager, path)
+        except (UnicodeError, OSError) as e:
+            log.exception("opening '%s' failed", path)
+            utils.errordialog(type(e).__name__, "Opening failed!",
+                              traceback.format_exc())
+            return
+        manager.add_tab(tab, make_current=False)
+
+    if tab.loading:
+        tab.bind('<<Loaded>>', lambda event: _go_to(tab, lineno, column),
+                 add=True)
+    else:
+        _go_to(tab, lineno, column)
+    manager.current_tab = tab
+
+
+class FindInFilesTab(tabs.Tab):
+    """A tab for searching the files of a directory."""
+
+    def __init__(self, manager, directory):
+        super().__init__(manager)
+        self.title = "Find in Files"
+        self._directory = None      # the directory being searched
+        self._search = None         # (cancel_event, result_queue) or None
+        self._poll_after_id = None
+        self._locations = []        # (path, lineno, column) for each line
+        self._file_count = 0
+        self._files_to_search = None
+        self._all_files = None
+        self._indexing = None       # (done, total) or None
+        self._match_count = 0
+
+        entrygrid = ttk.Frame(self.top_frame)
+        entrygrid.pack(fill='x')
+        entrygrid.grid_columnconfigure(1, weight=1)
+
+        ttk.Label(entrygrid, text="Find:").grid(row=0, column=0, sticky='w')
+        self._find_entry = ttk.Entry(entrygrid, font='TkFixedFont')
+        self._find_entry.grid(row=0, column=1, columnspan=2, sticky='we')
+        self._find_entry.bind('<Return>', lambda event: self.start_search())
+
+        ttk.Label(entrygrid, text="In directory:").grid(
+            row=1, column=0, sticky='w')
+        self._directory_var = tk.StringVar(value=directory)
+        directory_entry = ttk.Entry(entrygrid,
+                                    textvariable=self._directory_var)
+        directory_entry.grid(row=1, column=1, sticky='we')
+        directory_entry.bind('<Return>', lambda event: self.start_search())
+        ttk.Button(entrygrid, text="Browse...",
+                   command=self._browse).grid(row=1, column=2)
+
+        optionframe = ttk.Frame(self.top_frame)
+        optionframe.pack(fill='x')
+        self._match_case_var = tk.BooleanVar()
+        self._regex_var = tk.BooleanVar()
+        self._use_index_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(optionframe, text="Match case",
+                        variable=self._match_case_var).pack(side='left')
+        ttk.Checkbutton(optionframe, text="Regular expression",
+                        variable=self._regex_var).pack(side='left')
+        ttk.Checkbutton(optionframe, text="Use an index",
+                        variable=self._use_index_var).pack(side='left')
+        self._search_button = ttk.Button(
+            optionframe, text="Search", command=self._on_button)
+        self._search_button.pack(side='right')
+
+        indexframe = ttk.Frame(self.top_frame)
+        indexframe.pack(fill='x')
+        self._index_label = ttk.Label(indexframe)
+        self._index_label.pack(side='left')
+        ttk.Button(indexframe, text="Rebuild index",
+                   command=self.rebuild_index).pack(side='right')
+        self._directory_var.trace('w', self._show_index_file_info)
+        self._show_index_file_info()
+
+        self._results = ThemedText(self, cursor='hand2', wrap='none',
+                                   state='disabled')
+        scrollbar = ttk.Scrollbar(self, command=self._results.yview)
+        self._results['yscrollcommand'] = scrollbar.set
+        scrollbar.pack(side='right', fill='y')
+        self._results.pack(side='left', fill='both', expand=True)
+        self._results.tag_config('location', underline=True)
+        self._results.bind('<Button-1>', self._on_click, add=True)
+
+        self.bind('<Destroy>', self._on_destroy, add=True)
+
+    def on_focus(self):
+        self._find_entry.focus()
+
+    def _browse(self):
+        directory = filedialog.askdirectory(
+            initialdir=self._directory_var.get())
+        if directory:
+            self._directory_var.set(directory)
+
+    def _on_button(self):
+        if self._search is None:
+            self.start_search()
+        else:
+            self.stop_search()
+            self.status = "Search stopped. " + self.status
+
+    def _on_destroy(self, event):
+        if event.widget is self:
+            self.stop_search()
+
+    # the index is loaded to memory when searching, but the size and
+    # modification time of the file are good enough before that
+    def _show_index_file_info(self, *junk):
+        path = _trigrams.get_index_path(
+            os.path.abspath(self._directory_var.get()))
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self._index_label['text'] = "No index yet."
+            return
+        self._index_label['text'] = "Index: %.1f MB, updated %s." % (
+            stat.st_size / (1024 * 1024),
+            time.strftime('%Y-%m-%d %H:%M', time.localtime(stat.st_mtime)))
+
+    def _show_index_info(self, file_count, updated):
+        path = _trigrams.get_index_path(self._directory)
+        try:
+            size = '%.1f MB' % (os.path.getsize(path) / (1024 * 1024))
+        except OSError:
+            # not saved yet
+            size = 'not saved yet'
+        self._index_label['text'] = "Index: %d files, %s, updated %s." % (
+            file_count, size,
+            time.strftime('%Y-%m-%d %H:%M', time.localtime(updated)))
+
+    def _start(self, pattern_args, rebuild_index):
+        self.stop_search()
+        directory = os.path.abspath(self._directory_var.get())
+        if not os.path.isdir(directory):
+            self.status = "'%s' is not a directory." % directory
+            return
+
+        self._results['state'] = 'normal'
+        self._results.delete('1.0', 'end')
+        self._results['state'] = 'disabled'
+        self._locations.clear()
+        self._file_count = 0
+        self._files_to_search = None
+        self._all_files = None
+        self._indexing = None
+        self._match_count = 0
+        self._directory = directory
+
+        cancel_event = threading.Event()
+        result_queue = queue.Queue()
+        thread = threading.Thread(
+            target=_run_search, daemon=True,
+            args=[directory, pattern_args,
+                  (rebuild_index or self._use_index_var.get()),
+                  rebuild_index, result_queue, cancel_event])
+        thread.start()
+
+        self._search = (cancel_event, result_queue)
+        self._search_button['text'] = "Stop"
+        self._update_status()
+        self._poll_after_id = self.after(_POLL_INTERVAL, self._poll)
+
+    def start_search(self):
+        """Start searching, stopping the previous search if needed."""
+        text = self._find_entry.get()
+        if not text:
+            return
+        if self._regex_var.get():
+            try:
+                re.compile(text)
+            except re.error as e:
+                self.status = "Invalid regular expression: %s" % e
+                return
+        self._start((text, self._regex_var.get(),
+                     self._match_case_var.get()), False)
+
+    def rebuild_index(self):
+        """Index all files of the directory again without searching."""
+        self._start(None, True)
+
+    def stop_search(self):
+        """Stop the search if it's running.
+
+        The matches that have been found stay in the tab.
+        """
+        if self._search is not None:
+            self._search[0].set()
+            self._search = None
+        if self._poll_after_id is not None:
+            self.after_cancel(self._poll_after_id)
+            self._poll_after_id = None
+        self._search_button['text'] = "Search"
+
+    def _update_status(self):
+        if self._search is not None and self._files_to_search is None:
+            if self._indexing is None:
+                self.status = "Listing files..."
+            else:
+                self.status = "Indexing... %d/%d files." % self._indexing
+            return
+        if self._files_to_search is None:
+            # rebuild_index() is done
+            self.status = ''
+            return
+
+        if self._search is None:
+            prefix = "Found"
+        else:
+            prefix = "Searching... found"
+        self.status = "%s %d matches, searched %d of %d files." % (
+            prefix, self._match_count, self._file_count,
+            self._files_to_search)
+        if self._files_to_search != self._all_files:
+            self.status += " The index skipped %d files." % (
+                self._all_files - self._files_to_search)
+
+    def _poll(self):
+        self._poll_after_id = None
+        result_queue = self._search[1]
+
+        insert_args = []
+        error = None
+        done = False
+        while True:
+            try:
+                kind, *args = result_queue.get(block=False)
+            except queue.Empty:
+                break
+            if kind == 'done':
+                [error] = args
+                done = True
+                break
+            if kind == 'indexing':
+                self._indexing = tuple(args)
+                continue
+            if kind == 'index':
+                self._show_index_info(*args)
+                continue
+            if kind == 'files':
+                self._files_to_search, self._all_files = args
+                continue
+
+            file_count, results = args
+            self._file_count += file_count
+            for path, lineno, start, end, line in results:
+                if self._match_count == _MAX_MATCHES:
+                    done = True
+                    break
+                self._match_count += 1
+                self._locations.append((path, lineno, start))
+                if len(line) > _MAX_LINE_LENGTH:
+                    line = line[:_MAX_LINE_LENGTH] + '...'
+                insert_args.extend([
+                    '%s:%d' % (os.path.relpath(path, self._directory), lineno),
+                    'location', ': %s\n' % line.strip(), ''])
+            if done:
+                break
+
+        if insert_args:
+            # one insert is much faster than one insert per match
+            self._results['state'] = 'normal'
+            self._results.insert('end - 1 char', *insert_args)
+            self._results['state'] = 'disabled'
+
+        if done:
+            self.stop_search()
+            self._update_status()
+            if error is not None:
+                utils.errordialog("Searching failed",
+                                  "An error occurred while searching.",
+                                  error)
+            elif self._match_count == _MAX_MATCHES:
+                self.status += " Stopped after %d matches." % _MAX_MATCHES
+        else:
+            self._update_status()
+            self._poll_after_id = self.after(_POLL_INTERVAL, self._poll)
+
+    def _on_click(self, event):
+        index = self._results.index('@%d,%d' % (event.x, event.y))
+        lineno = int(index.split('.')[0])
+        if lineno <= len(self._locations):
+            _open_location(*self._locations[lineno - 1])
+        return 'break'
+
+
+def find_in_files():
+    manager = get_tab_manager()
+    current_tab = manager.current_tab
+    if isinstance(current_tab, tabs.FileTab) and current_tab.path is not None:
+        directory = os.path.dirname(current_tab.path)
+    else:
+        directory = os.getcwd()
+
+    for tab in manager.tabs:
+        if isinstance(tab, FindInFilesTab):
+            manager.current_tab = tab
+            break
+    else:
+        manager.add_tab(FindInFilesTab(manager, directory))
+
+
+def setup():
+    porcupine.add_action(find_in_files, "Edit/Find in Files",
+                         ("Ctrl+Shift+F", '<Control-F>'))
@@ -0,0 +1,84 @@
+"""Free the memory of tabs that haven't been looked at in a while.
+
+Tabs that have been hidden for too long, and the least recently seen
+tabs if there are too many of them, are hibernated with
+:meth:`porcupine.tabs.FileTab.hibernate`. They wake up when they are
+shown again. Tabs with unsaved changes are never hibernated because
+hibernating loses the undo history.
+"""
+
+import time
+
+from porcupine import get_tab_manager, settings, tabs
+
+config = settings.get_section('General')
+
+_CHECK_INTERVAL = 30 * 1000     # milliseconds
+
+
+class _Hibernator:
+
+    def __init__(self):
+        self._last_seen = {}    # {tab: time.monotonic() value}
+
+    def on_new_tab(self, tab):
+        self._last_seen[tab] = time.monotonic()
+        tab.bind('<Map>', self._on_map, add=True)
+        tab.bind('<Unmap>', self._on_unmap, add=True)
+        tab.bind('<Destroy>', self._on_destroy, add=True)
+
+    def _on_map(self, event):
+        if event.widget in self._last_seen:
+            event.widget.wake_up()
+            self._last_seen[event.widget] = time.monotonic()
+
+    def _on_unmap(self, event):
+        if event.widget in self._last_seen:
+            self._last_seen[event.widget] = time.monotonic()
+
+    def _on_destroy(self, event):
+        self._last_seen.pop(event.widget, None)
+
+    def check(self):
+        now = time.monotonic()
+        max_age = config['hibernate_after'] * 60
+        hidden = []     # tabs that can be hibernated
+        awake_count = 0
+
+        for tab, last_seen in self._last_seen.items():
+            if tab.winfo_ismapped():
+                self._last_seen[tab] = now
+            if tab.hibernated:
+                continue
+            awake_count += 1
+            # hibernating loses the undo history, and that's bad if the
+            # tab has unsaved changes
+            if not tab.winfo_ismapped() and tab.is_saved(quick=True):
+                hidden.append(tab)
+
+        # least recently seen tabs first
+        hidden.sort(key=self._last_seen.__getitem__)
+        for tab in hidden:
+            too_many = (awake_count > config['max_awake_tabs'])
+            too_old = (max_age != 0 and now - self._last_seen[tab] > max_age)
+            if not (too_many or too_old):
+                break
+            if tab.hibernate():
+                awake_count -= 1
+
+        get_tab_manager().after(_CHECK_INTERVAL, self.check)
+
+
+def setup():
+    # 0 means never
+    config.add_option('hibernate_after', 30)
+    config.add_spinbox('hibernate_after', 0, 24 * 60,
+                       "Free memory of tabs hidden for this many minutes:")
+    config.add_option('max_awake_tabs', 50)
+    config.add_spinbox('max_awake_tabs', 1, 10000,
+                       "Maximum number of tabs kept in memory:")
+
+    hibernator = _Hibernator()
+    get_tab_manager().add_new_tab_callback(hibernator.on_new_tab,
+                                           tabs.FileTab)
+    get_tab_manager().after(_CHECK_INTERVAL, hibernator.check)
@@ -15,7 +15,7 @@ import pygments.styles
 import pygments.token
 import pygments.util   # only for ClassNotFound, the docs say that it's here
 
-from porcupine import filetypes, get_tab_manager, settings, tabs, utils
+from porcupine import filetypes, get_tab_manager, settings, tabs
 
 config = settings.get_section('General')
 
@@ -179,11 +179,7 @@ class Highlighter:
         self.pygmentizer.in_queue.put([self._get_filetype_name(), code])
 
 
-def on_new_tab(event):
-    tab = event.data_widget
-    if not isinstance(tab, tabs.FileTab):
-        return
-
+def on_new_tab(tab):
     highlighter = Highlighter(tab.textwidget, (lambda: tab.filetype.name))
     tab.bind('<<FiletypeChanged>>', highlighter.highlight_all, add=True)
     tab.textwidget.bind('<<ContentChanged>>', highlighter.highlight_all,
@@ -194,7 +190,7 @@ def on_new_tab(event):
 
 
 def setup():
-    utils.bind_with_data(get_tab_manager(), '<<NewTab>>', on_new_tab, add=True)
+    get_tab_manager().add_new_tab_callback(on_new_tab, tabs.FileTab)
 
 
 if __name__ == '__main__':
@@ -34,10 +34,9 @@ def on_tab_key(event, shifted):
     event.widget.tag_add('sel', '%d.0' % start, '%d.0' % end)
 
 
-def on_new_tab(event):
-    if isinstance(event.data_widget, tabs.FileTab):
-        utils.bind_tab_key(event.data_widget.textwidget, on_tab_key, add=True)
+def on_new_tab(tab):
+    utils.bind_tab_key(tab.textwidget, on_tab_key, add=True)
 
 
 def setup():
-    utils.bind_with_data(get_tab_manager(), '<<NewTab>>', on_new_tab, add=True)
+    get_tab_manager().add_new_tab_callback(on_new_tab, tabs.FileTab)
@@ -8,36 +8,220 @@ Windows::
 Or like this on other operating systems::
 
     python3 -m pip install --user jedi
+
+Jedi runs in a separate process that is started when Porcupine starts,
+see :source:`porcupine/plugins/_jedi_worker.py`. Import statements are
+completed without jedi when possible, see
+:source:`porcupine/plugins/_importindex.py`.
 """
 
+import concurrent.futures
+import importlib.util
+import itertools
 import logging
+import multiprocessing
 import os
-from porcupine import dirs, utils
-from porcupine.plugins import autocomplete
+import queue
+import re
+import threading
+
+from porcupine import dirs, get_tab_manager, tabs, utils
+from porcupine.plugins import _importindex, _jedi_worker, autocomplete
+
+log = logging.getLogger(__name__)
+
+# these match the part of the line before the cursor
+_IMPORT_MODULE_REGEX = re.compile(
+    r'^\s*(?:import\s+(?:\w+\s*,\s*)*|from\s+)(\w*)$')
+_IMPORT_NAME_REGEX = re.compile(
+    r'^\s*from\s+(\w+)\s+import\s+\(?\s*(?:\w+\s*,\s*)*(\w*)$')
+
+
+class _JediProcess:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._opened = set()    # file ids that the process knows about
+        self._request_ids = itertools.count()
+        self._start()
+
+    def _start(self):
+        # forking a process with threads can deadlock, see findinfiles.py
+        if 'forkserver' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('forkserver')
+        else:
+            context = multiprocessing.get_context('spawn')
+
+        connection, child_connection = context.Pipe()
+        self._process = context.Process(
+            target=_jedi_worker.main, daemon=True,
+            args=[child_connection, os.path.join(dirs.cachedir, 'jedi')])
+        self._process.start()
+        child_connection.close()
+
+        # a full pipe would block connection.send(), but the UI must
+        # not freeze
+        self._send_queue = queue.Queue()
+        with self._lock:
+            self._opened.clear()
+            # the receiving thread of a dead process may still be
+            # running, so it gets its own dict
+            self._futures = {}      # {request_id: future}
+        threading.Thread(target=self._send_loop, daemon=True,
+                         args=[connection, self._send_queue]).start()
+        threading.Thread(target=self._receive_loop, daemon=True,
+                         args=[connection, self._futures]).start()
+
+    @staticmethod
+    def _send_loop(connection, send_queue):
+        while True:
+            try:
+                connection.send(send_queue.get())
+            except OSError:
+                # the process died, _receive_loop() handles this
+                break
+
+    def _receive_loop(self, connection, futures):
+        while True:
+            try:
+                kind, request_id, value = connection.recv()
+            except (EOFError, OSError):
+                break
+
+            with self._lock:
+                future = futures.pop(request_id, None)
+                if kind == 'out_of_sync':
+                    self._opened.discard(value)
+            # 'cancelled' responses come only for cancelled futures
+            if future is None or not future.set_running_or_notify_cancel():
+                continue
+            if kind == 'result':
+                future.set_result(value)
+            elif kind == 'error':
+                future.set_exception(RuntimeError(
+                    "jedi failed\n\n" + value.rstrip()))
+            elif kind == 'out_of_sync':
+                future.set_exception(RuntimeError(
+                    "the jedi process had an outdated version of the "
+                    "file, it will be sent again"))
+
+        with self._lock:
+            remaining = list(futures.values())
+            futures.clear()
+        for future in remaining:
+            if future.set_running_or_notify_cancel():
+                future.set_exception(RuntimeError("the jedi process died"))
+
+    def change(self, file_id, start, end, new_text):
+        with self._lock:
+            if file_id not in self._opened:
+                return
+        self._send_queue.put(('change', file_id, start, end, new_text))
+
+    def close(self, file_id):
+        with self._lock:
+            if file_id not in self._opened:
+                return
+            self._opened.remove(file_id)
+        self._send_queue.put(('close', file_id))
 
-try:
-    import jedi
-except ImportError:
-    # the space after the last \n is intentional, logging strips off
-    # trailing newlines
-    logging.getLogger(__name__).exception(
-        "Jedi is not installed. You can install it like this:\n\n" +
-        "    %s -m pip install --user jedi\n ", utils.short_python_command)
-    jedi = None
+    def complete(self, file_id, textwidget, path):
+        """Return a future of a list of suffixes."""
+        if not self._process.is_alive():
+            log.warning("the jedi process died with exit code %r, "
+                        "starting a new one", self._process.exitcode)
+            self._start()
+
+        with self._lock:
+            opened = file_id in self._opened
+            self._opened.add(file_id)
+        if not opened:
+            self._send_queue.put(
+                ('open', file_id, textwidget.get('1.0', 'end - 1 char')))
+
+        line, column = map(int, textwidget.index('insert').split('.'))
+        line_count = int(textwidget.index('end - 1 char').split('.')[0])
+        future = concurrent.futures.Future()
+        request_id = next(self._request_ids)
+        with self._lock:
+            self._futures[request_id] = future
+        self._send_queue.put(('complete', request_id, file_id, path,
+                              line, column, line_count))
+
+        # autocomplete cancels prefetched completions when the user types
+        send_queue = self._send_queue
+
+        def on_done(future):
+            if future.cancelled():
+                send_queue.put(('cancel', request_id))
+
+        future.add_done_callback(on_done)
+        return future
+
+
+_jedi_process = None
+_import_index = None
+_file_ids = {}      # {tab: file_id}
+_new_file_ids = itertools.count()
+
+
+def _complete_import(before_cursor):
+    match = _IMPORT_MODULE_REGEX.search(before_cursor)
+    if match is not None:
+        prefix = match.group(1)
+        names = _import_index.complete_module(prefix)
+    else:
+        match = _IMPORT_NAME_REGEX.search(before_cursor)
+        if match is None:
+            return None
+        prefix = match.group(2)
+        names = _import_index.complete_name(match.group(1), prefix)
+
+    if names is None:
+        return None
+    return [name[len(prefix):] for name in names]
 
 
 def jedi_completer(tab):
-    source = tab.textwidget.get("1.0", "end - 1 char")
-    cursor_pos = tab.textwidget.index("insert")
-    line, column = map(int, cursor_pos.split("."))
+    # the index doesn't know about submodules or relative imports, and
+    # jedi handles them when this returns None
+    suffixes = _complete_import(tab.textwidget.get('insert linestart',
+                                                   'insert'))
+    if suffixes is not None:
+        return suffixes
+    return _jedi_process.complete(_file_ids[tab], tab.textwidget, tab.path)
+
+
+def on_new_tab(tab):
+    file_id = _file_ids[tab] = next(_new_file_ids)
 
-    # the source is already unicode, so jedi doesn't need an encoding
-    script = jedi.Script(source, line, column, path=tab.path)
-    return (c.complete for c in script.completions())
+    def on_change(start, end, new_text):
+        _jedi_process.change(file_id, start, end, new_text)
+
+    def on_destroy(event):
+        if event.widget is tab:
+            _jedi_process.close(file_id)
+            del _file_ids[tab]
+
+    tab.textwidget.add_change_callback(on_change)
+    tab.bind('<Destroy>', on_destroy, add=True)
 
 
 def setup():
-    if jedi is not None:
-        jedi.settings.cache_directory = os.path.join(dirs.cachedir, 'jedi')
-        jedi.settings.case_insensitive_completion = False
-        autocomplete.register_completer("Python", jedi_completer)
+    global _jedi_process
+    global _import_index
+
+    if importlib.util.find_spec('jedi') is None:
+        # the space after the last \n is intentional, logging strips off
+        # trailing newlines
+        log.error("Jedi is not installed. You can install it like this:\n\n" +
+                  "    %s -m pip install --user jedi\n ",
+                  utils.short_python_command)
+        return
+
+    _jedi_process = _JediProcess()
+    _import_index = _importindex.ImportIndex(utils.python_executable,
+                                             dirs.cachedir)
+    _import_index.start()
+    get_tab_manager().add_new_tab_callback(on_new_tab, tabs.FileTab)
+    autocomplete.register_completer("Python", jedi_completer)
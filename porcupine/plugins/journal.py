@@ -0,0 +1,309 @@
+"""Recover unsaved changes after Porcupine or the computer crashes.
+
+Each FileTab with unsaved changes has a journal file in Porcupine's
+cache directory. The journal starts with a snapshot of the whole content
+of the tab, and the changes done after that are appended to it. The
+changes are collected in memory while the user is typing, and written
+and fsynced in a thread when the user stops typing for a moment.
+
+The journal is compacted into a new snapshot when it gets too big, and
+it's deleted when the tab is saved or closed. If Porcupine didn't exit
+cleanly, the leftover journals are found when it starts, and the user
+can open the unsaved content in new tabs.
+
+Each Porcupine process has its own directory for journals, and it keeps
+a file in that directory locked until it exits. This way the journals
+of other Porcupines that are still running are left alone.
+"""
+
+import atexit
+import itertools
+import json
+import logging
+import os
+import queue
+import shutil
+import tempfile
+import threading
+from tkinter import messagebox
+
+from porcupine import (_logs, dirs, get_main_window, get_tab_manager, tabs,
+                       textwidget, utils)
+
+log = logging.getLogger(__name__)
+
+_JOURNAL_DIR = os.path.join(dirs.cachedir, 'journals')
+_FLUSH_DELAY = 500                  # milliseconds
+_COMPACT_SIZE = 1024 * 1024         # bytes
+
+_LOCK_FILENAME = 'lock'
+
+_filename_counter = itertools.count()
+_journal_dir = None     # the directory of this process, set in setup()
+
+# contains ('append', filename, records), ('replace', filename, records),
+# ('remove', filename), ('remove_dir', dirname, lock_fd) and None to stop
+# the thread
+_write_queue = queue.Queue()
+
+
+# this runs in a thread, each record is a line of json
+def _writer():
+    while True:
+        item = _write_queue.get()
+        if item is None:
+            break
+
+        action, filename, *records = item
+        try:
+            if action == 'remove':
+                os.remove(filename)
+                continue
+            if action == 'remove_dir':
+                # windows can't remove locked files
+                os.close(records[0])
+                shutil.rmtree(filename)
+                continue
+
+            # json.dumps() escapes everything non-ascii by default, even
+            # the lone surrogates that Tk sometimes gives us
+            data = ''.join(json.dumps(record) + '\n' for record in records[0])
+            if action == 'replace':
+                # atomic_open() fsyncs
+                with utils.atomic_open(filename, 'w') as file:
+                    file.write(data)
+            else:
+                with open(filename, 'a') as file:
+                    file.write(data)
+                    file.flush()
+                    os.fsync(file.fileno())
+        except OSError:
+            log.exception("%s failed with '%s'", action, filename)
+
+
+class _Journal:
+
+    def __init__(self, tab):
+        self._tab = tab
+        self._filename = None     # None if the tab has no unsaved changes
+        self._snapshot_size = 0
+        self._appended_size = 0   # approximate, since the snapshot
+        self._changes = []        # (start, end, new_text) tuples
+        self._needs_snapshot = False
+        self._after_id = None
+
+        tab.textwidget.add_change_callback(self._on_change)
+        tab.bind('<<PathChanged>>', self._on_path_changed, add=True)
+        tab.bind('<<Save>>', self._schedule_flush, add=True)
+        tab.bind('<Destroy>', self._on_destroy, add=True)
+
+    # this runs on every key press, so it must be fast
+    def _on_change(self, start, end, new_text):
+        self._changes.append((start, end, new_text))
+        self._appended_size += len(new_text) + 30
+        self._schedule_flush()
+
+    def _on_path_changed(self, junk_event):
+        # the path is in the snapshot
+        self._needs_snapshot = True
+        self._schedule_flush()
+
+    def _schedule_flush(self, junk_event=None):
+        if self._after_id is None:
+            self._after_id = self._tab.after(_FLUSH_DELAY, self._flush)
+
+    def _flush(self):
+        self._after_id = None
+        # is_saved() without quick=True would hash the whole content
+        if self._tab.is_saved(quick=True):
+            # the content is on disk, nothing to recover
+            self._changes.clear()
+            self._remove()
+            return
+
+        if self._tab.loading:
+            # is_saved() returns True while loading, so this shouldn't
+            # happen, but let's be careful
+            return
+
+        # big files have big snapshots, and compacting them after every
+        # _COMPACT_SIZE bytes of changes would be slow
+        if (self._filename is None or self._needs_snapshot or
+                self._appended_size > max(_COMPACT_SIZE,
+                                          self._snapshot_size)):
+            if self._filename is None:
+                self._filename = os.path.join(
+                    _journal_dir, '%d.journal' % next(_filename_counter))
+
+            # the tab may be hibernated, but then it isn't changing
+            self._tab.wake_up()
+            snapshot = ['snapshot', self._tab.path, self._tab.encoding,
+                        self._tab.textwidget.get('1.0', 'end - 1 char')]
+            _write_queue.put(('replace', self._filename, [snapshot]))
+            self._snapshot_size = len(snapshot[3])
+            self._appended_size = 0
+            self._needs_snapshot = False
+        elif self._changes:
+            records = [['change', start, end, new_text]
+                       for start, end, new_text in self._changes]
+            _write_queue.put(('append', self._filename, records))
+
+        self._changes.clear()
+
+    def _remove(self):
+        if self._filename is not None:
+            _write_queue.put(('remove', self._filename))
+            self._filename = None
+            self._snapshot_size = 0
+            self._appended_size = 0
+
+    def _on_destroy(self, event):
+        if event.widget is self._tab:
+            # closing a tab discards its unsaved changes, or saves them
+            # with a blocking save
+            if self._after_id is not None:
+                self._tab.after_cancel(self._after_id)
+                self._after_id = None
+            self._remove()
+
+
+# returns (path, encoding, content) or None
+def _read_journal(filename):
+    result = None
+    lines = None
+    with open(filename, 'r') as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # the computer died while writing this line, the rest of
+                # the file is lost
+                log.warning("'%s' is truncated", filename)
+                break
+
+            if record[0] == 'snapshot':
+                kind, path, encoding, content = record
+                result = [path, encoding]
+                lines = content.split('\n')
+            elif lines is not None:
+                kind, start, end, new_text = record
+                textwidget.apply_change(lines, start, end, new_text)
+
+    if result is None:
+        return None
+    return (result[0], result[1], '\n'.join(lines))
+
+
+def _is_saved(path, encoding, content):
+    if path is None:
+        return False
+    try:
+        with open(path, 'r', encoding=encoding) as file:
+            return file.read() == content
+    except (OSError, UnicodeError):
+        return False
+
+
+# returns a file descriptor or None, the directory's lock is released
+# when the file descriptor is closed
+def _lock_directory(dirname):
+    try:
+        fd = os.open(os.path.join(dirname, _LOCK_FILENAME),
+                     os.O_WRONLY | os.O_CREAT, 0o644)
+    except OSError:
+        log.exception("cannot open the lock file of '%s'", dirname)
+        return None
+    if _logs._lock(fd):
+        return fd
+    os.close(fd)
+    return None
+
+
+# other porcupines may be running, and the journals in their directories
+# are still in use, but the directories that aren't locked were left
+# behind by porcupines that died
+def _recover():
+    recovered = []      # (path, encoding, content) tuples
+    dead_dirs = []      # (dirname, lock_fd) tuples
+    for name in sorted(os.listdir(_JOURNAL_DIR)):
+        dirname = os.path.join(_JOURNAL_DIR, name)
+        if dirname == _journal_dir or not os.path.isdir(dirname):
+            continue
+        lock_fd = _lock_directory(dirname)
+        if lock_fd is None:
+            continue
+        dead_dirs.append((dirname, lock_fd))
+
+        for filename in sorted(os.listdir(dirname)):
+            if not filename.endswith('.journal'):
+                continue
+            filename = os.path.join(dirname, filename)
+            try:
+                journal = _read_journal(filename)
+            except (OSError, ValueError):
+                log.exception("reading '%s' failed", filename)
+                continue
+            if journal is not None and not _is_saved(*journal):
+                recovered.append(journal)
+
+    if recovered and messagebox.askyesno(
+            "Recover unsaved changes",
+            ("Porcupine wasn't closed properly, and %d file(s) had "
+             "unsaved changes. Do you want to open the unsaved files? "
+             "If you choose No, the changes will be lost.")
+            % len(recovered)):
+        manager = get_tab_manager()
+        new_tabs = []
+        for path, encoding, content in recovered:
+            if path is not None and not os.path.isfile(path):
+                # the file was deleted or renamed, and the recovered tab
+                # must not be compared with other tabs by path
+                log.warning("'%s' doesn't exist anymore, recovering its "
+                            "unsaved content to a new file", path)
+                path = None
+            tab = tabs.FileTab(manager, path=path, encoding=encoding)
+            if any(map(tab.equivalent, manager.tabs + new_tabs)):
+                # e.g. the file was opened from the command line, and
+                # add_tabs() would use the existing tab
+                tab.path = None
+            new_tabs.append(tab)
+        manager.add_tabs(new_tabs)
+
+        # the content is inserted after adding the tabs, so that new
+        # journals are created and the tabs are not saved
+        for tab, (path, encoding, content) in zip(new_tabs, recovered):
+            tab.textwidget.insert('1.0', content)
+            tab.textwidget.edit_reset()
+            tab.textwidget.mark_set('insert', '1.0')
+
+    for dirname, lock_fd in dead_dirs:
+        _write_queue.put(('remove_dir', dirname, lock_fd))
+
+
+def setup():
+    global _journal_dir
+
+    os.makedirs(_JOURNAL_DIR, exist_ok=True)
+    _journal_dir = tempfile.mkdtemp(prefix='%d-' % os.getpid(),
+                                    dir=_JOURNAL_DIR)
+    lock_fd = _lock_directory(_journal_dir)
+    if lock_fd is None:
+        log.error("cannot lock '%s', unsaved changes will not be "
+                  "journaled", _journal_dir)
+        shutil.rmtree(_journal_dir, ignore_errors=True)
+        return
+
+    thread = threading.Thread(target=_writer, daemon=True)
+    thread.start()
+
+    # the journals of the tabs that are closed when porcupine exits must
+    # be removed before it exits, and then the directory isn't needed
+    def stop_thread():
+        _write_queue.put(('remove_dir', _journal_dir, lock_fd))
+        _write_queue.put(None)
+        thread.join()
+
+    atexit.register(stop_thread)
+
+    get_tab_manager().add_new_tab_callback(_Journal, tabs.FileTab)
+    get_main_window().after_idle(_recover)
@@ -0,0 +1,603 @@
+"""Language Server Protocol support.
+
+Language servers are programs that know a lot about a programming
+language. Set a ``langserver_command`` in ``filetypes.ini`` to use one,
+e.g. like this for Python::
+
+    [Python]
+    langserver_command = pyls
+
+The server is started when a file of that type is opened. It's used for
+autocompleting, errors and warnings are underlined, and *Go to
+Definition* in the *Edit* menu jumps to where the name under the cursor
+is defined. Move the cursor to an underlined part of the code to see
+the error message in the status bar.
+
+The server runs in a subprocess, and reading and writing its stdin and
+stdout happens in threads. Only the changed parts of files are sent to
+the server if it supports that, see :meth:`porcupine.textwidget.\
+HandyText.add_change_callback`.
+"""
+
+import atexit
+import concurrent.futures
+import itertools
+import json
+import logging
+import os
+import queue
+import re
+import shlex
+import subprocess
+import threading
+import traceback
+import urllib.parse
+import urllib.request
+
+import porcupine
+from porcupine import filetypes, get_main_window, get_tab_manager, tabs, utils
+from porcupine.plugins import autocomplete
+
+log = logging.getLogger(__name__)
+setup_after = ['jedi']      # langserver completions replace jedi's
+
+_POLL_INTERVAL = 50     # milliseconds
+
+# lowercased filetype names work for most languages
+_LANGUAGE_IDS = {'C++': 'cpp', 'C#': 'csharp', 'Objective-C': 'objective-c',
+                 'Bash': 'shellscript', 'JSX': 'javascriptreact',
+                 'TypeScript': 'typescript'}
+
+# textDocument/publishDiagnostics severities
+_SEVERITY_TAGS = {1: 'langserver_error', 2: 'langserver_warning'}
+
+
+def _path_to_uri(path):
+    return urllib.parse.urljoin(
+        'file:', urllib.request.pathname2url(os.path.abspath(path)))
+
+
+def _uri_to_path(uri):
+    return urllib.request.url2pathname(urllib.parse.urlparse(uri).path)
+
+
+# this runs in a thread
+def _read_messages(file, message_queue):
+    try:
+        while True:
+            headers = {}
+            while True:
+                line = file.readline()
+                if not line:
+                    return
+                line = line.strip()
+                if not line:
+                    break
+                name, value = line.decode('ascii').split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+
+            content = file.read(int(headers['content-length']))
+            message_queue.put(json.loads(content.decode('utf-8')))
+    except Exception:
+        log.exception("reading a message from a langserver failed")
+    finally:
+        message_queue.put(None)
+
+
+# this runs in a thread too
+def _write_messages(file, message_queue):
+    while True:
+        message = message_queue.get()
+        if message is None:
+            break
+        content = json.dumps(message).encode('utf-8')
+        header = 'Content-Length: %d\r\n\r\n' % len(content)
+        try:
+            file.write(header.encode('ascii') + content)
+            file.flush()
+        except OSError:
+            # the server died, _read_messages() notices it too
+            break
+
+
+# and so does this, stderr must be read or the server may block
+def _log_stderr(file, name):
+    for line in file:
+        log.debug("stderr of %s langserver: %s",
+                  name, line.decode('utf-8', errors='replace').rstrip())
+
+
+def _get_suffixes(result, prefix):
+    if result is None:
+        return []
+    if isinstance(result, dict):
+        items = result['items']
+    else:
+        items = result
+
+    suffixes = []
+    items = sorted(items, key=(lambda item: item.get('sortText',
+                                                     item['label'])))
+    for item in items:
+        if 'textEdit' in item:
+            text = item['textEdit']['newText']
+        else:
+            text = item.get('insertText') or item['label']
+        if text.startswith(prefix):
+            suffixes.append(text[len(prefix):])
+    return suffixes
+
+
+def _get_position(textwidget, index):
+    # tk counts characters and lsp counts utf-16 code units, so this is
+    # wrong after characters outside the BMP but tk doesn't really
+    # support them anyway
+    line, column = map(int, textwidget.index(index).split('.'))
+    return {'line': line - 1, 'character': column}
+
+
+def _go_to(tab, line, column):
+    tab.textwidget.tag_remove('sel', '1.0', 'end')
+    tab.textwidget.mark_set('insert', '%d.%d' % (line, column))
+    tab.textwidget.see('insert')
+
+
+def _open_location(path, line, column):
+    manager = get_tab_manager()
+    try:
+        # an existing tab is used if the file is already open
+        tab = manager.add_tab(tabs.FileTab.open_file(manager, path))
+    except (UnicodeError, OSError) as e:
+        log.exception("opening '%s' failed", path)
+        utils.errordialog(type(e).__name__, "Opening failed!",
+                          traceback.format_exc())
+        return
+
+    if tab.loading:
+        tab.bind('<<Loaded>>', lambda event: _go_to(tab, line, column),
+                 add=True)
+    else:
+        _go_to(tab, line, column)
+
+
+class _LangServer:
+
+    def __init__(self, filetype, command):
+        self.filetype = filetype
+        self._process = subprocess.Popen(
+            command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE)
+        atexit.register(self._kill)
+        log.info("started %s langserver: %s", filetype.name, command)
+
+        self._send_queue = queue.Queue()
+        self._receive_queue = queue.Queue()
+        for target, args in [
+                (_read_messages, [self._process.stdout, self._receive_queue]),
+                (_write_messages, [self._process.stdin, self._send_queue]),
+                (_log_stderr, [self._process.stderr, filetype.name])]:
+            threading.Thread(target=target, args=args, daemon=True).start()
+
+        self._request_ids = itertools.count()
+        self._callbacks = {}    # {request_id: callback(result, error)}
+        self._initialized = False
+        self._sync_kind = 0     # TextDocumentSyncKind
+        self._tabs = {}     # {tab: uri}
+        self._versions = {}     # {uri: version}
+        self._diagnostics = {}  # {uri: list of diagnostics}
+
+        self._request('initialize', {
+            'processId': os.getpid(),
+            'rootUri': _path_to_uri(os.getcwd()),
+            'capabilities': {
+                'textDocument': {
+                    'synchronization': {'didSave': True},
+                    'completion': {
+                        'completionItem': {'snippetSupport': False},
+                    },
+                    'publishDiagnostics': {},
+                    'definition': {},
+                },
+            },
+        }, self._on_initialized, force=True)
+        self._poll_id = get_main_window().after(_POLL_INTERVAL, self._poll)
+
+    @property
+    def running(self):
+        return self._poll_id is not None
+
+    def _kill(self):
+        if self._process.poll() is None:
+            self._process.kill()
+
+    def _send(self, message, *, force=False):
+        # the server must not get anything before the initialize request
+        # is done
+        if self._initialized or force:
+            message['jsonrpc'] = '2.0'
+            self._send_queue.put(message)
+
+    # json-rpc doesn't allow "params": null, so None means no params
+    def _notify(self, method, params=None):
+        message = {'method': method}
+        if params is not None:
+            message['params'] = params
+        self._send(message)
+
+    def _request(self, method, params, callback, **kwargs):
+        request_id = next(self._request_ids)
+        self._callbacks[request_id] = callback
+        message = {'id': request_id, 'method': method}
+        if params is not None:
+            message['params'] = params
+        self._send(message, **kwargs)
+        return request_id
+
+    def _on_initialized(self, result, error):
+        if error is not None:
+            log.error("initializing %s langserver failed: %s",
+                      self.filetype.name, error.get('message'))
+            self.shut_down()
+            return
+
+        # the result should be an object, but let's not crash with null
+        capabilities = (result or {}).get('capabilities') or {}
+        sync = capabilities.get('textDocumentSync', 0)
+        if isinstance(sync, dict):
+            self._sync_kind = sync.get('change', 0)
+        else:
+            self._sync_kind = sync
+        self._initialized = True
+        self._notify('initialized', {})
+
+        # changes were ignored until now, so the files are opened with
+        # their current content
+        for tab, uri in self._tabs.items():
+            self._send_did_open(tab, uri)
+
+    def _poll(self):
+        while True:
+            try:
+                message = self._receive_queue.get(block=False)
+            except queue.Empty:
+                break
+            if message is None:
+                self._on_exit()
+                return
+            try:
+                self._handle_message(message)
+            except Exception:
+                log.exception("handling a message from %s langserver "
+                              "failed: %r", self.filetype.name, message)
+        self._poll_id = get_main_window().after(_POLL_INTERVAL, self._poll)
+
+    def _handle_message(self, message):
+        method = message.get('method')
+        if 'id' in message and method is not None:
+            # a request from the server, the result doesn't matter for
+            # these but they must be responded to
+            if method == 'workspace/configuration':
+                response = {'result': [None] * len(message['params']['items'])}
+            elif method in {'window/workDoneProgress/create',
+                            'client/registerCapability'}:
+                response = {'result': None}
+            else:
+                response = {'error': {'code': -32601,
+                                      'message': "unknown method"}}
+            response['id'] = message['id']
+            self._send(response)
+        elif 'id' in message:
+            callback = self._callbacks.pop(message['id'], None)
+            if callback is not None:
+                callback(message.get('result'), message.get('error'))
+        elif method == 'textDocument/publishDiagnostics':
+            self._on_diagnostics(message['params'])
+        elif method in {'window/logMessage', 'window/showMessage'}:
+            log.info("%s langserver: %s", self.filetype.name,
+                     message['params']['message'])
+
+    def _on_exit(self):
+        self._poll_id = None
+        self._initialized = False
+        log.warning("%s langserver exited with code %r", self.filetype.name,
+                    self._process.wait())
+        callbacks = list(self._callbacks.values())
+        self._callbacks.clear()
+        for callback in callbacks:
+            callback(None, {'message': "the langserver exited"})
+        for tab in self._tabs:
+            for tag in _SEVERITY_TAGS.values():
+                tab.textwidget.tag_remove(tag, '1.0', 'end')
+
+    def shut_down(self):
+        """Ask the server to exit nicely."""
+        if self._initialized:
+            self._request('shutdown', None,
+                          lambda result, error: self._notify('exit'))
+        else:
+            self._kill()
+
+    def _send_did_open(self, tab, uri):
+        self._versions[uri] = 0
+        self._notify('textDocument/didOpen', {'textDocument': {
+            'uri': uri,
+            'languageId': _LANGUAGE_IDS.get(self.filetype.name,
+                                            self.filetype.name.lower()),
+            'version': 0,
+            'text': tab.textwidget.get('1.0', 'end - 1 char'),
+        }})
+
+    def get_uri(self, tab):
+        """Return the URI that the server knows *tab* with, or None."""
+        return self._tabs.get(tab)
+
+    def open_tab(self, tab):
+        uri = _path_to_uri(tab.path)
+        self._tabs[tab] = uri
+        if self._initialized:
+            self._send_did_open(tab, uri)
+
+    def close_tab(self, tab):
+        uri = self._tabs.pop(tab)
+        self._diagnostics.pop(uri, None)
+        if self._initialized:
+            self._notify('textDocument/didClose',
+                         {'textDocument': {'uri': uri}})
+
+    @property
+    def tabs(self):
+        return list(self._tabs)
+
+    def on_change(self, tab, start, end, new_text):
+        if not self._initialized or tab not in self._tabs:
+            return
+        uri = self._tabs[tab]
+
+        if self._sync_kind == 2:      # incremental
+            start_line, start_column = map(int, start.split('.'))
+            end_line, end_column = map(int, end.split('.'))
+            change = {
+                'range': {
+                    'start': {'line': start_line - 1,
+                              'character': start_column},
+                    'end': {'line': end_line - 1, 'character': end_column},
+                },
+                'text': new_text,
+            }
+        elif self._sync_kind == 1:    # full
+            change = {'text': tab.textwidget.get('1.0', 'end - 1 char')}
+        else:
+            return
+
+        self._versions[uri] += 1
+        self._notify('textDocument/didChange', {
+            'textDocument': {'uri': uri, 'version': self._versions[uri]},
+            'contentChanges': [change],
+        })
+
+    def on_save(self, tab):
+        if self._initialized and tab in self._tabs:
+            self._notify('textDocument/didSave',
+                         {'textDocument': {'uri': self._tabs[tab]}})
+
+    def _on_diagnostics(self, params):
+        self._diagnostics[params['uri']] = params['diagnostics']
+        for tab, uri in self._tabs.items():
+            if uri != params['uri']:
+                continue
+            for tag in _SEVERITY_TAGS.values():
+                tab.textwidget.tag_remove(tag, '1.0', 'end')
+            for diagnostic in params['diagnostics']:
+                tag = _SEVERITY_TAGS.get(diagnostic.get('severity', 1))
+                if tag is not None:
+                    start, end = self._get_indexes(diagnostic['range'])
+                    if start == end:
+                        end += ' + 1 char'
+                    tab.textwidget.tag_add(tag, start, end)
+
+    @staticmethod
+    def _get_indexes(lsp_range):
+        return ['%d.%d' % (lsp_range[key]['line'] + 1,
+                           lsp_range[key]['character'])
+                for key in ['start', 'end']]
+
+    def get_diagnostic_message(self, tab):
+        """Return the message of a diagnostic at the cursor or None."""
+        for diagnostic in self._diagnostics.get(self._tabs.get(tab), []):
+            start, end = self._get_indexes(diagnostic['range'])
+            if tab.textwidget.compare(start, '<=', 'insert') and \
+                    tab.textwidget.compare('insert', '<=', end):
+                return diagnostic['message']
+        return None
+
+    def _position_params(self, tab):
+        return {'textDocument': {'uri': self._tabs[tab]},
+                'position': _get_position(tab.textwidget, 'insert')}
+
+    def complete(self, tab):
+        """Return a future of a list of suffixes for autocomplete."""
+        future = concurrent.futures.Future()
+        if not self._initialized or tab not in self._tabs:
+            future.set_exception(RuntimeError(
+                "%s langserver isn't running" % self.filetype.name))
+            return future
+
+        before_cursor = tab.textwidget.get('insert linestart', 'insert')
+        prefix = re.search(r'\w*$', before_cursor).group(0)
+
+        def callback(result, error):
+            if not future.set_running_or_notify_cancel():
+                return
+            if error is None:
+                future.set_result(_get_suffixes(result, prefix))
+            else:
+                future.set_exception(RuntimeError(error.get('message')))
+
+        request_id = self._request('textDocument/completion',
+                                   self._position_params(tab), callback)
+
+        def on_done(future):
+            if future.cancelled():
+                self._notify('$/cancelRequest', {'id': request_id})
+
+        future.add_done_callback(on_done)
+        return future
+
+    def go_to_definition(self, tab):
+        if not self._initialized or tab not in self._tabs:
+            tab.status = "%s langserver isn't running." % self.filetype.name
+            return
+
+        def callback(result, error):
+            if error is not None:
+                log.error("finding a definition failed: %s",
+                          error.get('message'))
+                return
+            if isinstance(result, list):
+                result = result[0] if result else None
+            if result is None:
+                tab.status = "No definition found."
+                return
+
+            if 'targetUri' in result:     # LocationLink
+                uri = result['targetUri']
+                lsp_range = result['targetSelectionRange']
+            else:
+                uri = result['uri']
+                lsp_range = result['range']
+            _open_location(_uri_to_path(uri), lsp_range['start']['line'] + 1,
+                           lsp_range['start']['character'])
+
+        self._request('textDocument/definition', self._position_params(tab),
+                      callback)
+
+
+_servers = {}   # {filetype_name: _LangServer}
+
+
+def _get_server(tab):
+    if tab.path is None or not tab.filetype.langserver_command:
+        return None
+
+    server = _servers.get(tab.filetype.name)
+    if server is None or not server.running:
+        command = shlex.split(tab.filetype.langserver_command)
+        try:
+            server = _LangServer(tab.filetype, command)
+        except OSError:
+            log.exception("starting %s langserver failed", tab.filetype.name)
+            return None
+        _servers[tab.filetype.name] = server
+    return server
+
+
+def _find_server(tab):
+    for server in _servers.values():
+        if tab in server.tabs:
+            return server
+    return None
+
+
+def _release_server(server, tab):
+    server.close_tab(tab)
+    if not server.tabs:
+        server.shut_down()
+        del _servers[server.filetype.name]
+
+
+def _close_tab(tab):
+    server = _find_server(tab)
+    if server is not None:
+        _release_server(server, tab)
+
+
+# this runs when the tab's path or filetype may have changed, and the
+# server is looked up before releasing the old one so that e.g. "Save As"
+# of the only Python file doesn't restart the Python langserver
+def _update_tab(tab):
+    old_server = _find_server(tab)
+    new_server = None if tab.loading else _get_server(tab)
+
+    if old_server is not None and old_server is new_server:
+        if old_server.get_uri(tab) != _path_to_uri(tab.path):
+            old_server.close_tab(tab)
+            old_server.open_tab(tab)
+        return
+
+    if old_server is not None:
+        _release_server(old_server, tab)
+    if new_server is not None:
+        new_server.open_tab(tab)
+
+
+def completer(tab):
+    server = _find_server(tab)
+    if server is None:
+        raise RuntimeError("no langserver for %s" % tab.filetype.name)
+    return server.complete(tab)
+
+
+def go_to_definition():
+    tab = get_tab_manager().current_tab
+    server = _find_server(tab)
+    if server is None:
+        tab.status = "There's no langserver for %s files." % (
+            tab.filetype.name)
+    else:
+        server.go_to_definition(tab)
+
+
+def on_new_tab(tab):
+    shown_message = None
+
+    def on_change(start, end, new_text):
+        server = _find_server(tab)
+        if server is not None:
+            server.on_change(tab, start, end, new_text)
+
+    def on_save(event):
+        server = _find_server(tab)
+        if server is not None:
+            # <<Save>> runs before saving, the server reads the file
+            tab.after_idle(server.on_save, tab)
+
+    def show_message():
+        nonlocal shown_message
+        status = tab.status
+        if shown_message is not None and status.endswith('\t' + shown_message):
+            status = status[:-len('\t' + shown_message)]
+        server = _find_server(tab)
+        shown_message = None if server is None else (
+            server.get_diagnostic_message(tab))
+        if shown_message is not None:
+            status += '\t' + shown_message
+        tab.status = status
+
+    def on_cursor_moved(event):
+        # the tab updates its status with after_idle() too, and this
+        # must run after that
+        tab.after_idle(show_message)
+
+    def on_destroy(event):
+        if event.widget is tab:
+            _close_tab(tab)
+
+    tab.textwidget.add_change_callback(on_change)
+    tab.textwidget.tag_config('langserver_error', underline=True,
+                              foreground='red')
+    tab.textwidget.tag_config('langserver_warning', underline=True)
+    tab.textwidget.bind('<<CursorMoved>>', on_cursor_moved, add=True)
+    for event in ['<<PathChanged>>', '<<FiletypeChanged>>', '<<Loaded>>']:
+        tab.bind(event, lambda event: _update_tab(tab), add=True)
+    tab.bind('<<Save>>', on_save, add=True)
+    tab.bind('<Destroy>', on_destroy, add=True)
+    _update_tab(tab)
+
+
+def setup():
+    for filetype in filetypes.filetypes.values():
+        if filetype.langserver_command:
+            autocomplete.register_completer(filetype.name, completer)
+    get_tab_manager().add_new_tab_callback(on_new_tab, tabs.FileTab)
+    porcupine.add_action(go_to_definition, "Edit/Go to Definition",
+                         ("F12", "<F12>"), tabtypes=[tabs.FileTab])
@@ -1,6 +1,6 @@
 """Line numbers for tkinter's Text widget."""
 
-from porcupine import get_tab_manager, tabs, utils
+from porcupine import get_tab_manager, tabs
 from porcupine.textwidget import ThemedText
 
 
@@ -92,11 +92,7 @@ class LineNumbers(ThemedText):
         return 'break'
 
 
-def on_new_tab(event):
-    tab = event.data_widget      # pep8 line length
-    if not isinstance(tab, tabs.FileTab):
-        return
-
+def on_new_tab(tab):
     linenumbers = LineNumbers(tab.left_frame, tab.textwidget)
     linenumbers.pack(side='left', fill='y')
     ScrollManager(tab.scrollbar, tab.textwidget, [linenumbers]).enable()
@@ -105,7 +101,7 @@ def on_new_tab(event):
 
 
 def setup():
-    utils.bind_with_data(get_tab_manager(), '<<NewTab>>', on_new_tab, add=True)
+    get_tab_manager().add_new_tab_callback(on_new_tab, tabs.FileTab)
 
 
 if __name__ == '__main__':
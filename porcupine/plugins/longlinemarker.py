@@ -7,7 +7,7 @@ import pygments.styles
 import pygments.token
 
 import porcupine
-from porcupine import get_tab_manager, settings, tabs, utils
+from porcupine import get_tab_manager, settings, tabs
 
 config = settings.get_section('General')
 
@@ -64,10 +64,9 @@ class LongLineMarker:
         self.do_update()
 
 
-def on_new_tab(event):
-    if isinstance(event.data_widget, tabs.FileTab):
-        LongLineMarker(event.data_widget).setup()
+def on_new_tab(tab):
+    LongLineMarker(tab).setup()
 
 
 def setup():
-    utils.bind_with_data(get_tab_manager(), '<<NewTab>>', on_new_tab, add=True)
+    get_tab_manager().add_new_tab_callback(on_new_tab, tabs.FileTab)
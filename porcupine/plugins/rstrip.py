@@ -1,6 +1,6 @@
 """Remove trailing whitespace when enter is pressed."""
 
-from porcupine import get_tab_manager, tabs, utils
+from porcupine import get_tab_manager, tabs
 
 
 def after_enter(textwidget):
@@ -12,15 +12,14 @@ def after_enter(textwidget):
                           '%d.0 lineend' % lineno)
 
 
-def on_new_tab(event):
-    if isinstance(event.data_widget, tabs.FileTab):
-        textwidget = event.data_widget.textwidget
+def on_new_tab(tab):
+    textwidget = tab.textwidget
 
-        def bind_callback(event):
-            textwidget.after_idle(after_enter, textwidget)
+    def bind_callback(event):
+        textwidget.after_idle(after_enter, textwidget)
 
-        textwidget.bind('<Return>', bind_callback, add=True)
+    textwidget.bind('<Return>', bind_callback, add=True)
 
 
 def setup():
-    utils.bind_with_data(get_tab_manager(), '<<NewTab>>', on_new_tab, add=True)
+    get_tab_manager().add_new_tab_callback(on_new_tab, tabs.FileTab)
@@ -120,10 +120,10 @@ def run(path):
 def run_this_file():
     filetab = porcupine.get_tab_manager().current_tab
     if filetab.path is None or not filetab.is_saved():
-        filetab.save()
-    if filetab.path is None:
-        # user cancelled a save as dialog
-        return
+        # the file must be on disk before running it
+        if not filetab.save(blocking=True):
+            # user cancelled a save as dialog or saving failed
+            return
     run(filetab.path)
 
 
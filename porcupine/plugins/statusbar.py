@@ -1,6 +1,6 @@
 from tkinter import ttk
 
-from porcupine import get_tab_manager, utils
+from porcupine import get_tab_manager
 
 # i have experimented with a logging handler that displays logging
 # messages in the label, but it's not as good idea as it sounds like,
@@ -12,10 +12,17 @@ class LabelWithEmptySpaceAtLeft(ttk.Label):
 
     def __init__(self, master):
         self._spacer = ttk.Frame(master)
-        self._spacer.pack(side='left', expand=True)
         super().__init__(master)
+        self.show()
+
+    def show(self):
+        self._spacer.pack(side='left', expand=True)
         self.pack(side='left')
 
+    def hide(self):
+        self._spacer.pack_forget()
+        self.pack_forget()
+
     def destroy(self):
         self._spacer.destroy()
         super().destroy()
@@ -23,35 +30,60 @@ class LabelWithEmptySpaceAtLeft(ttk.Label):
 
 class StatusBar(ttk.Frame):
 
+    # the status changes after almost every key press, so updates are
+    # done at most once per this many milliseconds (about one frame)
+    _UPDATE_DELAY = 16
+
     def __init__(self, master, tab):
         super().__init__(master)
         self.tab = tab
-        # one label for each tab-separated thing
+        # one label for each tab-separated thing, the labels are hidden
+        # instead of destroyed when there are less things and reused
+        # later, only the first self._shown_count labels are showing
         self.labels = [ttk.Label(self)]
         self.labels[0].pack(side='left')
+        self._shown_count = 1
+        self._after_id = None
 
-        tab.bind('<<StatusChanged>>', self.do_update, add=True)
+        tab.bind('<<StatusChanged>>', self._schedule_update, add=True)
+        self.bind('<Destroy>', self._on_destroy, add=True)
         self.do_update()
 
+    def _schedule_update(self, junk=None):
+        if self._after_id is None:
+            self._after_id = self.after(self._UPDATE_DELAY, self.do_update)
+
+    def _on_destroy(self, event):
+        if event.widget is self and self._after_id is not None:
+            self.after_cancel(self._after_id)
+            self._after_id = None
+
     # this is do_update() because tkinter has a method called update()
     def do_update(self, junk=None):
+        self._after_id = None
         parts = self.tab.status.split('\t')
 
         # there's always at least one part, the label added in
-        # __init__ is not destroyed here
-        while len(self.labels) > len(parts):
-            self.labels.pop().destroy()
-        while len(self.labels) < len(parts):
-            self.labels.append(LabelWithEmptySpaceAtLeft(self))
+        # __init__ is never hidden
+        while self._shown_count > len(parts):
+            self._shown_count -= 1
+            self.labels[self._shown_count].hide()
+        while self._shown_count < len(parts):
+            if self._shown_count == len(self.labels):
+                self.labels.append(LabelWithEmptySpaceAtLeft(self))
+            else:
+                self.labels[self._shown_count].show()
+            self._shown_count += 1
 
         for label, text in zip(self.labels, parts):
-            label['text'] = text
+            # setting the text makes tk redraw the label
+            if label['text'] != text:
+                label['text'] = text
 
 
-def on_new_tab(event):
-    tab = event.data_widget
+def on_new_tab(tab):
     StatusBar(tab.bottom_frame, tab).pack(side='bottom', fill='x')
 
 
 def setup():
-    utils.bind_with_data(get_tab_manager(), '<<NewTab>>', on_new_tab, add=True)
+    get_tab_manager().add_new_tab_callback(on_new_tab)
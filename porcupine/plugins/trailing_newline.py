@@ -1,6 +1,6 @@
 """Add a trailing newline character to files when saving."""
 
-from porcupine import get_tab_manager, tabs, utils
+from porcupine import get_tab_manager, tabs
 
 
 def on_save(event):
@@ -13,10 +13,9 @@ def on_save(event):
         textwidget.mark_set('insert', cursor)
 
 
-def on_new_tab(event):
-    if isinstance(event.data_widget, tabs.FileTab):
-        event.data_widget.bind('<<Save>>', on_save, add=True)
+def on_new_tab(tab):
+    tab.bind('<<Save>>', on_save, add=True)
 
 
 def setup():
-    utils.bind_with_data(get_tab_manager(), '<<NewTab>>', on_new_tab, add=True)
+    get_tab_manager().add_new_tab_callback(on_new_tab, tabs.FileTab)
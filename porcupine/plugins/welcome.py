@@ -3,7 +3,7 @@
 import re
 from tkinter import ttk
 
-from porcupine import get_tab_manager, utils
+from porcupine import get_tab_manager
 
 
 RAW_MESSAGE = """
@@ -38,9 +38,9 @@ class WelcomeMessageDisplayer:
         for label in self._message.winfo_children():
             label['wraplength'] = event.width * 0.9     # small borders
 
-    def on_new_tab(self, event):
+    def on_new_tab(self, tab):
         self._message.place_forget()
-        event.data_widget.bind('<Destroy>', self._on_tab_closed, add=True)
+        tab.bind('<Destroy>', self._on_tab_closed, add=True)
 
     def _on_tab_closed(self, event):
         if not get_tab_manager().tabs:
@@ -50,5 +50,4 @@ class WelcomeMessageDisplayer:
 def setup():
     displayer = WelcomeMessageDisplayer()
     get_tab_manager().bind('<Configure>', displayer.update_wraplen, add=True)
-    utils.bind_with_data(get_tab_manager(), '<<NewTab>>',
-                         displayer.on_new_tab, add=True)
+    get_tab_manager().add_new_tab_callback(displayer.on_new_tab)
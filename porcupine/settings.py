@@ -374,6 +374,12 @@ def _validate_encoding(name):
         raise InvalidValue from e
 
 
+def _validate_encoding_list(names):
+    for name in names.split(','):
+        if name.strip():
+            _validate_encoding(name.strip())
+
+
 def _validate_pygments_style_name(name):
     try:
         pygments.styles.get_style_by_name(name)
@@ -437,10 +443,15 @@ def _init():
         'font_size', functools.partial(fixedfont.__setitem__, 'size'),
         run_now=True)
 
-    # TODO: allow file-specific encodings if someone complains about this
+    # each FileTab has an encoding, these are used for new files and for
+    # guessing the encoding of opened files, see tabs.FileTab.open_file
     general.add_option('encoding', 'UTF-8')
-    general.add_entry('encoding', "Encoding of opened and saved files:")
+    general.add_entry('encoding', "Encoding of new files:")
     general.connect('encoding', _validate_encoding)
+    general.add_option('fallback_encodings', 'latin-1')
+    general.add_entry('fallback_encodings',
+                      "Encodings to try if UTF-8 doesn't work:")
+    general.connect('fallback_encodings', _validate_encoding_list)
 
     general.add_option('pygments_style', 'default', reset=False)
     general.connect('pygments_style', _validate_pygments_style_name)
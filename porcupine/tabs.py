@@ -1,16 +1,26 @@
 r"""Tabs as in browser tabs, not \t characters."""
 
+import atexit
+import codecs
 import functools
 import hashlib
+import io
 import itertools
 import logging
 import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
 import tkinter
 from tkinter import ttk, messagebox
 import traceback
+import types
+import zlib
 
 import porcupine
-from porcupine import _dialogs, filetypes, settings, textwidget, utils
+from porcupine import _dialogs, dirs, filetypes, settings, textwidget, utils
 
 log = logging.getLogger(__name__)
 _flatten = itertools.chain.from_iterable
@@ -135,12 +145,16 @@ class TabManager(ttk.PanedWindow):
     .. virtualevent:: NewTab
 
         This runs when a new tab has been added to the tab manager with
-        :meth:`add_tab`. Use :func:`~porcupine.utils.bind_with_data` and
-        ``event.data_widget`` to access the tab that was added.
+        :meth:`add_tab` or :meth:`add_tabs`. Use
+        :func:`~porcupine.utils.bind_with_data` and ``event.data_widget``
+        to access the tab that was added.
 
         Bind to the ``<Destroy>`` event of the tab if you want to clean
         up something when the tab is closed.
 
+        .. seealso::
+            :meth:`add_new_tab_callback` is faster than binding this.
+
     .. virtualevent:: CurrentTabChanged
 
         This runs when the user selects another tab or Porcupine does it
@@ -154,8 +168,9 @@ class TabManager(ttk.PanedWindow):
         List of Tab objects in the tab manager.
 
         Don't modify this list yourself, use methods like
-        :meth:`~move_left`, :meth:`~move_right`, :meth:`~add_tab` or
-        :meth:`~close_tab` instead.
+        :meth:`~move_left`, :meth:`~move_right`, :meth:`~add_tab`,
+        :meth:`~add_tabs`, :meth:`~close_tab` or :meth:`~close_tabs`
+        instead.
 
     .. attribute:: current_tab
 
@@ -198,10 +213,15 @@ class TabManager(ttk.PanedWindow):
         come from ``PanedWindow``.
     """
 
+    # if the callbacks of add_new_tab_callback() take longer than this
+    # for one tab, a warning is logged
+    _NEW_TAB_BUDGET = 0.05      # seconds
+
     def __init__(self, *args, **kwargs):
         kwargs.setdefault('orient', 'horizontal')
         super().__init__(*args, **kwargs)
         self._current_pane = None
+        self._new_tab_callbacks = []    # [(callback, tab_class), ...]
 
         # These can be bound in a parent widget. This doesn't use
         # enable_traversal() because we want more bindings than it
@@ -316,53 +336,204 @@ class TabManager(ttk.PanedWindow):
 
         If ``tab.equivalent(existing_tab)`` returns True for any
         ``existing_tab`` that is already in the tab manager, then that
-        existing tab is returned. Otherwise *tab* is added to the tab
-        manager and returned.
+        existing tab is returned and *tab* is destroyed. Otherwise *tab*
+        is added to the tab manager and returned.
 
         If *make_current* is True, then :attr:`current_tab` is set to
         the tab that is returned.
 
         .. seealso::
-            The :meth:`.Tab.equivalent` and :meth:`~close_tab` methods.
+            The :meth:`.Tab.equivalent` and :meth:`~close_tab` methods,
+            and :meth:`add_tabs` for adding many tabs at once.
         """
-        assert tab not in self.tabs, "cannot add the same tab twice"
-        for existing_tab in self.tabs:
-            if tab.equivalent(existing_tab):
-                if make_current:
-                    self.current_tab = existing_tab
-                return existing_tab
-
-        if self.panes():
-            self._current_pane = self.panes()[0]
-            self._current_pane.add_tab(tab)
-        else:
-            self._add_pane(tab)
+        return self.add_tabs([tab], make_current)[0]
 
-        if make_current:
-            self.current_tab = tab
+    def add_tabs(self, new_tabs, make_current=True):
+        """Add each :class:`.Tab` from an iterable to this tab manager.
 
-        # the update() is needed in some cases because virtual events
-        # don't run if the widget isn't visible yet
-        self.update()
-        self.event_generate('<<NewTab>>', data=tab)
-        return tab
+        This is like calling :meth:`add_tab` in a loop, but much faster
+        when there are many tabs. Pending Tk events are processed only
+        once, and the :virtevt:`NewTab` events of all added tabs are
+        generated after that.
+
+        A list is returned. It contains the tab from the tab manager
+        that :meth:`add_tab` would return for each tab in *new_tabs*.
+        If *make_current* is True, the last tab of that list becomes
+        :attr:`current_tab`. The tabs of *new_tabs* that are not added
+        because they are equivalent to other tabs are destroyed.
+        """
+        existing_tabs = self.tabs
+
+        # comparing every new tab with every existing tab would be
+        # O(n**2), so tabs that have an equivalence key are looked up
+        # from a dict instead, and equivalent() is used for other tabs
+        keyed_tabs = {}
+        unkeyed_tabs = []
+        for existing_tab in existing_tabs:
+            key = existing_tab._get_equivalence_key()
+            if key is None:
+                unkeyed_tabs.append(existing_tab)
+            else:
+                keyed_tabs.setdefault(key, existing_tab)
+
+        result = []
+        added = []
+        for tab in new_tabs:
+            assert tab not in existing_tabs, "cannot add the same tab twice"
+            key = tab._get_equivalence_key()
+            if key is None:
+                equivalent_tab = None
+                compare_tabs = existing_tabs
+            else:
+                # e.g. tabs of deleted files have no key, and they must
+                # be compared with equivalent()
+                equivalent_tab = keyed_tabs.get(key)
+                compare_tabs = unkeyed_tabs
+            if equivalent_tab is None:
+                for existing_tab in compare_tabs:
+                    if tab.equivalent(existing_tab):
+                        equivalent_tab = existing_tab
+                        break
+
+            if equivalent_tab is not None:
+                # the tab will never be shown, and destroying it stops
+                # e.g. a FileTab from loading its file in the background
+                tab.destroy()
+                result.append(equivalent_tab)
+            else:
+                if key is None:
+                    unkeyed_tabs.append(tab)
+                else:
+                    keyed_tabs[key] = tab
+                if self.panes():
+                    self._current_pane = self.panes()[0]
+                    self._current_pane.add_tab(tab)
+                else:
+                    self._add_pane(tab)
+                existing_tabs.append(tab)
+                added.append(tab)
+                result.append(tab)
+
+        if make_current and result:
+            self.current_tab = result[-1]
+
+        if added:
+            # the update() is needed in some cases because virtual events
+            # don't run if the widget isn't visible yet
+            self.update()
+            for tab in added:
+                self._run_new_tab_callbacks(tab)
+                self.event_generate('<<NewTab>>', data=tab)
+        return result
+
+    def add_new_tab_callback(self, callback, tab_class=None):
+        """Run ``callback(tab)`` when a tab is added to the tab manager.
+
+        If *tab_class* is not None, the callback runs only for tabs that
+        are instances of it. For example, most plugins do something
+        like this::
+
+            def on_new_tab(tab):
+                ...
+
+            def setup():
+                get_tab_manager().add_new_tab_callback(
+                    on_new_tab, tabs.FileTab)
+
+        This is like binding :virtevt:`NewTab`, but much faster when
+        many plugins do it. All callbacks run in one loop in Python, and
+        they run before :virtevt:`NewTab` is generated. The callbacks
+        are timed, and a warning that tells which callbacks were slowest
+        is logged if they take too long.
+        """
+        self._new_tab_callbacks.append((callback, tab_class or Tab))
+
+    def _run_new_tab_callbacks(self, tab):
+        times = []
+        for callback, tab_class in self._new_tab_callbacks:
+            if not isinstance(tab, tab_class):
+                continue
+
+            start = time.perf_counter()
+            try:
+                callback(tab)
+            except Exception:
+                # like exceptions in tkinter callbacks
+                log.exception("%r failed", callback)
+            times.append((time.perf_counter() - start, callback))
+
+        total = sum(seconds for seconds, callback in times)
+        log.debug("new tab callbacks took %.1fms for %r", total * 1000, tab)
+        if total > self._NEW_TAB_BUDGET:
+            times.sort(key=(lambda pair: pair[0]), reverse=True)
+            log.warning(
+                "new tab callbacks took %.1fms, the slowest were %s",
+                total * 1000, ', '.join(
+                    '%s.%s (%.1fms)' % (callback.__module__,
+                                        callback.__qualname__,
+                                        seconds * 1000)
+                    for seconds, callback in times[:3]))
 
     def close_tab(self, tab):
         """Destroy a tab without calling :meth:`~Tab.can_be_closed`.
 
         The closed tab cannot be added back to the tab manager later.
 
-        .. seealso:: The :meth:`.Tab.can_be_closed` method.
+        .. seealso::
+            The :meth:`.Tab.can_be_closed` method, and :meth:`close_tabs`
+            for closing many tabs at once.
         """
-        # which pane is this tab in?
-        for pane in self.panes():
-            if tab in pane.tabs():
-                break
-        else:
-            raise ValueError("unknown tab " + repr(tab))
+        self.close_tabs([tab])
+
+    def close_tabs(self, tabs_to_close):
+        """Like :meth:`close_tab`, but closes all tabs from an iterable.
 
-        pane.remove_tab(tab)     # may get rid of the whole pane
-        tab.destroy()
+        The tabs are removed from their panes first and destroyed after
+        that, so the panes don't select and focus each neighbor tab of
+        the closed tabs one by one. :virtevt:`CurrentTabChanged` runs
+        at most once per pane.
+        """
+        tabs_to_close = list(tabs_to_close)
+        doomed = set(tabs_to_close)
+        all_panes = self.panes()
+        pane_tabs = {pane: pane.tabs() for pane in all_panes}
+        for tab in tabs_to_close:
+            if not any(tab in tabs for tabs in pane_tabs.values()):
+                raise ValueError("unknown tab " + repr(tab))
+
+        old_pane = self._current_pane
+        for pane in all_panes:
+            closing = [tab for tab in pane_tabs[pane] if tab in doomed]
+            if len(closing) == len(pane_tabs[pane]):
+                # a pane with no tabs in it would suck
+                self.forget(pane)
+                pane.destroy()
+            elif closing:
+                # the notebook selects another tab only when the
+                # selected tab is forgotten, so that's done last
+                selected = pane.select()
+                closing.sort(key=(lambda tab: tab is selected))
+                for tab in closing:
+                    pane.forget(tab)
+
+        for tab in tabs_to_close:
+            tab.destroy()
+
+        remaining_panes = self.panes()
+        if old_pane is None or old_pane in remaining_panes:
+            return
+
+        # prefer the pane that was on the right side of the old current
+        # pane, like the pane's remove_tab() does
+        if remaining_panes:
+            index = all_panes.index(old_pane)
+            after = [pane for pane in all_panes[index + 1:]
+                     if pane in remaining_panes]
+            self._current_pane = after[0] if after else remaining_panes[-1]
+            self._current_pane.select().on_focus()
+        else:
+            self._current_pane = None
+        self.event_generate('<<CurrentTabChanged>>')
 
     # moves the current tab to another pane, creating a new pane if needed
     def _move_to_another_pane(self, diff):
@@ -433,8 +604,9 @@ class Tab(ttk.Frame):
 
     .. virtualevent:: StatusChanged
 
-        This event is generated when :attr:`status` is set to a new
-        value. Use ``event.widget.status`` to access the current status.
+        This event is generated when :attr:`status` is set to a value
+        that is different from the old value. Use
+        ``event.widget.status`` to access the current status.
 
     .. attribute:: title
 
@@ -509,8 +681,9 @@ class Tab(ttk.Frame):
 
     @status.setter
     def status(self, new_status):
-        self._status = new_status
-        self.event_generate('<<StatusChanged>>')
+        if new_status != self._status:
+            self._status = new_status
+            self.event_generate('<<StatusChanged>>')
 
     @property
     def title(self):
@@ -566,6 +739,214 @@ class Tab(ttk.Frame):
         """
         return False
 
+    def _get_equivalence_key(self):
+        # a hashable object or None, tabs with equal keys must be
+        # equivalent and tabs with different keys must not be
+        return None
+
+
+# utf-32 must be before utf-16 because BOM_UTF16_LE is a prefix of
+# BOM_UTF32_LE, and the utf-8-sig and utf-16 codecs write the BOM back
+# when the file is saved
+_BOMS = [
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+]
+_ENCODING_DETECT_SIZE = 8 * 1024
+
+
+def _detect_encodings(file):
+    """Figure out the encoding of a file opened in binary mode.
+
+    Only the first few kilobytes of the file are read, and the file is
+    seeked back to the beginning. A list of the encodings that can
+    decode the beginning of the file is returned, best first, and
+    UnicodeError is raised if none of the encodings in the settings
+    work. The rest of the file may still fail to decode with the first
+    encoding, and _FileLoader tries the next one then.
+    """
+    start = file.read(_ENCODING_DETECT_SIZE)
+    file.seek(0)
+
+    for bom, encoding in _BOMS:
+        if start.startswith(bom):
+            return [encoding]
+
+    config = settings.get_section('General')
+    candidates = ['utf-8', config['encoding']]
+    candidates.extend(name.strip()
+                      for name in config['fallback_encodings'].split(',')
+                      if name.strip())
+
+    tried = set()
+    result = []
+    for encoding in candidates:
+        if codecs.lookup(encoding).name in tried:
+            continue
+        tried.add(codecs.lookup(encoding).name)
+
+        # incremental decoders don't mind a multibyte character that
+        # was cut in half by the end of start
+        decoder = codecs.getincrementaldecoder(encoding)()
+        try:
+            decoder.decode(start, final=(len(start) < _ENCODING_DETECT_SIZE))
+        except UnicodeDecodeError:
+            continue
+        result.append(encoding)
+
+    if not result:
+        raise UnicodeError(
+            "none of these encodings work: " + ', '.join(tried))
+    return result
+
+
+class _FileLoader:
+    """Reads a file in a thread and inserts it to a FileTab bit by bit.
+
+    The thread decodes the file in chunks of _CHUNK_SIZE bytes, and the
+    chunks are inserted to the text widget from Tk's main loop. Each
+    after() callback inserts for at most _TIME_SLICE seconds, so the
+    rest of Porcupine keeps running while a big file is being loaded.
+
+    If decoding fails in the middle of the file, loading starts over
+    with the next encoding from the list of encodings.
+    """
+
+    _CHUNK_SIZE = 256 * 1024
+    _TIME_SLICE = 0.02
+
+    def __init__(self, tab, file, encodings):
+        self._tab = tab
+        self._file = file
+        self._encodings = list(encodings)
+        self._total_bytes = os.fstat(file.fileno()).st_size
+        self._done_bytes = 0
+
+        # the thread puts ('chunk', number_of_bytes, text), ('done',),
+        # ('restart', encoding) and ('error', exception, traceback_string)
+        # tuples to the queue and stops when it's full, so big files
+        # don't end up in memory as huge strings
+        self._queue = queue.Queue(maxsize=16)
+        self._cancelled = threading.Event()
+        self._thread = threading.Thread(target=self._read, daemon=True)
+        self._after_id = None
+
+    @property
+    def progress(self):
+        """A number between 0 and 1."""
+        if self._total_bytes == 0:
+            return 1
+        return min(self._done_bytes / self._total_bytes, 1)
+
+    def start(self):
+        textwidget = self._tab.textwidget
+        textwidget._content_changed_enabled = False
+        textwidget['undo'] = False
+        textwidget['state'] = 'disabled'   # read-only until it's loaded
+        self._thread.start()
+        self._after_id = textwidget.after_idle(self._insert_some)
+
+    def cancel(self):
+        self._cancelled.set()
+        if self._after_id is not None:
+            self._tab.textwidget.after_cancel(self._after_id)
+            self._after_id = None
+
+    def _put(self, item):
+        # put() with a timeout, so that cancel() stops this
+        while not self._cancelled.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    # this runs in the thread
+    def _read(self):
+        try:
+            with self._file:
+                for index, encoding in enumerate(self._encodings):
+                    if index != 0:
+                        self._file.seek(0)
+                        self._put(('restart', encoding))
+                    try:
+                        self._read_with_encoding(encoding)
+                        return
+                    except UnicodeDecodeError:
+                        if index == len(self._encodings) - 1:
+                            raise
+                        log.info("decoding '%s' with %s failed, trying %s",
+                                 self._tab.path, encoding,
+                                 self._encodings[index + 1])
+        except (OSError, UnicodeError) as e:
+            self._put(('error', e, traceback.format_exc()))
+
+    def _read_with_encoding(self, encoding):
+        # this does the same newline translation as open() in text mode
+        decoder = io.IncrementalNewlineDecoder(
+            codecs.getincrementaldecoder(encoding)(), translate=True)
+        while not self._cancelled.is_set():
+            data = self._file.read(self._CHUNK_SIZE)
+            text = decoder.decode(data, final=(not data))
+            if text:
+                self._put(('chunk', len(data), text))
+            if not data:
+                self._put(('done',))
+                break
+
+    def _insert_some(self):
+        self._after_id = None
+        textwidget = self._tab.textwidget
+        deadline = time.perf_counter() + self._TIME_SLICE
+
+        textwidget['state'] = 'normal'
+        try:
+            while time.perf_counter() < deadline:
+                try:
+                    item = self._queue.get(block=False)
+                except queue.Empty:
+                    break
+
+                if item[0] == 'chunk':
+                    ignored, number_of_bytes, text = item
+                    textwidget.insert('end - 1 char', text)
+                    self._done_bytes += number_of_bytes
+                elif item[0] == 'restart':
+                    ignored, encoding = item
+                    textwidget.delete('1.0', 'end')
+                    self._done_bytes = 0
+                    self._tab.encoding = encoding
+                elif item[0] == 'done':
+                    self._tab._loading_done(None)
+                    return
+                else:
+                    ignored, error, traceback_string = item
+                    self._tab._loading_done((error, traceback_string))
+                    return
+        finally:
+            if self._tab._loader is self:
+                textwidget['state'] = 'disabled'
+
+        self._tab._update_status()
+        self._after_id = textwidget.after(10, self._insert_some)
+
+
+_hibernation_dir = None
+
+
+def _get_hibernation_dir():
+    global _hibernation_dir
+    if _hibernation_dir is None:
+        # every porcupine process has its own directory, so running
+        # multiple porcupines at the same time works
+        _hibernation_dir = tempfile.mkdtemp(prefix='hibernated-',
+                                            dir=dirs.cachedir)
+        atexit.register(shutil.rmtree, _hibernation_dir, ignore_errors=True)
+    return _hibernation_dir
+
 
 class FileTab(Tab):
     """A tab that represents an opened file.
@@ -590,6 +971,17 @@ class FileTab(Tab):
 
         This runs before the file is saved with the :meth:`save` method.
 
+    .. virtualevent:: Loaded
+
+        This runs when a tab created with :meth:`open_file` has read the
+        whole file into its :attr:`textwidget`. The text widget is
+        read-only until that, and :attr:`loading` is True.
+
+    .. virtualevent:: WokeUp
+
+        This runs when :meth:`wake_up` has put the content of a
+        :attr:`hibernated` tab back to the :attr:`textwidget`.
+
     .. attribute:: textwidget
 
         The central text widget of the tab.
@@ -619,12 +1011,41 @@ bers.py>` use this attribute.
         A value from :data:`porcupine.filetypes.filetypes`.
 
         .. seealso:: The :virtevt:`.FiletypeChanged` virtual event.
+
+    .. attribute:: encoding
+
+        The name of the encoding that :meth:`save` uses, e.g.
+        ``'utf-8'``. This is the *encoding* argument, or the encoding
+        of new files from the settings if it's None.
+
+        .. seealso:: :meth:`open_file` finds the encoding of the file.
     """
 
-    def __init__(self, manager, content='', path=None):
+    def __init__(self, manager, content='', path=None, *, encoding=None):
         super().__init__(manager)
+        if encoding is None:
+            encoding = settings.get_section('General')['encoding']
+        self.encoding = encoding
 
         self._save_hash = None
+        self._revision = 0          # incremented on every change
+        self._saved_revision = None
+        self._loader = None
+        self._saving = False        # True when a save() thread is running
+        self._save_again = False
+
+        # a blocking save can run while a save thread is running, and
+        # the thread must not overwrite the newer content after that
+        self._write_lock = threading.Lock()
+        self._save_counter = itertools.count()
+        self._latest_saves = {}     # {path: next(self._save_counter)}
+
+        # {path: (st_mtime_ns, st_size)} of the written file, see
+        # is_own_write()
+        self._written_stats = {}
+        self._hibernation = None    # see hibernate()
+        self._status_after_id = None
+        self.bind('<Destroy>', self._on_destroy, add=True)
 
         # path and filetype are set correctly below
         # TODO: try to guess the filetype from the content when path is None
@@ -639,6 +1060,7 @@ bers.py>` use this attribute.
         self.textwidget = textwidget.MainText(
             self, self._filetype, width=1, height=1, wrap='none', undo=True)
         self.textwidget.pack(side='left', fill='both', expand=True)
+        self.textwidget.add_change_callback(self._on_change)
         self.bind('<<FiletypeChanged>>',
                   lambda event: self.textwidget.set_filetype(self.filetype),
                   add=True)
@@ -655,8 +1077,9 @@ bers.py>` use this attribute.
 
         # everything seems to work ok without this except that e.g.
         # pressing Ctrl+O in the text widget opens a file AND inserts a
-        # newline (Tk inserts a newline by default)
-        utils.copy_bindings(porcupine.get_main_window(), self.textwidget)
+        # newline (Tk inserts a newline by default), this is much faster
+        # than utils.copy_bindings() because nothing is bound per widget
+        utils.bind_before_class(self.textwidget, porcupine.get_main_window())
 
         self.scrollbar = ttk.Scrollbar(self)
         self.scrollbar.pack(side='left', fill='y')
@@ -668,19 +1091,183 @@ bers.py>` use this attribute.
         self._update_status()
 
     @classmethod
-    def open_file(cls, manager, path):
-        """Read a file and return a new FileTab object.
+    def open_file(cls, manager, path, encoding=None):
+        """Return a new FileTab object that reads its content from a file.
 
         Use this constructor if you want to open an existing file from a
         path and let the user edit it.
 
-        :exc:`UnicodeError` or :exc:`OSError` is raised if reading the
-        file fails.
+        If *encoding* is None, the encoding is detected from the first
+        few kilobytes of the file. A byte order mark is used if the file
+        has one. Otherwise UTF-8 and then the encodings from the
+        settings are tried, and the first encoding that works becomes
+        the :attr:`encoding` of the tab. If the rest of the file can't be
+        decoded with it, loading starts over with the next encoding that
+        worked.
+
+        The file is read and decoded in another thread, and the content
+        appears in the tab while it's being read. :virtevt:`Loaded` runs
+        when everything has been read. Closing the tab stops the
+        loading.
+
+        :exc:`OSError` is raised if opening the file fails, and
+        :exc:`UnicodeError` is raised if the encoding can't be detected.
+        If reading the file fails later, the error is shown to the user
+        and the tab is closed.
         """
-        config = settings.get_section('General')
-        with open(path, 'r', encoding=config['encoding']) as file:
-            content = file.read()
-        return cls(manager, content, path)
+        file = open(path, 'rb')
+        try:
+            if encoding is None:
+                encodings = _detect_encodings(file)
+            else:
+                encodings = [encoding]
+            tab = cls(manager, path=path, encoding=encodings[0])
+            tab._loader = _FileLoader(tab, file, encodings)
+        except Exception as e:
+            file.close()
+            raise e
+
+        tab._loader.start()
+        tab._update_status()
+        return tab
+
+    @property
+    def loading(self):
+        """True if the tab is still reading its content from a file.
+
+        See :meth:`open_file`.
+        """
+        return (self._loader is not None)
+
+    def _on_destroy(self, event):
+        if event.widget is not self:
+            return
+        if self._loader is not None:
+            self._loader.cancel()
+            self._loader = None
+        if self._hibernation is not None:
+            self._remove_hibernation_file()
+        if self._status_after_id is not None:
+            self.after_cancel(self._status_after_id)
+            self._status_after_id = None
+
+    # error is None or an (exception, traceback_string) tuple
+    def _loading_done(self, error):
+        self._loader = None
+        if error is not None:
+            exception, traceback_string = error
+            log.error("reading '%s' failed\n%s", self.path, traceback_string)
+            utils.errordialog(type(exception).__name__, "Opening failed!",
+                              traceback_string)
+            if self in self.master.tabs:
+                self.master.close_tab(self)
+            else:
+                self.destroy()
+            return
+
+        self.textwidget['state'] = 'normal'
+        self.textwidget['undo'] = True
+        self.textwidget.edit_reset()
+        self.textwidget._content_changed_enabled = True
+        self.textwidget.event_generate('<<ContentChanged>>')
+        self.mark_saved()
+        self._update_status()
+        self.event_generate('<<Loaded>>')
+
+    @property
+    def hibernated(self):
+        """True after :meth:`hibernate` until :meth:`wake_up` is called."""
+        return (self._hibernation is not None)
+
+    def hibernate(self):
+        """Move the content of the tab from memory to a file.
+
+        The content is compressed and written to a file in
+        Porcupine's cache directory, and the :attr:`textwidget` is
+        emptied. This frees the memory used by the text, its tags and
+        the undo history, but the undo history is lost. The cursor
+        position and the scrolling are remembered.
+
+        The tab stays in the tab manager and :meth:`is_saved` keeps
+        working, but :meth:`wake_up` must be called before doing
+        anything else with the tab. Saving and selecting the tab does
+        that automatically. Returns False if the tab can't be hibernated
+        right now because it's :attr:`loading` or being saved, and True
+        otherwise.
+        """
+        if self._hibernation is not None:
+            return True
+        if self._loader is not None or self._saving:
+            return False
+
+        content = self.textwidget.get('1.0', 'end - 1 char')
+        fd, blob_path = tempfile.mkstemp(suffix='.zlib',
+                                         dir=_get_hibernation_dir())
+        try:
+            with open(fd, 'wb') as file:
+                # fast compression is good enough for source code
+                file.write(zlib.compress(
+                    content.encode('utf-8', errors='surrogatepass'), 1))
+        except OSError:
+            log.exception("hibernating '%s' failed", self.path)
+            os.remove(blob_path)
+            return False
+
+        self._hibernation = types.SimpleNamespace(
+            blob_path=blob_path,
+            is_saved=self.is_saved(),
+            cursor_pos=self.textwidget.index('insert'),
+            scroll_fraction=self.textwidget.yview()[0],
+            state=self.textwidget['state'],
+        )
+
+        # plugins must not see the emptying as a change of content
+        self.textwidget._content_changed_enabled = False
+        self.textwidget['state'] = 'normal'
+        self.textwidget.delete('1.0', 'end')
+        self.textwidget.edit_reset()
+        self.textwidget['state'] = 'disabled'
+        log.debug("hibernated '%s' to '%s'", self.path, blob_path)
+        return True
+
+    def wake_up(self):
+        """Undo a :meth:`hibernate` call.
+
+        This does nothing if the tab is not :attr:`hibernated`.
+        """
+        if self._hibernation is None:
+            return
+
+        hibernation = self._hibernation
+        with open(hibernation.blob_path, 'rb') as file:
+            content = zlib.decompress(file.read()).decode(
+                'utf-8', errors='surrogatepass')
+        self._remove_hibernation_file()
+        self._hibernation = None
+
+        self.textwidget['state'] = 'normal'
+        self.textwidget.insert('1.0', content)
+        self.textwidget.edit_reset()
+        self.textwidget['state'] = hibernation.state
+        self.textwidget.mark_set('insert', hibernation.cursor_pos)
+        self.textwidget.yview_moveto(hibernation.scroll_fraction)
+        self.textwidget._content_changed_enabled = True
+        if hibernation.is_saved:
+            self._saved_revision = self._revision
+
+        # tags like syntax highlighting must be added again
+        self.textwidget.event_generate('<<ContentChanged>>')
+        self._update_status()
+        self.event_generate('<<WokeUp>>')
+
+    def _on_change(self, start, end, new_text):
+        self._revision += 1
+
+    def _remove_hibernation_file(self):
+        try:
+            os.remove(self._hibernation.blob_path)
+        except OSError:
+            log.exception("cannot remove '%s'", self._hibernation.blob_path)
 
     def equivalent(self, other):
         """Return True if *self* and *other* are saved to the same place.
@@ -688,44 +1275,82 @@ bers.py>` use this attribute.
         This method overrides :meth:`Tab.can_be_closed` and returns
         False if other is not a FileTab or the path of at least one of
         the tabs is None. If neither path is None, this returns True if
-        the paths point to the same file. This way, it's possible to
-        have multiple "New File" tabs.
+        the paths point to the same file, or if the paths are the same
+        and one of the files doesn't exist anymore. This way, it's
+        possible to have multiple "New File" tabs.
         """
         # this used to have hasattr(other, "path") instead of isinstance
         # but it screws up if a plugin defines something different with
         # a path attribute, for example, a debugger plugin might have
         # tabs that represent files and they might need to be opened at
         # the same time as FileTabs are
-        return (isinstance(other, FileTab) and
+        if not (isinstance(other, FileTab) and
                 self.path is not None and
-                other.path is not None and
-                os.path.samefile(self.path, other.path))
-
-    def _get_hash(self):
-        # superstitious omg-optimization
-        config = settings.get_section('General')
-        encoding = config['encoding']
+                other.path is not None):
+            return False
+        try:
+            return os.path.samefile(self.path, other.path)
+        except OSError:
+            # the file was deleted or renamed by another program
+            return (os.path.normcase(os.path.abspath(self.path)) ==
+                    os.path.normcase(os.path.abspath(other.path)))
+
+    def _get_equivalence_key(self):
+        # os.path.samefile() compares these
+        if self.path is None:
+            return None
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            # equivalent() handles this
+            return None
+        return (stat.st_dev, stat.st_ino)
 
+    # this doesn't use tkinter, so save() calls this in a thread
+    @staticmethod
+    def _hash_chunks(chunks):
         result = hashlib.md5()
-        for chunk in self.textwidget.iter_chunks():
-            chunk = chunk.encode(encoding, errors='replace')
-            result.update(chunk)
+        for chunk in chunks:
+            # this doesn't use self.encoding because the hash is just
+            # for noticing changes, and utf-8 with surrogatepass can
+            # encode everything that Tk gives us without losing anything
+            result.update(chunk.encode('utf-8', errors='surrogatepass'))
 
         # hash objects don't define an __eq__ so we need to use a string
         # representation of the hash
         return result.hexdigest()
 
+    def _get_hash(self):
+        return self._hash_chunks(self.textwidget.iter_chunks())
+
     def mark_saved(self):
         """Make :meth:`is_saved` return True."""
+        self.wake_up()
         self._save_hash = self._get_hash()
+        self._saved_revision = self._revision
         self._update_title()      # TODO: add a virtual event for this?
 
-    def is_saved(self):
+    def is_saved(self, *, quick=False):
         """Return False if the text has changed since previous save.
 
         This is set to False automagically when the content is modified.
-        Use :meth:`mark_saved` to set this to True.
+        Use :meth:`mark_saved` to set this to True. This is always True
+        while the tab is :attr:`loading`.
+
+        Undoing all changes after saving makes this return True again,
+        and that's done by comparing a hash of the whole content with
+        the hash from the previous save. If *quick* is True, that's
+        skipped and False is returned if the content has changed in any
+        way, which is much faster for big files.
         """
+        if self._loader is not None:
+            return True
+        if self._hibernation is not None:
+            return self._hibernation.is_saved
+        if self._revision == self._saved_revision:
+            return True
+        if quick:
+            return False
         return self._get_hash() == self._save_hash
 
     @property
@@ -773,15 +1398,30 @@ bers.py>` use this attribute.
             text = '*' + text + '*'
         self.title = text
 
+    # the cursor moves after almost every key press, and this would
+    # run several times for each key press without after_idle
     def _update_status(self, junk=None):
+        if self._status_after_id is None:
+            self._status_after_id = self.after_idle(self._do_update_status)
+
+    def _do_update_status(self):
+        self._status_after_id = None
         if self.path is None:
             start = "New file"
         else:
             start = "File '%s'" % self.path
-        line, column = self.textwidget.index('insert').split('.')
+        if self._hibernation is None:
+            cursor_pos = self.textwidget.index('insert')
+        else:
+            cursor_pos = self._hibernation.cursor_pos
+        line, column = cursor_pos.split('.')
 
-        self.status = "%s, %s\tLine %s, column %s" % (
-            start, self.filetype.name, line, column)
+        start = "%s, %s, %s" % (start, self.filetype.name, self.encoding)
+        if self._loader is None:
+            self.status = "%s\tLine %s, column %s" % (start, line, column)
+        else:
+            self.status = "%s\tLoading... %d%%" % (
+                start, self._loader.progress * 100)
 
     def can_be_closed(self):
         """
@@ -806,67 +1446,161 @@ bers.py>` use this attribute.
             # cancel
             return False
         if answer:
-            # yes
-            return self.save()
+            # yes, and the file must be saved before the tab is closed
+            return self.save(blocking=True)
         # no was clicked, can be closed
         return True
 
     # TODO: document the overriding
     def on_focus(self):
+        self.wake_up()
         self.textwidget.focus()
 
     # TODO: returning None on errors kinda sucks
-    def save(self):
+    def save(self, *, blocking=False):
         """Save the file to the current :attr:`path`.
 
         This calls :meth:`save_as` if :attr:`path` is None, and returns
-        False if the user cancels the save as dialog. None is returned
-        on errors, and True is returned in all other cases. In other
-        words, this returns True if saving succeeded.
+        False if the user cancels the save as dialog.
+
+        The content of the text widget is copied, and the copy is
+        encoded and written with :func:`porcupine.utils.atomic_open` in
+        another thread, so the user can keep typing while the file is
+        being saved. When the thread is done, :meth:`is_saved` starts
+        returning True if the content hasn't changed since it was
+        copied, and errors are shown to the user with an error dialog.
+        This returns True in this case.
+
+        If *blocking* is True, the file is written without a thread
+        and this returns True if saving succeeded and None on errors.
 
         .. seealso:: The :virtevt:`Save` event.
         """
+        self.wake_up()
         if self.path is None:
-            return self.save_as()
+            return self.save_as(blocking=blocking)
+        if self._loader is not None:
+            # saving a half-loaded file would destroy the rest of it
+            log.info("not saving '%s' because it's still loading",
+                     self.path)
+            return None
+        if self._saving and not blocking:
+            # the content may have changed after the running save
+            # copied it, so it needs to be saved again after that
+            self._save_again = True
+            return True
 
         self.event_generate('<<Save>>')
 
-        encoding = settings.get_section('General')['encoding']
-        try:
-            with utils.backup_open(self.path, 'w', encoding=encoding) as f:
-                for chunk in self.textwidget.iter_chunks():
-                    f.write(chunk)
-        except (OSError, UnicodeError) as e:
-            log.exception("saving '%s' failed", self.path)
-            utils.errordialog(type(e).__name__, "Saving failed!",
-                              traceback.format_exc())
-            return None
+        path = self.path
+        encoding = self.encoding
+        content = self.textwidget.get('1.0', 'end - 1 char')
+        save_number = next(self._save_counter)
+        self._latest_saves[path] = save_number
+        revision = self._revision
+
+        # returns (error_type_name, traceback_string), (None, hash) or
+        # (None, None) if a newer save has written the file already
+        def write():
+            with self._write_lock:
+                if self._latest_saves[path] != save_number:
+                    return (None, None)
+                try:
+                    with utils.atomic_open(path, 'w',
+                                           encoding=encoding) as f:
+                        f.write(content)
+                        f.flush()
+                        # this is recorded before atomic_open() moves
+                        # the file to the path, so the change that the
+                        # filewatcher plugin sees is never unknown
+                        stat = os.fstat(f.fileno())
+                        self._written_stats[path] = (stat.st_mtime_ns,
+                                                     stat.st_size)
+                except (OSError, UnicodeError) as e:
+                    return (type(e).__name__, traceback.format_exc())
+                return (None, self._hash_chunks([content]))
+
+        def done(success, result):
+            if success:
+                error_name, hash_or_traceback = result
+            else:
+                # write() should catch everything, but who knows...
+                error_name, hash_or_traceback = ('Error', result)
+
+            if error_name is not None:
+                log.error("saving '%s' failed\n%s", path, hash_or_traceback)
+                utils.errordialog(error_name, "Saving failed!",
+                                  hash_or_traceback)
+                return None
+
+            # the content may have changed while the thread was running,
+            # so this doesn't use mark_saved()
+            if hash_or_traceback is not None:
+                self._save_hash = hash_or_traceback
+                self._saved_revision = revision
+            if self.winfo_exists():     # the tab may have been closed
+                self._update_title()
+                if self._save_again:
+                    self._save_again = False
+                    self.save()
+            return True
 
-        self.mark_saved()
+        if blocking:
+            return done(True, write())
+
+        def thread_done(success, result):
+            self._saving = False
+            done(success, result)
+
+        self._saving = True
+        utils.run_in_thread(write, thread_done)
         return True
 
-    def save_as(self):
+    def is_own_write(self, path, stat):
+        """Check if a file was written by :meth:`save` of this tab.
+
+        *stat* should be a result of :func:`os.stat` or :func:`os.fstat`
+        for *path*. This returns True if nothing has modified the file
+        after this tab saved it there. If a save is running, this waits
+        for it to finish.
+
+        This method doesn't use tkinter, so it can be called from other
+        threads.
+        """
+        with self._write_lock:
+            return (self._written_stats.get(path) ==
+                    (stat.st_mtime_ns, stat.st_size))
+
+    def save_as(self, *, blocking=False):
         """Ask the user where to save the file and save it there.
 
-        Returns True if the file was saved, and False if the user
-        cancelled the dialog.
+        Returns False if the user cancelled the dialog, and otherwise
+        the same thing as :meth:`save` with the *blocking* argument.
         """
         path = _dialogs.save_as(self.path)
         if path is None:
             return False
         self.path = path
-        self.save()
-        return True
+        return self.save(blocking=blocking)
 
     def get_state(self):
-        return (self.path, self.textwidget.index('insert'))
+        if self._hibernation is None:
+            cursor_pos = self.textwidget.index('insert')
+        else:
+            cursor_pos = self._hibernation.cursor_pos
+        return (self.path, cursor_pos, self.encoding)
 
     @classmethod
     def from_state(cls, manager, state):
-        path, cursor_pos = state
-        tab = cls.open_file(manager, path)
-        tab.textwidget.mark_set('insert', cursor_pos)
-        tab.textwidget.see('insert')
+        # older porcupines didn't have the encoding in the state
+        path, cursor_pos, *encoding = state
+        tab = cls.open_file(manager, path, *encoding)
+
+        def on_loaded(event):
+            tab.textwidget.mark_set('insert', cursor_pos)
+            tab.textwidget.see('insert')
+
+        tab.bind('<<Loaded>>', on_loaded, add=True)
         return tab
 
 
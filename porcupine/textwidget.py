@@ -7,6 +7,95 @@ import pygments.styles
 from porcupine import settings, utils
 
 
+# the widget command of each HandyText is replaced with a proc that runs
+# this code, so that the change callbacks run for all changes, even the
+# ones done by Tk's bindings and undo
+#
+# 'insert' and 'delete' to the end of the text are special cased the
+# same way as Tk does it, see text(3tk) and DeleteIndexRange() in
+# tkText.c, and other complicated cases notify about the whole content
+_WIDGET_COMMAND_TCL = r'''
+set orig {%(orig)s}
+set subcommand [lindex $args 0]
+if {$subcommand ni {insert delete replace} ||
+        [$orig cget -state] eq "disabled"} {
+    return [$orig {*}$args]
+}
+
+if {$subcommand eq "insert"} {
+    set start [$orig index [lindex $args 1]]
+    if {[$orig compare $start == end]} {
+        set start [$orig index "end - 1 char"]
+    }
+    set text ""
+    foreach {chars tags} [lrange $args 2 end] {
+        append text $chars
+    }
+    set result [$orig {*}$args]
+    %(callback)s $start $start $text
+    return $result
+}
+
+if {[llength $args] > 3 && $subcommand eq "delete"} {
+    set old_end [$orig index "end - 1 char"]
+    set result [$orig {*}$args]
+    %(callback)s 1.0 $old_end [$orig get 1.0 "end - 1 char"]
+    return $result
+}
+
+set start [$orig index [lindex $args 1]]
+if {[llength $args] == 2} {
+    set end [$orig index "$start + 1 char"]
+} else {
+    set end [$orig index [lindex $args 2]]
+}
+
+if {[$orig compare $end == end]} {
+    if {$subcommand eq "replace"} {
+        set old_end [$orig index "end - 1 char"]
+        set result [$orig {*}$args]
+        %(callback)s 1.0 $old_end [$orig get 1.0 "end - 1 char"]
+        return $result
+    }
+
+    # the last newline can't be deleted, tk deletes the one before the
+    # first deleted character instead if that's at the start of a line
+    set end [$orig index "end - 1 char"]
+    if {[$orig compare $start < $end] &&
+            [$orig compare $start > 1.0] &&
+            [$orig compare $start == "$start linestart"]} {
+        set start [$orig index "$start - 1 char"]
+    }
+}
+if {$subcommand eq "delete" && [$orig compare $start >= $end]} {
+    return [$orig {*}$args]
+}
+
+set text ""
+foreach {chars tags} [lrange $args 3 end] {
+    append text $chars
+}
+set result [$orig {*}$args]
+%(callback)s $start $end $text
+return $result
+'''
+
+
+def apply_change(lines, start, end, new_text):
+    """Do a change of :meth:`HandyText.add_change_callback` to a list.
+
+    *lines* must be a list of the lines of the content without ``\n``
+    characters, e.g. ``content.split('\n')``. It's modified in-place.
+    This is useful for keeping a copy of a text widget's content up to
+    date in another thread or process.
+    """
+    start_line, start_column = map(int, start.split('.'))
+    end_line, end_column = map(int, end.split('.'))
+    before = lines[start_line - 1][:start_column]
+    after = lines[end_line - 1][end_column:]
+    lines[start_line - 1:end_line] = (before + new_text + after).split('\n')
+
+
 class HandyText(tk.Text):
     """Like ``tkinter.Text``, but with some handy features.
 
@@ -26,6 +115,9 @@ class HandyText(tk.Text):
             ``<<ContentChanged>>`` implementation, and
             ``<<ContentChanged>>`` is easier to use in general.
 
+        .. seealso::
+            :meth:`add_change_callback` tells what exactly changed.
+
     .. virtualevent:: CursorMoved
 
         This event is generated every time the user moves the cursor or
@@ -48,12 +140,82 @@ class HandyText(tk.Text):
 
         self._modified_id = self.bind('<<Modified>>', self._do_modified)
 
+        self._change_callbacks = []
+        self._orig_command = self._w + '_handytext_orig'
+        self.tk.call('rename', self._w, self._orig_command)
+        self.tk.call('proc', self._w, 'args', _WIDGET_COMMAND_TCL % {
+            'orig': self._orig_command,
+            'callback': self.register(self._run_change_callbacks),
+        })
+
+        # tabs.FileTab sets this to False while it's loading a file or
+        # hibernated, it generates one <<ContentChanged>> when it's done
+        self._content_changed_flag = True
+        self._end_when_disabled = None
+
+    # the change callbacks don't run while this is False, and when it's
+    # set back to True, they are told that everything changed
+    @property
+    def _content_changed_enabled(self):
+        return self._content_changed_flag
+
+    @_content_changed_enabled.setter
+    def _content_changed_enabled(self, enabled):
+        if enabled == self._content_changed_flag:
+            return
+        self._content_changed_flag = enabled
+        if enabled:
+            self._run_change_callbacks(
+                '1.0', self._end_when_disabled,
+                self.get('1.0', 'end - 1 char'))
+        else:
+            self._end_when_disabled = self.index('end - 1 char')
+
+    def destroy(self):
+        super().destroy()
+        # tk deleted the original widget command, but not the proc
+        self.tk.call('rename', self._w, '')
+
+    def add_change_callback(self, callback):
+        """Run ``callback(start, end, new_text)`` when the text changes.
+
+        *start* and *end* are indexes like ``'12.34'``, and they are the
+        start and end of the text that was replaced with *new_text* in
+        the content as it was *before* the change. Inserting text is
+        a change where *start* and *end* are equal, and deleting is a
+        change where *new_text* is ``''``. The callback runs after the
+        change has been done.
+
+        The callbacks run for all changes, including changes done by
+        Tk's key bindings and undo. This is useful for keeping something
+        up to date incrementally, because looking at the whole content
+        after every change would be slow with big files. Use
+        :virtevt:`ContentChanged` if you don't need to know what
+        changed.
+
+        While a :class:`porcupine.tabs.FileTab` is loading or
+        :meth:`hibernated <porcupine.tabs.FileTab.hibernate>`, the
+        callbacks don't run. When that's over, they are called with the
+        whole old and new content as the change.
+        """
+        self._change_callbacks.append(callback)
+
+    def remove_change_callback(self, callback):
+        """Undo an :meth:`add_change_callback` call."""
+        self._change_callbacks.remove(callback)
+
+    def _run_change_callbacks(self, start, end, new_text):
+        if self._content_changed_flag:
+            for callback in self._change_callbacks:
+                callback(start, end, new_text)
+
     def _do_modified(self, event):
         # this runs recursively if we don't unbind
         self.unbind('<<Modified>>', self._modified_id)
         self.edit_modified(False)
         self._modified_id = self.bind('<<Modified>>', self._do_modified)
-        self.event_generate('<<ContentChanged>>')
+        if self._content_changed_enabled:
+            self.event_generate('<<ContentChanged>>')
         self.cursor_has_moved()
 
     def cursor_has_moved(self):
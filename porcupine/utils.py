@@ -10,6 +10,7 @@ import platform
 import shutil
 import subprocess
 import sys
+import tempfile
 import threading
 import tkinter
 from tkinter import ttk
@@ -327,6 +328,27 @@ def copy_bindings(widget1, widget2):
         widget2.tk.call('bind', widget2, sequence, '+' + tcl_command)
 
 
+def bind_before_class(widget, tag_widget):
+    """Make the bindings of *tag_widget* run before *widget*'s class bindings.
+
+    This changes the ``bindtags()`` of *widget*. The bindings of the
+    widget itself run first like they usually do, and the bindings of
+    *tag_widget* run after them, but before the bindings of the
+    widget's class. If a binding of *tag_widget* returns ``'break'``,
+    the class bindings don't run.
+
+    For example, ``bind_before_class(textwidget,
+    porcupine.get_main_window())`` does the same thing as
+    :func:`copy_bindings`, but it's faster because nothing is bound to
+    the text widget and the main window's bindings are never copied.
+    Bindings that are added to the main window later work too.
+    """
+    tag = str(tag_widget)
+    tags = [other_tag for other_tag in widget.bindtags() if other_tag != tag]
+    tags.insert(tags.index(str(widget)) + 1, tag)
+    widget.bindtags(tags)
+
+
 # see docs/utils.rst for explanation and docs
 try:
     Spinbox = ttk.Spinbox
@@ -506,6 +528,65 @@ def backup_open(path, *args, **kwargs):
         yield open(path, *args, **kwargs)
 
 
+# os.umask() can only be read by setting it, and that's not thread-safe,
+# so it's done here when nothing else is running yet
+_umask = os.umask(0)
+os.umask(_umask)
+
+
+@contextlib.contextmanager
+def atomic_open(path, mode='w', **kwargs):
+    """Like :func:`open`, but the file is replaced all at once.
+
+    Use this as a context manager when overwriting the user's files::
+
+        try:
+            with utils.atomic_open(cool_file, 'w') as file:
+                ...
+        except (UnicodeError, OSError):
+            # log the error and report it to the user
+
+    Everything is written to a temporary file in the same directory
+    first. If the ``with`` block succeeds, the temporary file is flushed
+    to the disk and moved over *path* with :func:`os.replace`, which
+    is atomic. Otherwise the temporary file is deleted and *path* is
+    left untouched. Unlike :func:`backup_open`, this never copies the
+    old content of the file.
+
+    This function doesn't use tkinter, so it can be called from other
+    threads.
+    """
+    # symlinks should keep pointing to the saved file, so the file that
+    # the symlink points to is replaced instead of the symlink itself
+    path = os.path.realpath(path)
+    directory, basename = os.path.split(path)
+    fileno, temp_path = tempfile.mkstemp(
+        dir=directory, prefix=('.' + basename + '.'), suffix='.tmp')
+
+    try:
+        # mkstemp() creates the file with 0o600 permissions
+        if os.path.exists(path):
+            shutil.copymode(path, temp_path)
+        else:
+            os.chmod(temp_path, 0o666 & ~_umask)
+
+        with open(fileno, mode, **kwargs) as file:
+            fileno = None       # the file object closes it now
+            yield file
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, path)
+
+    except BaseException as e:
+        if fileno is not None:
+            os.close(fileno)
+        try:
+            os.remove(temp_path)
+        except FileNotFoundError:
+            pass
+        raise e
+
+
 if __name__ == '__main__':
     import doctest
     print(doctest.testmod())
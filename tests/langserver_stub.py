@@ -0,0 +1,123 @@
+"""A tiny language server for testing the langserver plugin.
+
+The server keeps track of the opened files like a real server would,
+and after every change it publishes a diagnostic whose message is the
+whole content of the file as the server sees it. Completions and
+definitions are hard-coded.
+
+Run this with ``python langserver_stub.py [full]``. Incremental sync is
+used by default, and ``full`` makes the server ask for the whole content
+on every change. The exit code is 2 if the client sends something that
+isn't valid JSON-RPC 2.0.
+"""
+
+import json
+import sys
+
+COMPLETION_ITEMS = [
+    {'label': 'foobar', 'sortText': 'b'},
+    {'label': 'foo_label', 'sortText': 'a', 'insertText': 'foo_insert'},
+    {'label': 'unrelated'},
+]
+DEFINITION_URI = 'file:///tmp/the%20definition.py'
+
+
+def read_message(file):
+    headers = {}
+    while True:
+        line = file.readline()
+        if not line:
+            return None
+        line = line.strip()
+        if not line:
+            break
+        name, value = line.decode('ascii').split(':', 1)
+        headers[name.strip().lower()] = value.strip()
+    content = file.read(int(headers['content-length']))
+    return json.loads(content.decode('utf-8'))
+
+
+def send_message(file, message):
+    message['jsonrpc'] = '2.0'
+    content = json.dumps(message).encode('utf-8')
+    header = 'Content-Length: %d\r\n\r\n' % len(content)
+    file.write(header.encode('ascii') + content)
+    file.flush()
+
+
+def apply_change(lines, change):
+    if 'range' not in change:
+        lines[:] = change['text'].split('\n')
+        return
+    start = change['range']['start']
+    end = change['range']['end']
+    before = lines[start['line']][:start['character']]
+    after = lines[end['line']][end['character']:]
+    lines[start['line']:end['line'] + 1] = (
+        before + change['text'] + after).split('\n')
+
+
+def publish_content(output, uri, lines):
+    send_message(output, {
+        'method': 'textDocument/publishDiagnostics',
+        'params': {'uri': uri, 'diagnostics': [{
+            'range': {'start': {'line': 0, 'character': 0},
+                      'end': {'line': 0, 'character': 3}},
+            'severity': 1,
+            'message': '\n'.join(lines),
+        }]},
+    })
+
+
+def main():
+    sync_kind = 1 if sys.argv[1:] == ['full'] else 2
+    input_file = sys.stdin.buffer
+    output = sys.stdout.buffer
+    documents = {}      # {uri: lines}
+
+    while True:
+        message = read_message(input_file)
+        if message is None:
+            sys.exit(1)
+        if message.get('jsonrpc') != '2.0' or message.get(
+                'params', {}) is None:
+            sys.exit(2)
+
+        method = message.get('method')
+        params = message.get('params')
+        if method == 'initialize':
+            send_message(output, {'id': message['id'], 'result': {
+                'capabilities': {'textDocumentSync': {'change': sync_kind}},
+            }})
+        elif method == 'textDocument/didOpen':
+            document = params['textDocument']
+            documents[document['uri']] = document['text'].split('\n')
+            publish_content(output, document['uri'],
+                            documents[document['uri']])
+        elif method == 'textDocument/didChange':
+            uri = params['textDocument']['uri']
+            for change in params['contentChanges']:
+                apply_change(documents[uri], change)
+            publish_content(output, uri, documents[uri])
+        elif method == 'textDocument/didClose':
+            del documents[params['textDocument']['uri']]
+        elif method == 'textDocument/completion':
+            send_message(output, {'id': message['id'], 'result': {
+                'isIncomplete': False, 'items': COMPLETION_ITEMS}})
+        elif method == 'textDocument/definition':
+            send_message(output, {'id': message['id'], 'result': [{
+                'targetUri': DEFINITION_URI,
+                'targetRange': {'start': {'line': 4, 'character': 0},
+                                'end': {'line': 6, 'character': 0}},
+                'targetSelectionRange': {
+                    'start': {'line': 4, 'character': 4},
+                    'end': {'line': 4, 'character': 7}},
+            }]})
+        elif method == 'shutdown':
+            send_message(output, {'id': message['id'], 'result': None})
+        elif method == 'exit':
+            sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,282 @@
+import operator
+import os
+import re
+import shlex
+import sys
+import time
+import types
+
+import pytest
+
+from porcupine.plugins import langserver
+
+STUB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         'langserver_stub.py')
+PYTHON = types.SimpleNamespace(name='Python')
+
+
+class FakeMainWindow:
+
+    def __init__(self):
+        self._callbacks = []
+
+    def after(self, ms, callback, *args):
+        self._callbacks.append((callback, args))
+        return 'after#%d' % len(self._callbacks)
+
+    def update(self):
+        callbacks = self._callbacks
+        self._callbacks = []
+        for callback, args in callbacks:
+            callback(*args)
+
+
+class FakeText:
+    """Just enough of a text widget for the langserver plugin."""
+
+    def __init__(self, content, cursor):
+        self.content = content
+        self.cursor = cursor
+        self.tags = []
+
+    def index(self, index):
+        lines = self.content.split('\n')
+        if index == 'insert':
+            return self.cursor
+        if index == 'end - 1 char':
+            return '%d.%d' % (len(lines), len(lines[-1]))
+        return index
+
+    def get(self, start, end):
+        if (start, end) == ('insert linestart', 'insert'):
+            line, column = map(int, self.cursor.split('.'))
+            return self.content.split('\n')[line - 1][:column]
+        assert (start, end) == ('1.0', 'end - 1 char')
+        return self.content
+
+    def compare(self, index1, op, index2):
+        def key(index):
+            return tuple(map(int, self.index(index).split('.')))
+        function = {'<': operator.lt, '<=': operator.le, '==': operator.eq,
+                    '>=': operator.ge, '>': operator.gt}[op]
+        return function(key(index1), key(index2))
+
+    def tag_add(self, tag, start, end):
+        self.tags.append((tag, start, end))
+
+    def tag_remove(self, tag, start, end):
+        self.tags = [tag_tuple for tag_tuple in self.tags
+                     if tag_tuple[0] != tag]
+
+
+class FakeTab:
+
+    def __init__(self, textwidget, path):
+        self.textwidget = textwidget
+        self.path = path
+        self.status = ''
+
+
+def wait_until(main_window, condition, timeout=10):
+    end = time.time() + timeout
+    while not condition():
+        assert time.time() < end, "timed out"
+        main_window.update()
+        time.sleep(0.01)
+
+
+def server_content(server, tab):
+    # the stub server sends its view of the file as a diagnostic message
+    diagnostics = server._diagnostics.get(server.get_uri(tab))
+    return diagnostics[0]['message'] if diagnostics else None
+
+
+@pytest.fixture
+def main_window(monkeypatch):
+    window = FakeMainWindow()
+    monkeypatch.setattr(langserver, 'get_main_window', lambda: window)
+    return window
+
+
+def start_server(main_window, *args):
+    server = langserver._LangServer(
+        PYTHON, [sys.executable, STUB_PATH] + list(args))
+    wait_until(main_window, lambda: server._initialized)
+    return server
+
+
+def stop_server(main_window, server):
+    server.shut_down()
+    wait_until(main_window, lambda: not server.running)
+    # the stub exits with 2 if it gets invalid json-rpc, e.g. "params": null
+    assert server._process.wait() == 0
+
+
+def create_tab(content, cursor='1.0', path='/tmp/test file.py'):
+    return FakeTab(FakeText(content, cursor), path)
+
+
+def test_initialize_and_did_open(main_window):
+    server = start_server(main_window)
+    assert server._sync_kind == 2
+
+    tab = create_tab('hello\nworld')
+    server.open_tab(tab)
+    assert server.get_uri(tab).startswith('file:///')
+    assert server.get_uri(tab).endswith('/test%20file.py')
+    wait_until(main_window, lambda: server_content(server, tab) is not None)
+    assert server_content(server, tab) == 'hello\nworld'
+
+    server.close_tab(tab)
+    assert server.get_uri(tab) is None
+    stop_server(main_window, server)
+
+
+@pytest.mark.parametrize('sync_args', [[], ['full']])
+def test_did_change(main_window, sync_args):
+    server = start_server(main_window, *sync_args)
+    tab = create_tab('hello\nworld')
+    server.open_tab(tab)
+
+    # these are like the arguments of change callbacks
+    changes = [
+        ('1.5', '1.5', ' there'),     # insert
+        ('1.0', '1.1', 'J'),          # replace
+        ('1.11', '2.1', ''),          # delete a newline
+        ('1.0', '1.0', 'a\nb\n'),     # insert lines
+    ]
+    expected = ['hello there\nworld', 'Jello there\nworld',
+                'Jello thereorld', 'a\nb\nJello thereorld']
+    for change, content in zip(changes, expected):
+        tab.textwidget.content = content
+        server.on_change(tab, *change)
+        wait_until(main_window,
+                   lambda: server_content(server, tab) == content)
+
+    stop_server(main_window, server)
+
+
+def test_completion(main_window):
+    server = start_server(main_window)
+    tab = create_tab('x = foo', cursor='1.7')
+    server.open_tab(tab)
+
+    future = server.complete(tab)
+    wait_until(main_window, future.done)
+    # sorted by sortText, insertText is used instead of the label if
+    # it's given, and items that don't match the prefix are ignored
+    assert future.result() == ['_insert', 'bar']
+
+    # cancelling must not break anything
+    server.complete(tab).cancel()
+    future = server.complete(tab)
+    wait_until(main_window, future.done)
+    assert future.result() == ['_insert', 'bar']
+
+    stop_server(main_window, server)
+
+
+def test_definition(main_window, monkeypatch):
+    opened = []
+    monkeypatch.setattr(langserver, '_open_location',
+                        lambda *args: opened.append(args))
+
+    server = start_server(main_window)
+    tab = create_tab('import thing\nthing.func()', cursor='2.8')
+    server.open_tab(tab)
+    server.go_to_definition(tab)
+    wait_until(main_window, lambda: opened)
+    assert opened == [(langserver._uri_to_path(
+        'file:///tmp/the%20definition.py'), 5, 4)]
+    assert opened[0][0].endswith('the definition.py')
+
+    stop_server(main_window, server)
+
+
+def test_diagnostics(main_window):
+    server = start_server(main_window)
+    tab = create_tab('hello\nworld', cursor='1.1')
+    server.open_tab(tab)
+    wait_until(main_window, lambda: tab.textwidget.tags)
+    assert tab.textwidget.tags == [('langserver_error', '1.0', '1.3')]
+    assert server.get_diagnostic_message(tab) == 'hello\nworld'
+
+    tab.textwidget.cursor = '2.2'
+    assert server.get_diagnostic_message(tab) is None
+
+    stop_server(main_window, server)
+
+
+def test_save_as_keeps_server(main_window, monkeypatch):
+    monkeypatch.setattr(langserver, '_servers', {})
+    command = ' '.join(map(shlex.quote, [sys.executable, STUB_PATH]))
+    tab = create_tab('hello', path='/tmp/old.py')
+    tab.loading = False
+    tab.filetype = types.SimpleNamespace(name='Python',
+                                         langserver_command=command)
+
+    langserver._update_tab(tab)
+    server = langserver._find_server(tab)
+    wait_until(main_window, lambda: server._initialized)
+
+    # save as generates <<PathChanged>> and then <<FiletypeChanged>>
+    tab.path = '/tmp/new.py'
+    langserver._update_tab(tab)
+    langserver._update_tab(tab)
+    assert langserver._find_server(tab) is server
+    assert server.running
+    assert server.get_uri(tab).endswith('/new.py')
+    wait_until(main_window, lambda: server_content(server, tab) == 'hello')
+
+    langserver._close_tab(tab)
+    assert langserver._servers == {}
+    wait_until(main_window, lambda: not server.running)
+    assert server._process.wait() == 0
+
+
+def test_null_initialize_result():
+    server = types.SimpleNamespace(_notify=lambda *args: None, _tabs={})
+    langserver._LangServer._on_initialized(server, None, None)
+    assert server._sync_kind == 0 and server._initialized
+
+
+def test_change_callbacks(monkeypatch):
+    # this needs a display because HandyText is a real Tk widget
+    tkinter = pytest.importorskip('tkinter')
+    try:
+        root = tkinter.Tk()
+    except tkinter.TclError as e:
+        pytest.skip("cannot create a Tk window: %s" % e)
+    root.withdraw()
+    monkeypatch.setattr(langserver, 'get_main_window', lambda: root)
+
+    from porcupine.textwidget import HandyText
+    try:
+        server = start_server(root)
+        textwidget = HandyText(root)
+        textwidget.insert('1.0', 'hello\nworld\n')
+        tab = FakeTab(textwidget, '/tmp/test.py')
+        server.open_tab(tab)
+        textwidget.add_change_callback(
+            lambda *change: server.on_change(tab, *change))
+
+        textwidget.insert('1.5', ' there')
+        textwidget.delete('1.0', '1.1')
+        textwidget.replace('2.0', '2.5', 'WORLD\nagain')
+        textwidget.insert('end', 'the end')
+        textwidget.delete('1.0', 'end')
+        textwidget.insert('1.0', 'new\ncontent')
+        textwidget.delete('2.3', 'end')
+
+        content = textwidget.get('1.0', 'end - 1 char')
+        assert content == 'new\ncon'
+        wait_until(root, lambda: server_content(server, tab) == content)
+        stop_server(root, server)
+    finally:
+        root.destroy()
+
+
+def test_path_to_uri():
+    uri = langserver._path_to_uri('/tmp/a b/c.py')
+    assert re.fullmatch(r'file:///.*/a%20b/c\.py', uri)
+    assert langserver._uri_to_path(uri) == os.path.abspath('/tmp/a b/c.py')